@@ -1,13 +1,5 @@
-import logging
-import logging.handlers
-import socket
-from typing import Dict
-
-from cachetools import TTLCache
-
-from .settings import Settings
-
-cache: TTLCache = TTLCache(maxsize=1000, ttl=5)
-sp = socket.socketpair()
+# Keep this module free of side effects: it is imported by every autopeer
+# process, including the forked peer manager and configtest mode, so the
+# heavy dependencies (FastAPI, SQLAlchemy, gnupg, ...) are only pulled in
+# by the modules that actually need them.
 max_bytes = 8
-settings: Settings = Settings()
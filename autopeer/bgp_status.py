@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+from typing import Dict, List, Tuple
+
+from .logger import logger
+from .peer_cache import etag
+
+
+class BGPStatus:
+    """
+    Cache of the BGP neighbor state as reported by bgpd.
+    The cache is refreshed by a periodic `poll` that queries bgpd through its
+    restricted control socket, requests are only ever served from the cache.
+    """
+
+    def __init__(self, bgpctl: str, socket: str, timeout: float = 10) -> None:
+        self.bgpctl = bgpctl
+        self.socket = socket
+        self.timeout = timeout
+        self.peers: Dict[int, List[dict]] = {}
+        self.updated: float = 0
+        self.responses: Dict[int, Tuple[str, dict]] = {}
+
+    async def poll(self):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                self.bgpctl,
+                "-j",
+                "-s",
+                self.socket,
+                "show",
+                "neighbor",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await asyncio.wait_for(
+                proc.communicate(), timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            logger.error("Timed out querying bgpd neighbor state")
+            return
+        except Exception as e:
+            logger.error(f"Failed to query bgpd neighbor state: {e}")
+            return
+        if proc.returncode:
+            logger.error(f"Failed to query bgpd neighbor state: {stderr.decode()}")
+            return
+
+        try:
+            self.peers = self.parse(stdout)
+            self.updated = time.time()
+            self.responses = {}
+        except Exception as e:
+            logger.error(f"Failed to parse bgpd neighbor state: {e}")
+
+    @staticmethod
+    def parse(output: bytes) -> Dict[int, List[dict]]:
+        """
+        Parse the output of `bgpctl -j show neighbor` into a per ASN list of
+        compact session records.
+        """
+        peers: Dict[int, List[dict]] = {}
+        for neighbor in json.loads(output).get("neighbors", []):
+            try:
+                asn = int(neighbor["remote_as"])
+            except (KeyError, ValueError):
+                continue
+            prefixes = neighbor.get("stats", {}).get("prefixes", {})
+            peers.setdefault(asn, []).append(
+                {
+                    "remote_addr": neighbor.get("remote_addr"),
+                    "description": neighbor.get("description"),
+                    "state": neighbor.get("state"),
+                    "last_updown": neighbor.get("last_updown"),
+                    "last_updown_sec": neighbor.get("last_updown_sec"),
+                    "prefixes_received": prefixes.get("received"),
+                    "prefixes_sent": prefixes.get("sent"),
+                }
+            )
+        return peers
+
+    def get(self, asn: int) -> dict:
+        return {
+            "ASN": asn,
+            "updated": self.updated,
+            "sessions": self.peers.get(asn, []),
+        }
+
+    def tagged(self, asn: int) -> Tuple[str, dict]:
+        """
+        The state of the sessions of `asn` with its ETag, kept until the next
+        poll.
+        """
+        entry = self.responses.get(asn)
+        if entry is None:
+            body = self.get(asn)
+            entry = self.responses[asn] = (etag(int(self.updated), body), body)
+        return entry
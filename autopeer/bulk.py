@@ -0,0 +1,126 @@
+import shutil
+import sys
+import urllib.error
+import urllib.request
+from typing import AsyncIterator, Iterable, List, Tuple
+
+from pydantic import ValidationError
+
+from .schemas import PeerInfo
+from .validation import PeerValidator
+
+batch_size = 100
+
+
+async def read_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Split a stream of bytes into numbered NDJSON lines, skipping blank lines.
+    """
+    buf = b""
+    lineno = 0
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            lineno += 1
+            if line.strip():
+                yield lineno, line
+    if buf.strip():
+        yield lineno + 1, buf
+
+
+def parse_batch(
+    lines: Iterable[Tuple[int, bytes]],
+) -> Tuple[List[Tuple[str, PeerInfo]], List[str]]:
+    """
+    Parse a batch of NDJSON PeerInfo records.
+    Returns the labelled peers and an error message for every unparsable line.
+    """
+    peers = []
+    errors = []
+    for lineno, line in lines:
+        try:
+            peers.append((f"line {lineno}", PeerInfo.model_validate_json(line)))
+        except ValidationError as e:
+            errors.append(f"line {lineno}: {e.errors()[0]['msg']}")
+    return peers, errors
+
+
+async def read_peers(
+    chunks: AsyncIterator[bytes], validator: PeerValidator
+) -> Tuple[List[PeerInfo], List[str]]:
+    """
+    Read and validate NDJSON PeerInfo records in batches of `batch_size`.
+    """
+    peers: List[PeerInfo] = []
+    errors: List[str] = []
+    batch = []
+
+    def flush():
+        parsed, invalid = parse_batch(batch)
+        valid, conflicts = validator.validate_batch(parsed)
+        errors.extend(invalid)
+        errors.extend(conflicts)
+        peers.extend(valid)
+        batch.clear()
+
+    async for lineno, line in read_ndjson(chunks):
+        batch.append((lineno, line))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return peers, errors
+
+
+def admin_request(
+    config: dict, path: str, token: bytes, data=None
+) -> urllib.request.Request:
+    host = config.get("uvicorn", {}).get("host", "127.0.0.1")
+    port = config.get("uvicorn", {}).get("port", 8000)
+    if ":" in host:
+        host = f"[{host}]"
+    req = urllib.request.Request(
+        f"http://{host}:{port}/admin{path}",
+        data=data,
+        method="GET" if data is None else "POST",
+    )
+    req.add_header("X-DN42-Admin-Token", token.decode())
+    if data is not None:
+        req.add_header("Content-Type", "application/x-ndjson")
+    return req
+
+
+def import_file(config: dict, token: bytes, path: str) -> bool:
+    """
+    Stream an NDJSON file (or stdin for `-`) to the bulk import endpoint of a
+    running autopeer instance.
+    """
+    f = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        with urllib.request.urlopen(admin_request(config, "/import", token, f)) as r:
+            sys.stdout.write(r.read().decode() + "\n")
+        return True
+    except urllib.error.HTTPError as e:
+        sys.stderr.write(f"Import failed: {e.code} {e.read().decode()}\n")
+        return False
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+def export_file(config: dict, token: bytes, path: str) -> bool:
+    """
+    Stream all peers of a running autopeer instance to an NDJSON file (or
+    stdout for `-`).
+    """
+    try:
+        with urllib.request.urlopen(admin_request(config, "/export", token)) as r:
+            if path == "-":
+                shutil.copyfileobj(r, sys.stdout.buffer)
+            else:
+                with open(path, "wb") as f:
+                    shutil.copyfileobj(r, f)
+        return True
+    except urllib.error.HTTPError as e:
+        sys.stderr.write(f"Export failed: {e.code} {e.read().decode()}\n")
+        return False
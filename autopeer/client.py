@@ -0,0 +1,64 @@
+import json
+import socket
+
+from . import max_bytes
+from .logger import logger
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    """
+    Read exactly `size` bytes, also from TLS sockets which do not support
+    MSG_WAITALL.
+    """
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return data
+
+
+class PeerManagerClient:
+    """
+    Client side of the length prefixed JSON protocol spoken by the PeerManager.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+
+    def send(self, cmd: dict):
+        cmd_bytes = json.dumps(cmd).encode()
+        cmd_len = len(cmd_bytes).to_bytes(max_bytes)
+        self.sock.sendall(cmd_len + cmd_bytes)
+
+    def recv(self) -> dict:
+        try:
+            rsp_bytes = recv_exact(self.sock, max_bytes)
+        except ConnectionError:
+            raise ConnectionError("Connection to peer manager closed")
+        try:
+            rsp_len = int.from_bytes(rsp_bytes)
+        except ValueError:
+            logger.critical(f"Invalid command length: {rsp_bytes}")
+            raise ValueError
+        rsp_json = recv_exact(self.sock, rsp_len)
+        try:
+            rsp = json.loads(rsp_json)
+            if "success" not in rsp:
+                logger.critical(f"Invalid response: {rsp}")
+                return {
+                    "success": False,
+                    "error": "Invalid response from peer manager",
+                }
+            return rsp
+        except json.JSONDecodeError:
+            logger.critical(f"Invalid response: {rsp_json}")
+            return {"success": False, "error": "Invalid response from peer manager"}
+        except Exception as e:
+            logger.error(f"Failed to decode response: {e}")
+            return {"success": False, "error": str(e)}
+
+    def request(self, cmd: dict) -> dict:
+        self.send(cmd)
+        return self.recv()
@@ -0,0 +1,179 @@
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from .logger import logger
+
+registry_dirs = ["data/aut-num", "data/person", "data/mntner"]
+registry_samples = 16
+bgpd_bin = "/usr/sbin/bgpd"
+
+# rendered when the database has no peers yet, so that the neighbor
+# configuration is checked as well
+sample_peer = {
+    "ASN": 4242420001,
+    "description": "configtest",
+    "peer_ip": "192.0.2.1",
+    "peer_port": 20001,
+    "peer_pubkey": "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=",
+    "peer_psk": "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=",
+    "ll_ip4": "169.254.0.1",
+    "ll_ip6": "fe80::1",
+    "dn42_ip4": "172.20.0.1",
+    "dn42_ip6": "fd00::1",
+}
+
+
+class ConfigTest:
+    """
+    Checks run by `autopeer -n`.
+    Every check raises an exception on failure, independent checks are run
+    concurrently and the time taken by each one is reported.
+    """
+
+    def __init__(self, config: dict) -> None:
+        self.config = config
+
+    def check_config(self):
+        if "autopeer" not in self.config:
+            raise RuntimeError("[autopeer] section not found")
+        for key in ["user", "group", "registry", "db_dir", "asn", "router_id"]:
+            if key not in self.config["autopeer"]:
+                raise RuntimeError(f"autopeer.{key} not set")
+
+    def check_registry(self):
+        from .utils import DN42
+
+        registry = self.config["autopeer"]["registry"]
+        if not os.path.isdir(registry):
+            raise RuntimeError(f"Registry {registry} is not a directory")
+        for d in registry_dirs:
+            path = os.path.join(registry, d)
+            if not os.path.isdir(path):
+                raise RuntimeError(f"Registry directory {path} does not exist")
+
+        # resolve a sample of aut-num objects to catch broken references
+        aut_num = os.path.join(registry, "data/aut-num")
+        names = sorted(n for n in os.listdir(aut_num) if n.startswith("AS"))
+        if not names:
+            raise RuntimeError(f"No aut-num objects found in {aut_num}")
+        step = max(1, len(names) // registry_samples)
+        resolved = 0
+        for name in names[::step][:registry_samples]:
+            try:
+                asn = int(name[2:])
+                DN42.email(registry, asn)
+                DN42.pgp_fingerprint(registry, asn)
+                resolved += 1
+            except Exception as e:
+                logger.debug(f"Sample {name} did not resolve: {e}")
+        if not resolved:
+            raise RuntimeError("None of the sampled aut-num objects resolved")
+        return f"{len(names)} aut-num objects, {resolved} samples resolved"
+
+    def check_database(self):
+        from .migrations import migrations
+        from .settings import Settings
+
+        settings = Settings()
+        settings.initialize(self.config["autopeer"])
+        if not os.path.isfile(settings.database):
+            raise RuntimeError(f"Database {settings.database} does not exist")
+        version = settings.get_version()
+        if version != len(migrations):
+            raise RuntimeError(
+                f"Database version {version}, expected {len(migrations)}"
+            )
+        return f"version {version}"
+
+    def check_templates(self):
+        from . import models, schemas
+        from .peer_manager import bgpd_config, wg_config
+        from .settings import Settings
+
+        settings = Settings()
+        settings.initialize(self.config["autopeer"])
+        peers = []
+        if os.path.isfile(settings.database):
+            with settings.session_local() as session:
+                for row in session.query(models.PeerInfo):
+                    peers.append(
+                        schemas.PeerInfo.model_validate(row, from_attributes=True)
+                    )
+        rendered = len(peers)
+        if not peers:
+            peers.append(schemas.PeerInfo(**sample_peer))
+        local = self.config["autopeer"].get("local", {})
+        node = {
+            "wgid": 0,
+            "wgport": local.get("wg_port_base", 20000),
+            "inet": local.get("inet"),
+            "inet6": local.get("inet6"),
+        }
+        for peer in peers:
+            peer.dn42_validate()
+            # the private key is only readable by the peer manager
+            wg_config(
+                peer,
+                node,
+                "configtest",
+                self.config["autopeer"].get("rdomain", 0),
+                self.config["autopeer"].get("mtu", 1420),
+            )
+        bgpd_data = bgpd_config(
+            peers, self.config["autopeer"]["asn"], self.config["autopeer"]["router_id"]
+        )
+
+        if not os.path.isfile(bgpd_bin):
+            return f"{rendered} peers rendered, {bgpd_bin} not found"
+        with tempfile.NamedTemporaryFile("w", suffix=".conf") as f:
+            f.write(bgpd_data)
+            f.flush()
+            sp = subprocess.run(
+                [bgpd_bin, "-f", f.name, "-n"], capture_output=True, text=True
+            )
+        if sp.returncode:
+            raise RuntimeError(f"bgpd -n failed: {sp.stderr.strip()}")
+        return f"{rendered} peers rendered, bgpd -n passed"
+
+    def run(self) -> bool:
+        start = time.perf_counter()
+        results = [self.timed("config", self.check_config)]
+        if not results[0][1]:
+            self.report(results, time.perf_counter() - start)
+            return False
+
+        checks = [
+            ("registry", self.check_registry),
+            ("database", self.check_database),
+            ("templates", self.check_templates),
+        ]
+        with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+            futures = [executor.submit(self.timed, *check) for check in checks]
+            results.extend(f.result() for f in futures)
+
+        self.report(results, time.perf_counter() - start)
+        return all(ok for _, ok, _, _ in results)
+
+    @staticmethod
+    def timed(name: str, check: Callable) -> tuple:
+        start = time.perf_counter()
+        try:
+            msg = check() or "ok"
+            ok = True
+        except Exception as e:
+            msg = str(e)
+            ok = False
+        return name, ok, time.perf_counter() - start, msg
+
+    @staticmethod
+    def report(results: list, total: float):
+        for name, ok, elapsed, msg in results:
+            status = "ok" if ok else "FAILED"
+            print(f"{name:<10} {status:<6} {elapsed * 1000:8.1f} ms  {msg}")
+        print(f"{'total':<10} {'':<6} {total * 1000:8.1f} ms")
+        if all(ok for _, ok, _, _ in results):
+            print("configuration OK")
@@ -0,0 +1,80 @@
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from .logger import logger
+
+
+class Drain:
+    """
+    In-flight requests and peer manager commands of a webapp process.
+    SIGTERM puts the process in drain mode: new requests are refused and
+    the shutdown waits for the outstanding work until `timeout` seconds
+    after the signal, so a restart neither drops requests nor interrupts
+    a peer being configured half-way.
+    """
+
+    def __init__(self, timeout: float = 30) -> None:
+        self.timeout = timeout
+        self.inflight: Dict[str, int] = {"requests": 0, "commands": 0}
+        self.deadline: Optional[float] = None
+        # commands are dispatched from worker threads
+        self.cond = threading.Condition()
+
+    @property
+    def draining(self) -> bool:
+        return self.deadline is not None
+
+    def start(self):
+        with self.cond:
+            if self.deadline is not None:
+                return
+            self.deadline = time.monotonic() + self.timeout
+        logger.info(f"Draining, waiting up to {self.timeout}s for in-flight work")
+
+    def install(self):
+        """
+        Enter drain mode on SIGTERM and SIGINT, before the handlers already
+        installed (uvicorn's) run.
+        """
+        # signal handlers can only be set from the main thread
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(signum)
+
+            def handler(signum, frame, previous=previous):
+                self.start()
+                if callable(previous):
+                    previous(signum, frame)
+
+            signal.signal(signum, handler)
+
+    def remaining(self) -> float:
+        self.start()
+        return max(0, self.deadline - time.monotonic())
+
+    @contextmanager
+    def track(self, kind: str):
+        with self.cond:
+            self.inflight[kind] += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.inflight[kind] -= 1
+                self.cond.notify_all()
+
+    def wait(self) -> bool:
+        """
+        Wait until nothing is in flight or the deadline passed, returns
+        whether all work completed.
+        """
+        timeout = self.remaining()
+        with self.cond:
+            done = self.cond.wait_for(lambda: not any(self.inflight.values()), timeout)
+            if not done:
+                logger.error(f"Drain deadline passed with {self.inflight} in flight")
+            return done
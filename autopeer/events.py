@@ -0,0 +1,146 @@
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from .logger import logger
+
+
+class EventLog:
+    """
+    Append only NDJSON log of the changes made to the peers and who made them.
+
+    Events are buffered in memory by `record` and written in batches by a
+    background task, so logging adds no I/O to the request handlers. Each
+    batch is a single append made under a lock file, which lets all webapp
+    workers share the log, and the log is rotated once it reaches `max_size`.
+    Readers follow the log with a cursor of the form `inode:offset`, which
+    stays valid across one rotation.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 16 << 20,
+        keep: int = 5,
+        interval: float = 1,
+    ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.keep = keep
+        self.interval = interval
+        self.buffer: List[bytes] = []
+        # events are also recorded from the job worker thread
+        self.lock = threading.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    def record(self, event: str, asn: Optional[int], **fields):
+        entry = {"time": round(time.time(), 3), "event": event, "ASN": asn, **fields}
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.buffer.append(line.encode())
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if not batch:
+            return
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.rotate()
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+            try:
+                os.write(fd, b"".join(batch))
+            finally:
+                os.close(fd)
+
+    def rotate(self):
+        try:
+            if os.path.getsize(self.path) < self.max_size:
+                return
+        except FileNotFoundError:
+            return
+        for i in range(self.keep - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Failed to write event log: {e}")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.flush()
+
+    def read(
+        self, cursor: Optional[str], limit: int = 1 << 20
+    ) -> Tuple[str, List[Tuple[str, dict]]]:
+        """
+        Read the events written after `cursor`, each with the cursor
+        following it. Without a cursor, or one older than the last rotation
+        or malformed, reading starts at the end or the beginning of the log
+        respectively.
+        Returns the new cursor and the events.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return cursor or "0:0", []
+        if cursor is None:
+            return f"{st.st_ino}:{st.st_size}", []
+
+        # cursors come from clients, a malformed one matches no log file
+        ino, _, offset = cursor.partition(":")
+        try:
+            start = int(offset)
+        except ValueError:
+            start = -1
+        if start < 0:
+            logger.debug(f"Reading events from the start for cursor {cursor!r}")
+            ino = ""
+
+        files = [(self.path, st.st_ino, 0)]
+        if ino == str(st.st_ino):
+            files = [(self.path, st.st_ino, start)]
+        else:
+            try:
+                rotated = os.stat(f"{self.path}.1")
+                if ino == str(rotated.st_ino):
+                    files.insert(0, (f"{self.path}.1", rotated.st_ino, start))
+            except FileNotFoundError:
+                pass
+
+        events = []
+        for path, ino, offset in files:
+            cursor = f"{ino}:{offset}"
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read(limit)
+            # a batch being appended is only read once complete
+            for line in data[: data.rfind(b"\n") + 1].splitlines(keepends=True):
+                offset += len(line)
+                cursor = f"{ino}:{offset}"
+                try:
+                    events.append((cursor, json.loads(line)))
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring corrupt event: {line!r}")
+            limit -= len(data)
+            if limit <= 0:
+                break
+        return cursor, events
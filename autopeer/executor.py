@@ -0,0 +1,214 @@
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .logger import logger
+
+# how often the exit of a command is checked while children it left behind
+# keep its output open
+poll_interval = 0.1
+
+
+class Executor:
+    """
+    Runs the external commands of the peer manager.
+    Independent commands run concurrently on a bounded pool of workers,
+    children outliving their timeout are killed along with the processes
+    they started and output is read as it is produced, only a bounded tail
+    is kept unless it is consumed as a stream.
+    Latency statistics are kept per command.
+    """
+
+    def __init__(
+        self, workers: int = 4, timeout: float = 120, max_output: int = 64 * 1024
+    ) -> None:
+        self.timeout = timeout
+        self.max_output = max_output
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exec")
+        self.stats: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def spawn(
+        self, args: Sequence[str], deadline: float, result: subprocess.CompletedProcess
+    ) -> Iterator[Tuple[int, bytes]]:
+        """
+        Start a command and yield (fd, chunk) pairs of its stdout (1) and
+        stderr (2) as they are read. The exit status is stored in `result`,
+        it stays None if the command was killed at the deadline.
+        The command runs in its own process group so that the processes it
+        started are killed along with it.
+        """
+        proc = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+        fds = {proc.stdout: 1, proc.stderr: 2}
+        try:
+            with selectors.DefaultSelector() as sel:
+                for pipe in fds:
+                    sel.register(pipe, selectors.EVENT_READ)
+                while sel.get_map():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    events = sel.select(min(remaining, poll_interval))
+                    if not events and proc.poll() is not None:
+                        # exited, leaving background children holding the
+                        # pipes open
+                        break
+                    for key, _ in events:
+                        chunk = os.read(key.fd, 65536)
+                        if not chunk:
+                            sel.unregister(key.fileobj)
+                            continue
+                        yield fds[key.fileobj], chunk
+            result.returncode = proc.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            pass
+        finally:
+            # also reached when the consumer stops reading early
+            if proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                proc.wait()
+            for pipe in fds:
+                pipe.close()
+
+    def stream(
+        self,
+        args: Sequence[str],
+        result: subprocess.CompletedProcess,
+        timeout: Optional[float] = None,
+    ) -> Iterator[bytes]:
+        """
+        Run a command yielding its stdout in chunks, the tail of stderr and
+        the exit status are stored in `result`.
+        A command killed by the timeout has a returncode of -9.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        stderr = bytearray()
+        try:
+            for fd, chunk in self.spawn(args, start + timeout, result):
+                if fd == 1:
+                    yield chunk
+                else:
+                    stderr += chunk
+                    del stderr[: -self.max_output]
+        finally:
+            timed_out = result.returncode is None
+            self.record(args[0], time.monotonic() - start, timed_out)
+        if timed_out:
+            result.returncode = -9
+            stderr += f"\nkilled after {timeout}s".encode()
+            logger.error(f"Command {args[0]} timed out after {timeout}s")
+        result.stderr = bytes(stderr)
+
+    def run(
+        self, args: Sequence[str], timeout: Optional[float] = None
+    ) -> subprocess.CompletedProcess:
+        """
+        Run a command and wait for it, keeping the tail of its output.
+        """
+        result = subprocess.CompletedProcess(args, None, b"", b"")
+        stdout = bytearray()
+        for chunk in self.stream(args, result, timeout):
+            stdout += chunk
+            del stdout[: -self.max_output]
+        result.stdout = bytes(stdout)
+        return result
+
+    def lines(
+        self, args: Sequence[str], timeout: Optional[float] = None
+    ) -> Iterator[str]:
+        """
+        Run a command yielding its stdout line by line as it is read.
+        Raises CalledProcessError once the output ends if the command failed.
+        """
+        result = subprocess.CompletedProcess(args, None, b"", b"")
+        buf = b""
+        for chunk in self.stream(args, result, timeout):
+            *lines, buf = (buf + chunk).split(b"\n")
+            for line in lines:
+                yield line.decode()
+        if buf:
+            yield buf.decode()
+        if result.returncode:
+            raise subprocess.CalledProcessError(
+                result.returncode, args, stderr=result.stderr
+            )
+
+    def map(
+        self, commands: Sequence[Sequence[str]], timeout: Optional[float] = None
+    ) -> List[subprocess.CompletedProcess]:
+        """
+        Run independent commands concurrently, results are in command order.
+        """
+        futures = [self.pool.submit(self.run, args, timeout) for args in commands]
+        return [f.result() for f in futures]
+
+    def record(self, command: str, elapsed: float, timed_out: bool):
+        with self.lock:
+            stats = self.stats.setdefault(
+                command, {"count": 0, "timeouts": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            stats["count"] += 1
+            stats["timeouts"] += timed_out
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+
+    def summary(self) -> Dict[str, dict]:
+        with self.lock:
+            return {
+                command: {
+                    **stats,
+                    "total_ms": round(stats["total_ms"], 1),
+                    "max_ms": round(stats["max_ms"], 1),
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 1),
+                }
+                for command, stats in self.stats.items()
+            }
+
+
+class FakeExecutor(Executor):
+    """
+    Executor that runs nothing, for exercising the peer manager without
+    touching the system. Every command is recorded in `commands` and answered
+    by `handler`, which defaults to a successful command without output.
+    """
+
+    def __init__(
+        self,
+        handler: Optional[
+            Callable[[Sequence[str]], subprocess.CompletedProcess]
+        ] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.handler = handler
+        self.commands: List[List[str]] = []
+
+    def spawn(
+        self, args: Sequence[str], deadline: float, result: subprocess.CompletedProcess
+    ) -> Iterator[Tuple[int, bytes]]:
+        with self.lock:
+            self.commands.append(list(args))
+        if self.handler is None:
+            result.returncode = 0
+            return
+        sp = self.handler(args)
+        if sp.stdout:
+            yield 1, sp.stdout
+        if sp.stderr:
+            yield 2, sp.stderr
+        result.returncode = sp.returncode
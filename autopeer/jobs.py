@@ -0,0 +1,200 @@
+import asyncio
+import json
+import time
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, peers, schemas
+from .events import EventLog
+from .logger import logger
+from .nodes import NodeRegistry
+from .settings import Settings
+from .validation import PeerIndex, PeerValidator
+
+
+class JobQueue:
+    """
+    Persistent queue of peer operations stored in the job table.
+    Requests only enqueue a job, a single worker task drains the queue
+    through the peer managers so that bursts of requests are absorbed while
+    the nodes apply them at their own pace.
+    With `poll`, the queue is also checked every `poll` seconds to pick up
+    jobs submitted by other webapp workers. `invalidate` is called with the
+    ASN of every job that ran and the outcome is recorded in `events`.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        nodes: NodeRegistry,
+        poll: Optional[float] = None,
+        invalidate: Optional[Callable[[Iterable[int]], None]] = None,
+        events: Optional[EventLog] = None,
+    ) -> None:
+        self.settings = settings
+        self.nodes = nodes
+        self.poll = poll
+        self.invalidate = invalidate
+        self.events = events
+        self.wakeup = asyncio.Event()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+
+    def submit(
+        self, session: Session, command: str, asn: int, payload: Optional[str] = None
+    ) -> models.Job:
+        now = time.time()
+        job = models.Job(
+            ASN=asn,
+            command=command,
+            payload=payload,
+            state="queued",
+            created=now,
+            updated=now,
+        )
+        session.add(job)
+        session.commit()
+        self.notify()
+        logger.debug(f"Queued job {job.id}: {command} AS{asn}")
+        return job
+
+    def notify(self):
+        # jobs are also submitted from the scheduler threads
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self.loop is None or running is self.loop:
+            self.wakeup.set()
+        else:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def start(self):
+        # jobs interrupted by a restart are run again from the start, which
+        # is safe as every step is idempotent: wg_create rewrites the
+        # interface and bgp_update the whole bgpd configuration. Failing them
+        # would leave the peers `peers.store` committed without BGP sessions
+        with self.settings.session_local() as session:
+            interrupted = (
+                session.query(models.Job).filter(models.Job.state == "running").all()
+            )
+            for job in interrupted:
+                logger.warning(f"Requeueing job {job.id} interrupted by a restart")
+                job.state = "queued"
+                job.updated = time.time()
+            session.commit()
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.create_task(self.worker())
+
+    async def stop(self, timeout: float = 0):
+        """
+        Stop claiming jobs and give the job being run up to `timeout`
+        seconds to complete before cancelling the worker.
+        """
+        self.stopping = True
+        self.wakeup.set()
+        if self.task is not None:
+            try:
+                await asyncio.wait_for(self.task, timeout)
+            except asyncio.TimeoutError:
+                logger.error("Job worker did not stop in time")
+            except asyncio.CancelledError:
+                pass
+
+    async def worker(self):
+        while not self.stopping:
+            self.wakeup.clear()
+            job_id = self.claim()
+            if job_id is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await asyncio.to_thread(self.run, job_id)
+
+    def claim(self) -> Optional[int]:
+        with self.settings.session_local() as session:
+            job = (
+                session.query(models.Job)
+                .filter(models.Job.state == "queued")
+                .order_by(models.Job.id)
+                .first()
+            )
+            if job is None:
+                return None
+            job.state = "running"
+            job.updated = time.time()
+            session.commit()
+            return job.id
+
+    def run(self, job_id: int):
+        with self.settings.session_local() as session:
+            job = session.get(models.Job, job_id)
+            try:
+                if job.command == "create":
+                    peer_info = schemas.PeerInfo.model_validate_json(job.payload)
+                    peer_info.dn42_validate()
+                    # peers created by the jobs queued before this one were
+                    # not stored yet when the request was validated
+                    index = PeerIndex.lookup(session, [peer_info])
+                    errors = PeerValidator(index).validate(f"AS{job.ASN}", peer_info)
+                    if errors:
+                        raise ValueError("; ".join(errors))
+                    results = peers.create_peer(session, self.nodes, peer_info)
+                elif job.command == "delete":
+                    results = peers.delete_peer(session, self.nodes, job.ASN)
+                    if not results:
+                        raise ValueError("Peer not found")
+                else:
+                    raise ValueError(f"Invalid job command: {job.command}")
+                failed = NodeRegistry.failed(results)
+                job.state = (
+                    "failed" if failed and len(failed) == len(results) else "done"
+                )
+                job.result = json.dumps({"success": not failed, "nodes": results})
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                session.rollback()
+                job = session.get(models.Job, job_id)
+                job.state = "failed"
+                job.result = json.dumps({"success": False, "error": str(e)})
+            job.updated = time.time()
+            session.commit()
+            if self.invalidate is not None:
+                self.invalidate([job.ASN])
+            if self.events is not None:
+                self.events.record(
+                    "job", job.ASN, job=job.id, command=job.command, state=job.state
+                )
+            logger.debug(f"Job {job_id} {job.state}")
+
+    def prune(self):
+        """
+        Forget finished jobs older than the retention period.
+        """
+        cutoff = time.time() - self.settings.job_retention
+        with self.settings.session_local() as session:
+            count = (
+                session.query(models.Job)
+                .filter(models.Job.state.in_(["done", "failed"]))
+                .filter(models.Job.updated < cutoff)
+                .delete()
+            )
+            session.commit()
+        if count:
+            logger.debug(f"Pruned {count} finished jobs")
+
+    @staticmethod
+    def status(job: models.Job) -> dict:
+        return {
+            "job": job.id,
+            "ASN": job.ASN,
+            "command": job.command,
+            "state": job.state,
+            "created": job.created,
+            "updated": job.updated,
+            "result": json.loads(job.result) if job.result else None,
+        }
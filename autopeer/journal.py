@@ -0,0 +1,111 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+from .logger import logger
+
+
+class Journal:
+    """
+    Append only write-ahead log of the operations run by the peer manager.
+
+    Every operation is recorded as a `begin` entry holding the command before
+    any change is made, optional `step` entries as it progresses and a `done`
+    entry once it finished (successfully or not). `begin` entries are fsynced
+    right away, which also makes the entries written before them durable.
+    `done` entries are only fsynced by `sync`, once the peer manager is idle,
+    so a burst of operations costs a single extra fsync; an operation
+    completed right before a crash may be replayed, which is harmless as
+    every journaled command is idempotent. Operations without a `done` entry
+    are the ones interrupted by a crash and are returned by `pending`.
+    """
+
+    def __init__(self, path: str, max_size: int = 1 << 20) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.next_id = 1
+        self.inflight: Dict[int, dict] = {}
+        self.unsynced = False
+        self.load()
+        self.file = open(self.path, "a")
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                # torn write at the end of the journal, the next entry would
+                # be appended to it and be unreadable in turn
+                logger.warning(f"Truncating torn journal entry: {data[end:]!r}")
+                f.truncate(end)
+                os.fsync(f.fileno())
+        for line in data[:end].decode(errors="replace").splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring corrupt journal entry: {line!r}")
+                continue
+            jid = entry["id"]
+            self.next_id = max(self.next_id, jid + 1)
+            if entry["op"] == "begin":
+                self.inflight[jid] = {"command": entry["command"], "steps": []}
+            elif entry["op"] == "step" and jid in self.inflight:
+                self.inflight[jid]["steps"].append(entry["step"])
+            elif entry["op"] == "done":
+                self.inflight.pop(jid, None)
+
+    def append(self, entry: dict, sync: bool = False):
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def begin(self, command: dict) -> int:
+        jid = self.next_id
+        self.next_id += 1
+        self.inflight[jid] = {"command": command, "steps": []}
+        self.append({"id": jid, "op": "begin", "command": command}, sync=True)
+        return jid
+
+    def step(self, jid: int, step: str):
+        self.inflight[jid]["steps"].append(step)
+        self.append({"id": jid, "op": "step", "step": step})
+
+    def done(self, jid: int):
+        self.inflight.pop(jid, None)
+        self.append({"id": jid, "op": "done"})
+        self.unsynced = True
+        if not self.inflight and self.file.tell() > self.max_size:
+            self.compact()
+
+    def sync(self):
+        """
+        Make the `done` entries written since the last fsync durable.
+        """
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = False
+
+    def compact(self):
+        """
+        Truncate the journal, only valid while no operation is in flight.
+        """
+        os.fsync(self.file.fileno())
+        self.unsynced = False
+        self.file.truncate(0)
+        self.file.seek(0)
+        os.fsync(self.file.fileno())
+        logger.debug("Compacted journal")
+
+    def pending(self) -> List[tuple]:
+        """
+        Interrupted operations in the order they were started, as a list of
+        (id, command, steps) tuples.
+        """
+        return [(jid, op["command"], op["steps"]) for jid, op in self.inflight.items()]
+
+    def close(self):
+        os.fsync(self.file.fileno())
+        self.file.close()
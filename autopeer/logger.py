@@ -2,18 +2,30 @@ import logging
 import logging.handlers
 
 logger: logging.Logger = logging.getLogger("autopeer")
-logger.setLevel(logging.DEBUG)
 
 formatter: logging.Formatter = logging.Formatter(
     "%(asctime)s [%(levelname)s]\t%(name)s[%(process)d]: %(message)s"
 )
 
-syslog_handler: logging.handlers.SysLogHandler = logging.handlers.SysLogHandler(
-    address="/dev/log"
-)
-syslog_handler.setFormatter(formatter)
-logger.addHandler(syslog_handler)
 
-console_handler: logging.StreamHandler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+def setup_logging(level: str = "DEBUG", syslog: bool = True) -> None:
+    """
+    Install the console and (optionally) syslog handlers on the autopeer logger.
+    Calling it more than once only updates the level.
+    """
+    logger.setLevel(level)
+    if logger.handlers:
+        return
+
+    if syslog:
+        try:
+            syslog_handler = logging.handlers.SysLogHandler(address="/dev/log")
+        except OSError as e:
+            logger.warning(f"Failed to connect to syslog: {e}")
+        else:
+            syslog_handler.setFormatter(formatter)
+            logger.addHandler(syslog_handler)
+
+    console_handler: logging.StreamHandler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
@@ -3,16 +3,23 @@ import email.utils
 import json
 import subprocess
 import tempfile
+import time
 from functools import partial
 from os import system
+from typing import Optional
 
 import gnupg
+from cachetools import TTLCache
 from fastapi import HTTPException
 from starlette.requests import Request
+from starlette.responses import JSONResponse
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from . import cache, settings
+from .drain import Drain
 from .logger import logger
+from .profiler import Tracer, current, stage
+from .registry_snapshot import RegistrySnapshot
+from .session_token import TokenSigner
 from .settings import Settings
 from .utils import DN42
 
@@ -21,14 +28,21 @@ class GPGMiddleware:
     """
     Middleware to verfify the body of the request using GPG.
     If there is no body, the request is passed through.
+    The e-mail and PGP fingerprint of the ASN are taken from the registry
+    snapshot if given.
     """
 
     def __init__(
-        self, app: ASGIApp, gpg: gnupg.GPG = None, settings: Settings = None
+        self,
+        app: ASGIApp,
+        gpg: gnupg.GPG = None,
+        settings: Settings = None,
+        snapshot: Optional[RegistrySnapshot] = None,
     ) -> None:
         self.app = app
         self.gpg = gnupg.GPG() if gpg is None else gpg
         self.settings = settings
+        self.snapshot = snapshot
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope["type"] != "http":
@@ -84,7 +98,11 @@ class GPGMiddleware:
 
         # get the email of the ASN
         try:
-            mail = DN42.email(self.settings.registry, ASN)
+            with stage("registry"):
+                if self.snapshot is not None:
+                    mail = self.snapshot.email(ASN)
+                else:
+                    mail = DN42.email(self.settings.registry, ASN)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Error getting email: {e}")
         if not mail:
@@ -92,7 +110,11 @@ class GPGMiddleware:
         logger.debug(f"Email: {mail}")
 
         try:
-            pgp_fingerprint = DN42.pgp_fingerprint(self.settings.registry, ASN)
+            with stage("registry"):
+                if self.snapshot is not None:
+                    pgp_fingerprint = self.snapshot.pgp_fingerprint(ASN)
+                else:
+                    pgp_fingerprint = DN42.pgp_fingerprint(self.settings.registry, ASN)
         except Exception as e:
             raise HTTPException(
                 status_code=400, detail=f"Error getting PGP fingerprint: {e}"
@@ -104,7 +126,8 @@ class GPGMiddleware:
         # get the public key of the ASN
         # only searches for the key using WKD and local keyring
         logger.debug("Getting public key")
-        sp = subprocess.run(["gpg", "--locate-keys", mail])
+        with stage("gpg_locate"):
+            sp = subprocess.run(["gpg", "--locate-keys", mail])
         if sp.returncode != 0:
             logger.warning(f"Error getting public key for: {mail}")
 
@@ -113,7 +136,8 @@ class GPGMiddleware:
                 tmppath = tmpfile.name
                 tmpfile.write(signature)
                 tmpfile.flush()
-                verified = self.gpg.verify_data(tmppath, body)
+                with stage("gpg_verify"):
+                    verified = self.gpg.verify_data(tmppath, body)
                 if not verified.valid:
                     raise HTTPException(
                         status_code=400, detail="Signature verification failed"
@@ -144,6 +168,8 @@ class GPGMiddleware:
                             status_code=401, detail="PGP fingerprint mismatch"
                         )
                     logger.debug("Signature verified")
+                    # made available to the handlers as request.state.signer
+                    scope.setdefault("state", {})["signer"] = sig_fingerprint
 
         except HTTPException:
             raise
@@ -159,11 +185,20 @@ class TokenMiddleware:
     """
     Middleware to verify that the token of the request is valid.
     If there is no body, the request is passed through.
+    Tokens are looked up in the cache, or verified by the signer if given.
     """
 
-    def __init__(self, app: ASGIApp, gpg: gnupg.GPG = None) -> None:
+    def __init__(
+        self,
+        app: ASGIApp,
+        cache: TTLCache,
+        gpg: gnupg.GPG = None,
+        signer: Optional[TokenSigner] = None,
+    ) -> None:
         self.app = app
+        self.cache = cache
         self.gpg = gnupg.GPG() if gpg is None else gpg
+        self.signer = signer
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope["type"] != "http":
@@ -207,8 +242,15 @@ class TokenMiddleware:
         logger.debug(f"Token: {token}")
 
         # check that token is valid
+        if self.signer is not None:
+            try:
+                with stage("token"):
+                    self.signer.verify(ASN, token)
+            except ValueError as e:
+                raise HTTPException(status_code=401, detail=str(e))
+            return message
         try:
-            if cache[ASN] != token:
+            if self.cache[ASN] != token:
                 raise HTTPException(status_code=401, detail="Token is invalid")
         except KeyError:
             raise HTTPException(status_code=401, detail="ASN is not logged in")
@@ -216,3 +258,58 @@ class TokenMiddleware:
             raise HTTPException(status_code=400, detail=f"Error verifying token: {e}")
 
         return message
+
+
+class DrainMiddleware:
+    """
+    Middleware counting the requests in flight and refusing new ones with
+    503 Service Unavailable while draining. The health probes are always
+    answered.
+    """
+
+    def __init__(self, app: ASGIApp, drain: Drain) -> None:
+        self.app = app
+        self.drain = drain
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in ("/healthz", "/readyz"):
+            await self.app(scope, receive, send)
+            return
+
+        if self.drain.draining:
+            response = JSONResponse(
+                {"detail": "Server is shutting down"},
+                status_code=503,
+                headers={"Retry-After": "1", "Connection": "close"},
+            )
+            await response(scope, receive, send)
+            return
+
+        with self.drain.track("requests"):
+            await self.app(scope, receive, send)
+
+
+class TraceMiddleware:
+    """
+    Middleware timing the stages of every request, the breakdown of the
+    requests slower than the threshold of the tracer is logged and kept.
+    """
+
+    def __init__(self, app: ASGIApp, tracer: Tracer) -> None:
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace: dict = {}
+        token = current.set(trace)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current.reset(token)
+            total = (time.perf_counter() - start) * 1000
+            self.tracer.finish(scope["method"], scope["path"], total, trace)
@@ -34,6 +34,63 @@ CREATE TABLE peerinfo (
     "CREATE INDEX IF NOT EXISTS idx_DN42_IP6 ON peerinfo (DN42_IP6);",
 ]
 
+m_002 = [
+    """
+CREATE TABLE nodepeer (
+	"NODE" VARCHAR NOT NULL, 
+	"ASN" INTEGER NOT NULL, 
+	"WGID" INTEGER NOT NULL, 
+	PRIMARY KEY ("NODE", "ASN"), 
+	UNIQUE ("NODE", "WGID"), 
+	FOREIGN KEY("ASN") REFERENCES peerinfo ("ASN") ON DELETE CASCADE
+);
+""",
+    "CREATE INDEX IF NOT EXISTS idx_nodepeer_ASN ON nodepeer (ASN);",
+]
+
+m_003 = [
+    """
+CREATE TABLE job (
+	"ID" INTEGER NOT NULL, 
+	"ASN" INTEGER NOT NULL, 
+	"COMMAND" VARCHAR(10) NOT NULL, 
+	"PAYLOAD" VARCHAR, 
+	"STATE" VARCHAR(10) NOT NULL, 
+	"RESULT" VARCHAR, 
+	"CREATED" FLOAT NOT NULL, 
+	"UPDATED" FLOAT NOT NULL, 
+	PRIMARY KEY ("ID")
+);
+""",
+    "CREATE INDEX IF NOT EXISTS idx_job_STATE ON job (STATE);",
+    "CREATE INDEX IF NOT EXISTS idx_job_ASN ON job (ASN);",
+]
+
+m_004 = [
+    """
+CREATE TABLE logintoken (
+	"ASN" INTEGER NOT NULL, 
+	"TOKEN" VARCHAR NOT NULL, 
+	"EXPIRES" FLOAT NOT NULL, 
+	PRIMARY KEY ("ASN")
+);
+""",
+    "CREATE INDEX IF NOT EXISTS idx_logintoken_EXPIRES ON logintoken (EXPIRES);",
+]
+
+m_005 = [
+    'ALTER TABLE peerinfo ADD COLUMN "VERSION" INTEGER NOT NULL DEFAULT 1;',
+]
+
+m_006 = [
+    'ALTER TABLE nodepeer ADD COLUMN "CONFIGURED" BOOLEAN NOT NULL DEFAULT 1;',
+]
+
 migrations = [
     m_001,
+    m_002,
+    m_003,
+    m_004,
+    m_005,
+    m_006,
 ]
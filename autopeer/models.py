@@ -1,4 +1,4 @@
-from sqlalchemy import String, text
+from sqlalchemy import ForeignKey, String, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
@@ -25,3 +25,44 @@ class PeerInfo(Base):
 
     dn42_ip4: Mapped[str] = mapped_column("DN42_IP4", nullable=False, unique=True)
     dn42_ip6: Mapped[str] = mapped_column("DN42_IP6", nullable=False, unique=True)
+
+    # bumped by every update, part of the ETag of the peer info
+    version: Mapped[int] = mapped_column("VERSION", nullable=False)
+
+    __mapper_args__ = {"version_id_col": version}
+
+
+class NodePeer(Base):
+    __tablename__ = "nodepeer"
+
+    node: Mapped[str] = mapped_column("NODE", primary_key=True)
+    ASN: Mapped[int] = mapped_column(
+        "ASN", ForeignKey("peerinfo.ASN", ondelete="CASCADE"), primary_key=True
+    )
+    wgid: Mapped[int] = mapped_column("WGID", nullable=False)
+    # whether the node accepted the interface, only then is the peer part of
+    # its bgpd configuration
+    configured: Mapped[bool] = mapped_column(
+        "CONFIGURED", nullable=False, server_default=text("1")
+    )
+
+
+class Job(Base):
+    __tablename__ = "job"
+
+    id: Mapped[int] = mapped_column("ID", primary_key=True)
+    ASN: Mapped[int] = mapped_column("ASN", nullable=False)
+    command: Mapped[str] = mapped_column("COMMAND", String(10), nullable=False)
+    payload: Mapped[str] = mapped_column("PAYLOAD", nullable=True)
+    state: Mapped[str] = mapped_column("STATE", String(10), nullable=False)
+    result: Mapped[str] = mapped_column("RESULT", nullable=True)
+    created: Mapped[float] = mapped_column("CREATED", nullable=False)
+    updated: Mapped[float] = mapped_column("UPDATED", nullable=False)
+
+
+class LoginToken(Base):
+    __tablename__ = "logintoken"
+
+    ASN: Mapped[int] = mapped_column("ASN", primary_key=True)
+    token: Mapped[str] = mapped_column("TOKEN", nullable=False)
+    expires: Mapped[float] = mapped_column("EXPIRES", nullable=False)
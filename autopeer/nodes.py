@@ -0,0 +1,389 @@
+import hashlib
+import hmac
+import os
+import queue
+import signal
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Union
+
+from .client import PeerManagerClient, recv_exact
+from .drain import Drain
+from .logger import logger
+from .profiler import stage
+
+nonce_bytes = 32
+
+
+def parse_address(address: str) -> tuple:
+    """
+    Parse a node address of the form `unix:/path/to/socket` or `tcp:host:port`.
+    """
+    kind, _, rest = address.partition(":")
+    if kind == "unix" and rest:
+        return socket.AF_UNIX, rest
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        if host and port.isdigit():
+            return socket.AF_INET6 if ":" in host else socket.AF_INET, (
+                host.strip("[]"),
+                int(port),
+            )
+    raise ValueError(f"Invalid node address: {address}")
+
+
+def read_secret(path: str) -> bytes:
+    with open(path, "rb") as f:
+        secret = f.read().strip()
+    if not secret:
+        raise ValueError(f"Secret file {path} is empty")
+    return secret
+
+
+def proof(secret: bytes, role: bytes, nonce: bytes) -> bytes:
+    # the role keeps an answer of one side from being replayed by the other
+    return hmac.digest(secret, role + nonce, hashlib.sha256)
+
+
+def authenticate(sock: socket.socket, secret: bytes):
+    """
+    Controller side of the mutual challenge response handshake: answer the
+    nonce sent by the agent, then have the agent answer ours.
+    """
+    nonce = recv_exact(sock, nonce_bytes)
+    ours = os.urandom(nonce_bytes)
+    sock.sendall(proof(secret, b"controller", nonce) + ours)
+    if recv_exact(sock, 1) != b"\x01":
+        raise PermissionError("Authentication rejected by agent")
+    digest = recv_exact(sock, hashlib.sha256().digest_size)
+    if not hmac.compare_digest(digest, proof(secret, b"agent", ours)):
+        raise PermissionError("Agent failed to authenticate")
+
+
+def challenge(sock: socket.socket, secret: bytes) -> bool:
+    """
+    Agent side of the mutual challenge response handshake.
+    """
+    nonce = os.urandom(nonce_bytes)
+    sock.sendall(nonce)
+    digest = recv_exact(sock, hashlib.sha256().digest_size)
+    theirs = recv_exact(sock, nonce_bytes)
+    ok = hmac.compare_digest(digest, proof(secret, b"controller", nonce))
+    if not ok:
+        sock.sendall(b"\x00")
+        return False
+    sock.sendall(b"\x01" + proof(secret, b"agent", theirs))
+    return True
+
+
+def tls_context(purpose: ssl.Purpose, config: dict) -> ssl.SSLContext:
+    """
+    TLS context of a node channel, both sides present a certificate signed
+    by the CA in `tls_ca`.
+    """
+    for key in ("tls_cert", "tls_key", "tls_ca"):
+        if not config.get(key):
+            raise ValueError(f"{key} must be set for tcp addresses")
+    context = ssl.create_default_context(purpose, cafile=config["tls_ca"])
+    context.load_cert_chain(config["tls_cert"], config["tls_key"])
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.verify_mode = ssl.CERT_REQUIRED
+    return context
+
+
+class Node:
+    """
+    A router running a peer manager.
+    The local node talks over the socketpair to the forked peer manager,
+    remote nodes are reached through an authenticated agent socket which is
+    (re)connected on demand, over TLS for tcp addresses.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        address: Optional[str] = None,
+        secret: Optional[bytes] = None,
+        sock: Optional[socket.socket] = None,
+        wg_port_base: int = 20000,
+        inet: Optional[str] = None,
+        inet6: Optional[str] = None,
+        timeout: float = 30,
+        tls: Optional[ssl.SSLContext] = None,
+        server_name: Optional[str] = None,
+    ) -> None:
+        if address is None and sock is None:
+            raise ValueError(f"Node {name} has neither an address nor a socket")
+        self.name = name
+        self.address = address
+        self.secret = secret
+        self.wg_port_base = wg_port_base
+        self.inet = inet
+        self.inet6 = inet6
+        self.timeout = timeout
+        self.tls = tls
+        self.server_name = server_name
+        self.client = PeerManagerClient(sock) if sock is not None else None
+        self.lock = threading.Lock()
+        self.busy_since = 0.0
+
+    @classmethod
+    def from_config(cls, name: str, config: dict) -> "Node":
+        family, addr = parse_address(config["address"])
+        tls, server_name = None, None
+        if family != socket.AF_UNIX:
+            tls = tls_context(ssl.Purpose.SERVER_AUTH, config)
+            server_name = config.get("tls_server_name", addr[0])
+        return cls(
+            name,
+            address=config["address"],
+            secret=read_secret(config["secret_file"]),
+            wg_port_base=config.get("wg_port_base", 20000),
+            inet=config.get("inet"),
+            inet6=config.get("inet6"),
+            timeout=config.get("timeout", 30),
+            tls=tls,
+            server_name=server_name,
+        )
+
+    def connect(self) -> PeerManagerClient:
+        family, addr = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(addr)
+            if self.tls is not None:
+                sock = self.tls.wrap_socket(sock, server_hostname=self.server_name)
+            authenticate(sock, self.secret)
+        except Exception:
+            sock.close()
+            raise
+        logger.debug(f"Connected to node {self.name} at {self.address}")
+        return PeerManagerClient(sock)
+
+    def request(self, cmd: dict) -> dict:
+        with self.lock:
+            self.busy_since = time.monotonic()
+            if self.client is None:
+                self.client = self.connect()
+            try:
+                return self.client.request(cmd)
+            except (OSError, ValueError):
+                # drop the broken connection, the next request reconnects
+                if self.address is not None:
+                    self.client.sock.close()
+                    self.client = None
+                raise
+
+    def ping(self, timeout: float = 2) -> bool:
+        """
+        Whether the peer manager answers. A node busy with another command
+        counts as alive until the command exceeds the node timeout.
+        """
+        if not self.lock.acquire(timeout=timeout):
+            return time.monotonic() - self.busy_since < self.timeout
+        self.lock.release()
+        try:
+            return bool(self.request({"command": "exec_stats"}).get("success"))
+        except Exception as e:
+            logger.error(f"Peer manager of node {self.name} is not answering: {e}")
+            return False
+
+    def allocation(self, wgid: int) -> dict:
+        return {
+            "wgid": wgid,
+            "wgport": self.wg_port_base + wgid,
+            "inet": self.inet,
+            "inet6": self.inet6,
+        }
+
+
+class NodeRegistry:
+    """
+    All nodes driven by this autopeer instance.
+    Commands are dispatched to the nodes concurrently and the response of
+    every node is reported individually. Commands in flight are tracked by
+    `drain` so that a shutdown waits for them.
+    """
+
+    def __init__(self, nodes: List[Node], drain: Optional[Drain] = None) -> None:
+        self.nodes: Dict[str, Node] = {node.name: node for node in nodes}
+        self.drain = drain
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, len(nodes)), thread_name_prefix="node"
+        )
+
+    @classmethod
+    def from_config(
+        cls,
+        config: dict,
+        local: dict,
+        sock: socket.socket,
+        drain: Optional[Drain] = None,
+    ):
+        nodes = [
+            Node(
+                "local",
+                sock=sock,
+                wg_port_base=local.get("wg_port_base", 20000),
+                inet=local.get("inet"),
+                inet6=local.get("inet6"),
+            )
+        ]
+        for name, node_config in config.items():
+            nodes.append(Node.from_config(name, node_config))
+        return cls(nodes, drain)
+
+    def __getitem__(self, name: str) -> Node:
+        return self.nodes[name]
+
+    def __iter__(self):
+        return iter(self.nodes.values())
+
+    def dispatch(self, cmd: Union[dict, Callable[[Node], dict]]) -> Dict[str, dict]:
+        """
+        Send a command to every node and wait for all responses.
+        `cmd` is either the command itself or a function building the command
+        for a given node, e.g. to include its address allocation. Nodes for
+        which the function returns None are skipped.
+        """
+
+        def send(node: Node) -> dict:
+            try:
+                node_cmd = cmd(node) if callable(cmd) else cmd
+                if node_cmd is None:
+                    return {"success": True, "skipped": True}
+                return node.request(node_cmd)
+            except Exception as e:
+                logger.error(f"Failed to send command to node {node.name}: {e}")
+                return {"success": False, "error": str(e)}
+
+        label = cmd["command"] if isinstance(cmd, dict) else "peer_manager"
+        with stage(f"pm:{label}"):
+            if self.drain is None:
+                return self.run(send)
+            with self.drain.track("commands"):
+                return self.run(send)
+
+    def run(self, send: Callable[[Node], dict]) -> Dict[str, dict]:
+        futures = {
+            name: self.executor.submit(send, node) for name, node in self.nodes.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    @staticmethod
+    def failed(results: Dict[str, dict]) -> List[str]:
+        return [name for name, resp in results.items() if not resp.get("success")]
+
+
+class Acceptor:
+    """
+    Accepts and authenticates agent connections in background threads, so a
+    client stalling its handshake never holds up the command loop. At most
+    `max_pending` handshakes run at a time, each limited to `timeout`
+    seconds. Authenticated connections are queued, `ready` is readable
+    whenever `accept` has one to return.
+    """
+
+    def __init__(
+        self,
+        server: socket.socket,
+        secret: bytes,
+        context: Optional[ssl.SSLContext] = None,
+        timeout: float = 10,
+        max_pending: int = 16,
+    ) -> None:
+        self.server = server
+        self.secret = secret
+        self.context = context
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.queue: "queue.SimpleQueue[socket.socket]" = queue.SimpleQueue()
+        self.ready, self.notify = socket.socketpair()
+
+    def start(self):
+        threading.Thread(target=self.listen, name="agent-accept", daemon=True).start()
+
+    def listen(self):
+        while True:
+            try:
+                conn, peer = self.server.accept()
+            except OSError as e:
+                logger.error(f"Failed to accept agent connection: {e}")
+                time.sleep(1)
+                continue
+            if not self.slots.acquire(blocking=False):
+                logger.warning(f"Too many pending agent connections, closing {peer}")
+                conn.close()
+                continue
+            threading.Thread(
+                target=self.handshake, args=(conn, peer), daemon=True
+            ).start()
+
+    def handshake(self, conn: socket.socket, peer):
+        try:
+            conn.settimeout(self.timeout)
+            if self.context is not None:
+                conn = self.context.wrap_socket(conn, server_side=True)
+            if not challenge(conn, self.secret):
+                logger.warning(f"Agent authentication failed for {peer}")
+                conn.close()
+                return
+            conn.settimeout(None)
+        except Exception as e:
+            logger.error(f"Agent connection failed: {e}")
+            conn.close()
+            return
+        finally:
+            self.slots.release()
+        logger.info(f"Agent connection from {peer}")
+        self.queue.put(conn)
+        self.notify.send(b"\x00")
+
+    def accept(self) -> Optional[socket.socket]:
+        self.ready.recv(1)
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+
+def listen(address: str) -> socket.socket:
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX and os.path.exists(addr):
+        os.unlink(addr)
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family != socket.AF_UNIX:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(addr)
+    if family == socket.AF_UNIX:
+        os.chmod(addr, 0o600)
+    server.listen()
+    logger.info(f"Agent listening on {address}")
+    return server
+
+
+def serve(address: str, secret: bytes, tls: Optional[dict] = None, **kwargs):
+    """
+    Run a peer manager agent for remote autopeer instances.
+    Every authenticated connection is served, their commands are executed
+    one at a time so that the peer manager remains the single writer of the
+    router configuration. Connections to tcp addresses use TLS, the
+    certificates are configured in `tls`.
+    """
+    from .peer_manager import PeerManager
+
+    context = None
+    if parse_address(address)[0] != socket.AF_UNIX:
+        context = tls_context(ssl.Purpose.CLIENT_AUTH, tls or {})
+    acceptor = Acceptor(listen(address), secret, context)
+
+    pm = PeerManager(None, **kwargs)
+    signal.signal(signal.SIGTERM, pm.stop)
+    signal.signal(signal.SIGINT, pm.stop)
+    pm.recover()
+    acceptor.start()
+    pm.run(acceptor.ready, acceptor.accept)
@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Iterable, Optional, Tuple
+
+from cachetools import TTLCache
+
+from .events import EventLog
+from .logger import logger
+
+
+def etag(version: int, body: dict) -> str:
+    """
+    Entity tag of a response, the content hash tells apart a peer that was
+    deleted and created again with the same row version.
+    """
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+    return f'"{version}-{digest[:16]}"'
+
+
+def etag_matches(header: Optional[str], tag: str) -> bool:
+    if header is None:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or tag in tags
+
+
+class PeerCache:
+    """
+    Read-through cache of the peer info responses per ASN with their ETag.
+    Entries are dropped by the paths writing peers. In a supervised
+    deployment the changes made by the other workers are picked up by
+    `follow`ing the shared event log, the TTL only bounds the staleness if
+    an event is lost.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 60) -> None:
+        self.entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # the job worker invalidates from its thread
+        self.lock = threading.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    def get(self, asn: int) -> Optional[Tuple[str, dict]]:
+        with self.lock:
+            return self.entries.get(asn)
+
+    def put(self, asn: int, version: int, body: dict) -> str:
+        tag = etag(version, body)
+        with self.lock:
+            self.entries[asn] = (tag, body)
+        return tag
+
+    def invalidate(self, asns: Iterable[int]):
+        with self.lock:
+            for asn in asns:
+                self.entries.pop(asn, None)
+
+    def start(self, events: EventLog):
+        self.task = asyncio.create_task(self.follow(events))
+
+    async def follow(self, events: EventLog):
+        """
+        Drop the entries of every peer appearing in the event log, all the
+        changes to peers are recorded there once committed.
+        """
+        cursor, _ = events.read(None)
+        while True:
+            await asyncio.sleep(events.interval)
+            try:
+                cursor, batch = await asyncio.to_thread(events.read, cursor)
+            except Exception as e:
+                logger.error(f"Failed to follow event log: {e}")
+                continue
+            self.invalidate(
+                event["ASN"] for _, event in batch if event.get("ASN") is not None
+            )
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
@@ -2,27 +2,113 @@ import base64
 import ipaddress
 import json
 import os
+import select
 import socket
-import subprocess
-from typing import Generator, Optional
+import time
+from typing import Callable, Generator, List, Optional
 
-from fastapi import HTTPException
+from starlette.exceptions import HTTPException
 
 from . import max_bytes
+from .client import recv_exact
+from .executor import Executor
+from .journal import Journal
 from .logger import logger
+from .profiler import Sampler
+from .roa import RoaGenerator
 from .schemas import PeerInfo
 from .templates import bgpd_conf, hostname_wg
+from .wg_telemetry import WGTelemetry
+
+# configuration files of the wireguard interfaces
+wg_dir = "/etc/wireguard"
+
+# commands changing the system, recorded in the journal
+journaled = {"wg_create", "wg_delete", "wg_sync", "bgp_update"}
+
+
+def bgpd_config(
+    peers: List[PeerInfo], asn: Optional[int], router_id: Optional[str]
+) -> str:
+    """
+    Render the bgpd configuration of this router for the given peers.
+    """
+    if not asn or not router_id:
+        raise ValueError("asn and router_id must be configured to render bgpd.conf")
+    return bgpd_conf.render(peers=peers, ASN=asn, BGP_ROUTER_ID=router_id)
+
+
+def wg_config(
+    peer: PeerInfo, node: dict, wgkey: str, rdomain: int = 0, mtu: int = 1420
+) -> str:
+    """
+    Render the hostname.if(5) of the interface of a peer from its validated
+    information, the allocation of this node and the local settings.
+    """
+    for key in ("wgid", "wgport", "inet", "inet6"):
+        if node.get(key) is None:
+            raise ValueError(f"Node allocation is missing {key}")
+    return hostname_wg.render(
+        rdomain=rdomain,
+        mtu=mtu,
+        wgkey=wgkey,
+        wgid=node["wgid"],
+        wgport=node["wgport"],
+        inet=node["inet"],
+        inet6=node["inet6"],
+        peer_pubkey=peer.peer_pubkey,
+        peer_psk=peer.peer_psk,
+        peer_ip=peer.peer_ip,
+        peer_port=peer.peer_port,
+        peer_ll4=peer.ll_ip4,
+        peer_ll6=peer.ll_ip6,
+    )
 
 
 class PeerManager:
-    def __init__(self, sock: socket.socket) -> None:
+    def __init__(
+        self,
+        sock: socket.socket,
+        telemetry_interval: int = 60,
+        telemetry_samples: int = 60,
+        journal: Optional[str] = None,
+        registry: Optional[str] = None,
+        roa_file: Optional[str] = None,
+        exec_workers: int = 4,
+        exec_timeout: int = 120,
+        executor: Optional[Executor] = None,
+        asn: Optional[int] = None,
+        router_id: Optional[str] = None,
+        wgkey_file: str = "/etc/wireguard/private.key",
+        rdomain: int = 0,
+        mtu: int = 1420,
+        profile_dir: str = "/var/db/dn42-autopeer/profiles",
+    ) -> None:
         self.sock = sock
+        self.asn = asn
+        self.router_id = router_id
+        self.wgkey_file = wgkey_file
+        self.rdomain = rdomain
+        self.mtu = mtu
+        self.executor = executor or Executor(exec_workers, exec_timeout)
+        self.telemetry = WGTelemetry(telemetry_samples, self.executor)
+        self.telemetry_interval = telemetry_interval
+        self.telemetry_next = time.monotonic()
+        self.journal = Journal(journal) if journal else None
+        self.jid: Optional[int] = None
+        self.roa = RoaGenerator(registry, roa_file) if registry and roa_file else None
+        self.roa_reload = False
+        self.busy = False
+        self.stopping = False
+        self.sampler = Sampler()
+        self.profile_dir = profile_dir
 
     def recv(self):
-        cmd_bytes = self.sock.recv(max_bytes)
-        if not cmd_bytes:
+        try:
+            cmd_bytes = recv_exact(self.sock, max_bytes)
+        except ConnectionError:
             logger.critical("Connection closed while receiving command length")
-            raise ConnectionError
+            raise
         logger.debug(f"Received command length bytes: {cmd_bytes}")
 
         try:
@@ -32,10 +118,11 @@ class PeerManager:
             logger.critical(f"Invalid command length: {cmd_bytes}")
             raise ValueError
 
-        cmd = self.sock.recv(cmd_len)
-        if not cmd:
+        try:
+            cmd = recv_exact(self.sock, cmd_len)
+        except ConnectionError:
             logger.critical("Connection closed while receiving command")
-            raise ConnectionError
+            raise
         logger.debug(f"Received command bytes: {cmd}")
 
         jcmd = json.loads(cmd)
@@ -45,64 +132,230 @@ class PeerManager:
     def send(self, cmd: dict):
         cmd_bytes = json.dumps(cmd).encode()
         cmd_len = len(cmd_bytes).to_bytes(max_bytes)
-        self.sock.send(cmd_len)
-        self.sock.send(cmd_bytes)
+        self.sock.sendall(cmd_len + cmd_bytes)
+
+    def wg_config(self, peer: PeerInfo, node: dict) -> str:
+        # read on every use so that a rotated key is picked up
+        with open(self.wgkey_file) as f:
+            wgkey = f.read().strip()
+        return wg_config(peer, node, wgkey, self.rdomain, self.mtu)
+
+    def collect(self):
+        try:
+            self.telemetry.collect()
+        except Exception as e:
+            logger.error(f"Failed to collect wireguard telemetry: {e}")
+        self.telemetry_next = time.monotonic() + self.telemetry_interval
 
-    def run(self):
+    def run(
+        self,
+        listener: Optional[socket.socket] = None,
+        accept: Optional[Callable[[], Optional[socket.socket]]] = None,
+    ):
+        """
+        Serve commands until the channel closes.
+        With a `listener`, `accept` is called whenever it is readable to add
+        another channel, until it raises ConnectionError. Commands of all
+        channels are executed one at a time in arrival order so the peer
+        manager remains the single writer of the router configuration.
+        """
+        channels = [] if self.sock is None else [self.sock]
         while True:
+            # collect telemetry in between commands once it is due
+            if time.monotonic() >= self.telemetry_next:
+                self.collect()
+            timeout = max(0, self.telemetry_next - time.monotonic())
+            watched = channels if listener is None else [listener, *channels]
+            readable, _, _ = select.select(watched, [], [], 0)
+            if not readable:
+                # idle, the completions of the last commands are made durable
+                # with a single fsync
+                if self.journal is not None:
+                    self.journal.sync()
+                readable, _, _ = select.select(watched, [], [], timeout)
+            for sock in readable:
+                if sock is listener:
+                    try:
+                        channel = accept()
+                    except ConnectionError:
+                        return
+                    if channel is not None:
+                        channels.append(channel)
+                    continue
+                self.sock = sock
+                if self.serve():
+                    if self.stopping:
+                        return
+                    continue
+                channels.remove(sock)
+                sock.close()
+                if listener is None:
+                    return
+
+    def serve(self) -> bool:
+        """
+        Answer one command on the current channel, returns False once the
+        channel is closed.
+        """
+        try:
+            cmd = self.recv()
+        except OSError:
+            return False
+        except ValueError:
+            return True
+        self.busy = True
+        try:
             try:
-                cmd = self.recv()
-            except ConnectionError:
-                break
-            except ValueError:
-                continue
-            try:
-                if "command" not in cmd:
-                    resp = {"success": False, "error": "No command specified"}
-                elif cmd["command"] == "bgp_update":
-                    resp = self.bgp_update(cmd)
-                elif cmd["command"] == "wg_exists":
-                    resp = self.wg_exists(cmd)
-                elif cmd["command"] == "wg_create":
-                    resp = self.wg_create(cmd)
-                elif cmd["command"] == "wg_delete":
-                    resp = self.wg_delete(cmd)
-                else:
-                    resp = {"success": False, "error": "Invalid command"}
-                self.send(resp)
+                resp = self.execute(cmd)
             except Exception as e:
                 logger.error(f"Failed to run command: {e}")
-                self.send({"success": False, "error": str(e)})
+                resp = {"success": False, "error": str(e)}
+            try:
+                self.send(resp)
+            except OSError as e:
+                logger.error(f"Failed to send response: {e}")
+                return False
+            return True
+        finally:
+            self.busy = False
+
+    def stop(self, signum, frame):
+        """
+        Signal handler ending the peer manager, once the command being run
+        completed so that it is never interrupted half-way.
+        """
+        logger.info("Stopping peer manager")
+        self.stopping = True
+        if not self.busy:
+            raise SystemExit(0)
+
+    def handle(self, cmd: dict) -> dict:
+        if "command" not in cmd:
+            return {"success": False, "error": "No command specified"}
+        elif cmd["command"] == "bgp_update":
+            return self.bgp_update(cmd)
+        elif cmd["command"] == "wg_exists":
+            return self.wg_exists(cmd)
+        elif cmd["command"] == "wg_create":
+            return self.wg_create(cmd)
+        elif cmd["command"] == "wg_delete":
+            return self.wg_delete(cmd)
+        elif cmd["command"] == "wg_sync":
+            return self.wg_sync(cmd)
+        elif cmd["command"] == "wg_stats":
+            return self.wg_stats(cmd)
+        elif cmd["command"] == "wg_stale":
+            return self.wg_stale(cmd)
+        elif cmd["command"] == "roa_update":
+            return self.roa_update(cmd)
+        elif cmd["command"] == "exec_stats":
+            return {"success": True, "stats": self.executor.summary()}
+        elif cmd["command"] == "profile":
+            return self.profile(cmd)
+        return {"success": False, "error": "Invalid command"}
+
+    def execute(self, cmd: dict, jid: Optional[int] = None) -> dict:
+        """
+        Run a command, recording the ones changing the system in the journal.
+        """
+        if self.journal is None or cmd.get("command") not in journaled:
+            return self.handle(cmd)
+        self.jid = self.journal.begin(cmd) if jid is None else jid
+        try:
+            return self.handle(cmd)
+        finally:
+            self.journal.done(self.jid)
+            self.jid = None
+
+    def step(self, name: str):
+        if self.jid is not None:
+            self.journal.step(self.jid, name)
+
+    def recover(self):
+        """
+        Finish the operations interrupted by a crash.
+        Only the last bgpd update matters since each one rewrites the whole
+        configuration, an installed but not reloaded config is only reloaded.
+        """
+        if self.journal is None:
+            return
+        pending = self.journal.pending()
+        if not pending:
+            return
+        logger.warning(f"Recovering {len(pending)} interrupted operations")
+        last_bgp = max(
+            (jid for jid, cmd, _ in pending if cmd["command"] == "bgp_update"),
+            default=None,
+        )
+        for jid, cmd, steps in pending:
+            if cmd["command"] == "bgp_update" and jid != last_bgp:
+                self.journal.done(jid)
+                continue
+            if cmd["command"] == "bgp_update" and "installed" in steps:
+                self.jid = jid
+                try:
+                    resp = self.bgp_reload()
+                finally:
+                    self.journal.done(jid)
+                    self.jid = None
+            else:
+                resp = self.execute(cmd, jid)
+            if resp["success"]:
+                logger.info(f"Recovered {cmd['command']} operation {jid}")
+            else:
+                logger.error(
+                    f"Failed to recover {cmd['command']} operation {jid}: "
+                    f"{resp.get('error')}"
+                )
 
     def wg_exists(self, info: dict) -> dict:
+        """
+        Check whether the interface of a peer exists, or with `peers` which
+        of the interfaces of several peers exist, probing them concurrently.
+        """
         try:
+            if "peers" in info:
+                wgids = [entry["node"]["wgid"] for entry in info["peers"]]
+                sps = self.executor.map([["/sbin/ifconfig", f"wg{i}"] for i in wgids])
+                exists = {i: not sp.returncode for i, sp in zip(wgids, sps)}
+                return {"success": True, "exists": exists}
             peer_json = info["peer"]
             peer = PeerInfo.model_validate_json(peer_json)
-            wg_if = f"wg{peer.wgid}"
-            sp = subprocess.run(["/sbin/ifconfig", wg_if], capture_output=True)
+            wg_if = f"wg{info['node']['wgid']}"
+            sp = self.executor.run(["/sbin/ifconfig", wg_if])
             return {"success": not sp.returncode}
         except Exception as e:
             logger.error(f"Failed to check if interface exists: {e}")
             return {"success": False, "error": str(e)}
 
     def wg_create(self, info: dict) -> dict:
+        """
+        Create the interface of a peer, or update it if it exists so that
+        the command can be repeated safely.
+        """
         try:
             peer_json = info["peer"]
             peer = PeerInfo.model_validate_json(peer_json)
             logger.debug("Creating peer: %s", peer)
             peer.dn42_validate()
-            wg_if = f"wg{peer['wgid']}"
-            sp = subprocess.run(["/sbin/ifconfig", f"{wg_if}"], capture_output=True)
-            if not sp.returncode:
-                logger.error(f"Interface {wg_if} already exists")
-                return {"success": False, "error": "Interface already exists"}
-            wg_file = f"/etc/wireguard/wg{peer['wgid']}.conf"
-            wg_data = hostname_wg.render(peer=peer)
+            wg_if = f"wg{info['node']['wgid']}"
+            wg_file = os.path.join(wg_dir, f"wg{info['node']['wgid']}.conf")
+            wg_data = self.wg_config(peer, info["node"])
             with open(wg_file, "w") as f:
                 f.write(wg_data)
-            sp = subprocess.run(
-                ["/bin/sh", "/etc/netstart", f"{wg_if}"], capture_output=True
-            )
+            self.step("written")
+            sp = self.executor.run(["/sbin/ifconfig", f"{wg_if}"])
+            if not sp.returncode:
+                # netstart adds the peer again, drop the old one in case its
+                # key changed
+                logger.info(f"Interface {wg_if} exists, updating it")
+                sp = self.executor.run(["/sbin/ifconfig", f"{wg_if}", "-wgpeerall"])
+                if sp.returncode:
+                    logger.error(
+                        f"Failed to reset interface {wg_if}: {sp.stderr.decode()}"
+                    )
+                    return {"success": False, "error": "Failed to update interface"}
+            sp = self.executor.run(["/bin/sh", "/etc/netstart", f"{wg_if}"])
             if sp.returncode:
                 logger.error(
                     f"Failed to create interface {wg_if}: {sp.stderr.decode()}"
@@ -116,24 +369,62 @@ class PeerManager:
             return {"success": False, "error": str(e)}
         return {"success": True}
 
+    def wg_sync(self, info: dict) -> dict:
+        """
+        Write the configuration of several peers and bring all their
+        interfaces up in a single netstart pass, existing ones are updated.
+        """
+        try:
+            wg_ifs = []
+            for entry in info["peers"]:
+                peer = PeerInfo.model_validate_json(entry["peer"])
+                peer.dn42_validate()
+                wg_file = os.path.join(wg_dir, f"wg{entry['node']['wgid']}.conf")
+                wg_data = self.wg_config(peer, entry["node"])
+                with open(wg_file, "w") as f:
+                    f.write(wg_data)
+                wg_ifs.append(f"wg{entry['node']['wgid']}")
+            self.step("written")
+            if not wg_ifs:
+                return {"success": True}
+            # existing interfaces are updated, as in wg_create
+            sps = self.executor.map([["/sbin/ifconfig", i] for i in wg_ifs])
+            existing = [i for i, sp in zip(wg_ifs, sps) if not sp.returncode]
+            sps = self.executor.map(
+                [["/sbin/ifconfig", i, "-wgpeerall"] for i in existing]
+            )
+            failed = [i for i, sp in zip(existing, sps) if sp.returncode]
+            if failed:
+                logger.error(f"Failed to reset interfaces: {', '.join(failed)}")
+                return {"success": False, "error": "Failed to update interfaces"}
+            sp = self.executor.run(["/bin/sh", "/etc/netstart", *wg_ifs])
+            if sp.returncode:
+                logger.error(f"Failed to create interfaces: {sp.stderr.decode()}")
+                logger.debug(f"Debug output: {sp.stdout.decode()}")
+                return {"success": False, "error": "Failed to create interfaces"}
+        except HTTPException as e:
+            return {"success": False, "error": e.detail}
+        except Exception as e:
+            logger.error(f"Failed to sync peers: {e}")
+            return {"success": False, "error": str(e)}
+        return {"success": True, "interfaces": len(wg_ifs)}
+
     def wg_delete(self, info: dict) -> dict:
         try:
             peer_json = info["peer"]
             peer = PeerInfo.model_validate_json(peer_json)
             logger.debug("Deleting peer: %s", peer)
             peer.dn42_validate()
-            wg_file = f"/etc/wireguard/wg{peer['wgid']}.conf"
+            wg_file = os.path.join(wg_dir, f"wg{info['node']['wgid']}.conf")
             if os.path.isfile(wg_file):
                 logger.debug(f"Deleting wireguard config file {wg_file}")
                 os.unlink(wg_file)
             else:
                 logger.warning(f"Wireguard hostname file {wg_file} does not exist")
-            wg_if = f"wg{peer['wgid']}"
-            sp = subprocess.run(["/sbin/ifconfig", f"{wg_if}"], capture_output=True)
+            wg_if = f"wg{info['node']['wgid']}"
+            sp = self.executor.run(["/sbin/ifconfig", f"{wg_if}"])
             if not sp.returncode:
-                sp = subprocess.run(
-                    ["/sbin/ifconfig", f"{wg_if}", "destroy"], capture_output=True
-                )
+                sp = self.executor.run(["/sbin/ifconfig", f"{wg_if}", "destroy"])
                 if sp.returncode:
                     logger.debug(
                         f"Failed to destroy interface {wg_if}: {sp.stderr.decode()}"
@@ -149,6 +440,71 @@ class PeerManager:
             return {"success": False, "error": str(e)}
         return {"success": True}
 
+    def wg_stats(self, info: dict) -> dict:
+        try:
+            peer_json = info["peer"]
+            peer = PeerInfo.model_validate_json(peer_json)
+            resp = {"success": True, "samples": self.telemetry.stats(peer.peer_pubkey)}
+            if "threshold" in info:
+                stale = self.telemetry.stale(int(info["threshold"]))
+                resp["stale"] = peer.peer_pubkey in stale
+            return resp
+        except Exception as e:
+            logger.error(f"Failed to get wireguard telemetry: {e}")
+            return {"success": False, "error": str(e)}
+
+    def wg_stale(self, info: dict) -> dict:
+        try:
+            threshold = int(info["threshold"])
+            return {"success": True, "stale": self.telemetry.stale(threshold)}
+        except Exception as e:
+            logger.error(f"Failed to get stale wireguard peers: {e}")
+            return {"success": False, "error": str(e)}
+
+    def profile(self, info: dict) -> dict:
+        """
+        Start a sampling profile of the peer manager, the command loop keeps
+        serving while it runs. The stacks are written to a new file of the
+        profile directory, its path is returned.
+        """
+        try:
+            duration = min(max(float(info["duration"]), 0), 300)
+            path = os.path.join(
+                self.profile_dir,
+                f"peer_manager-{os.getpid()}-{int(time.time())}.collapsed",
+            )
+            self.sampler.start(duration, path)
+            return {"success": True, "path": path, "duration": duration}
+        except Exception as e:
+            logger.error(f"Failed to start profile: {e}")
+            return {"success": False, "error": str(e)}
+
+    def roa_update(self, info: dict) -> dict:
+        """
+        Regenerate the ROA set from the registry, bgpd is only reloaded if
+        the generated file changed.
+        """
+        if self.roa is None:
+            return {"success": False, "error": "ROA generation is not configured"}
+        try:
+            start = time.perf_counter()
+            stats = self.roa.update()
+            stats["reloaded"] = False
+            # retry the reload until it succeeded once for the changed file
+            self.roa_reload = self.roa_reload or stats["changed"]
+            if self.roa_reload:
+                resp = self.bgp_reload()
+                if not resp["success"]:
+                    return {**resp, "stats": stats}
+                self.roa_reload = False
+                stats["reloaded"] = True
+            stats["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            logger.debug(f"ROA update: {stats}")
+            return {"success": True, "stats": stats}
+        except Exception as e:
+            logger.error(f"Failed to update ROA set: {e}")
+            return {"success": False, "error": str(e)}
+
     def bgp_update(self, info: dict) -> dict:
         try:
             peers_json = info["peers"]
@@ -157,29 +513,31 @@ class PeerManager:
                 peer.dn42_validate()
             bgpd_file = "/etc/bgpd.conf"
             bgpd_tmp_file = "/tmp/bgpd.conf"
-            bgpd_data = bgpd_conf.render(peers=peers)
+            bgpd_data = bgpd_config(peers, self.asn, self.router_id)
             # write to temp file first
             with open(bgpd_tmp_file, "w") as f:
                 f.write(bgpd_data)
             # test the config
-            sp = subprocess.run(
-                ["/usr/sbin/bgpd", "-f", "-n", f"{bgpd_tmp_file}"], capture_output=True
-            )
+            sp = self.executor.run(["/usr/sbin/bgpd", "-n", "-f", f"{bgpd_tmp_file}"])
             if sp.returncode:
                 logger.error(f"Failed to test bgpd config: {sp.stderr.decode()}")
                 os.unlink(bgpd_tmp_file)
                 return {"success": False, "error": "Failed to test bgpd config"}
             # move the temp file to the real file
             os.rename(bgpd_tmp_file, bgpd_file)
-            # reload bgpd
-            sp = subprocess.run(
-                ["/usr/sbin/rcctl", "reload", "bgpd"], capture_output=True
-            )
+            self.step("installed")
+        except HTTPException as e:
+            return {"success": False, "error": e.detail}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        return self.bgp_reload()
+
+    def bgp_reload(self) -> dict:
+        try:
+            sp = self.executor.run(["/usr/sbin/rcctl", "reload", "bgpd"])
             if sp.returncode:
                 logger.error(f"Failed to reload bgpd: {sp.stderr.decode()}")
                 return {"success": False, "error": "Failed to reload bgpd"}
-        except HTTPException as e:
-            return {"success": False, "error": e.detail}
         except Exception as e:
             return {"success": False, "error": str(e)}
         return {"success": True}
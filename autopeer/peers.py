@@ -0,0 +1,233 @@
+from collections import defaultdict
+from typing import Collection, Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .logger import logger
+from .nodes import NodeRegistry
+
+
+def peer_json(peer: models.PeerInfo) -> str:
+    return schemas.PeerInfo.model_validate(peer, from_attributes=True).model_dump_json()
+
+
+def allocate(session: Session, nodes: NodeRegistry, asn: int) -> Dict[str, dict]:
+    """
+    Allocate the per node wireguard interface of a peer.
+    Existing allocations are kept, new ones use the lowest free interface id
+    and count as configured once the node accepted them.
+    """
+    allocations = {}
+    for node in nodes:
+        row = session.get(models.NodePeer, (node.name, asn))
+        if row is None:
+            used = {
+                wgid
+                for (wgid,) in session.query(models.NodePeer.wgid).filter(
+                    models.NodePeer.node == node.name
+                )
+            }
+            wgid = next(i for i in range(len(used) + 1) if i not in used)
+            row = models.NodePeer(node=node.name, ASN=asn, wgid=wgid, configured=False)
+            session.add(row)
+            session.flush()
+        allocations[node.name] = node.allocation(row.wgid)
+    return allocations
+
+
+def allocations(
+    session: Session, nodes: NodeRegistry, asn: int, configured: bool = True
+) -> Dict[str, dict]:
+    rows = session.query(models.NodePeer).filter(models.NodePeer.ASN == asn)
+    if configured:
+        rows = rows.filter(models.NodePeer.configured)
+    return {
+        row.node: nodes[row.node].allocation(row.wgid)
+        for row in rows
+        if row.node in nodes.nodes
+    }
+
+
+def bgp_update(
+    session: Session, nodes: NodeRegistry, skip: Collection[str] = ()
+) -> Dict[str, dict]:
+    """
+    Rewrite the bgpd configuration of every node not in `skip`, with the
+    peers whose interface the node did not reject.
+    """
+    peers = {peer.ASN: peer_json(peer) for peer in session.query(models.PeerInfo)}
+    rejected = defaultdict(set)
+    rows = session.query(models.NodePeer.node, models.NodePeer.ASN).filter(
+        models.NodePeer.configured.is_(False)
+    )
+    for node, asn in rows:
+        rejected[node].add(asn)
+    return nodes.dispatch(
+        lambda node: (
+            None
+            if node.name in skip
+            else {
+                "command": "bgp_update",
+                "peers": [
+                    jpeer
+                    for asn, jpeer in peers.items()
+                    if asn not in rejected[node.name]
+                ],
+            }
+        )
+    )
+
+
+def store(
+    session: Session, nodes: NodeRegistry, peer_infos: List[schemas.PeerInfo]
+) -> Tuple[Dict[int, tuple], Dict[int, Dict[str, dict]]]:
+    """
+    Store peers and allocate their interfaces in a short transaction of its
+    own, so that no write transaction is held while the nodes are being
+    configured. Returns the previous state of the peers, to `revert` to, and
+    their per node allocations.
+    """
+    previous = {}
+    for peer_info in peer_infos:
+        peer = session.get(models.PeerInfo, peer_info.ASN)
+        rows = (
+            session.query(models.NodePeer.node, models.NodePeer.configured)
+            .filter(models.NodePeer.ASN == peer_info.ASN)
+            .all()
+        )
+        previous[peer_info.ASN] = (
+            None if peer is None else peer_json(peer),
+            {node for node, _ in rows},
+            {node for node, configured in rows if configured},
+        )
+        session.merge(models.PeerInfo(**peer_info.model_dump()))
+    session.flush()
+    allocs = {p.ASN: allocate(session, nodes, p.ASN) for p in peer_infos}
+    session.commit()
+    return previous, allocs
+
+
+def revert(session: Session, previous: Dict[int, tuple]):
+    """
+    Restore the peers stored by `store` once every node rejected them.
+    """
+    for asn, (jpeer, allocated, _) in previous.items():
+        session.query(models.NodePeer).filter(
+            models.NodePeer.ASN == asn, models.NodePeer.node.not_in(allocated)
+        ).delete()
+        if jpeer is None:
+            session.query(models.PeerInfo).filter(models.PeerInfo.ASN == asn).delete()
+        else:
+            peer_info = schemas.PeerInfo.model_validate_json(jpeer)
+            session.merge(models.PeerInfo(**peer_info.model_dump()))
+    session.commit()
+
+
+def record(session: Session, previous: Dict[int, tuple], results: Dict[str, dict]):
+    """
+    Record which nodes configured the interfaces of the peers stored by
+    `store`. A node rejecting an interface it did not have before is left out
+    of the bgpd configuration until the peer is created again.
+    """
+    for asn, (_, _, configured) in previous.items():
+        for name, resp in results.items():
+            row = session.get(models.NodePeer, (name, asn))
+            if row is None:
+                continue
+            if resp.get("success"):
+                row.configured = True
+            elif name not in configured:
+                row.configured = False
+    session.commit()
+
+
+def create_peer(
+    session: Session, nodes: NodeRegistry, peer_info: schemas.PeerInfo
+) -> Dict[str, dict]:
+    """
+    Store a validated peer and configure it on all nodes.
+    Returns the per node results, the peer is kept if at least one node
+    accepted it and only the nodes accepting it get its BGP session.
+    """
+    previous, allocs = store(session, nodes, [peer_info])
+
+    jpeer = peer_info.model_dump_json()
+    wg_results = nodes.dispatch(
+        lambda node: {
+            "command": "wg_create",
+            "peer": jpeer,
+            "node": allocs[peer_info.ASN][node.name],
+        }
+    )
+    failed = NodeRegistry.failed(wg_results)
+    if len(failed) == len(wg_results):
+        revert(session, previous)
+        return wg_results
+    record(session, previous, wg_results)
+
+    results = merge_results(wg_results, bgp_update(session, nodes, skip=failed))
+    for name in NodeRegistry.failed(results):
+        logger.error(f"Failed to create AS{peer_info.ASN} on node {name}")
+    return results
+
+
+def import_peers(
+    session: Session, nodes: NodeRegistry, peer_infos: List[schemas.PeerInfo]
+) -> Dict[str, dict]:
+    """
+    Store a batch of validated peers in a single transaction and configure
+    them with one interface pass and one bgpd reload per node.
+    """
+    previous, allocs = store(session, nodes, peer_infos)
+
+    jpeers = [(p.ASN, p.model_dump_json()) for p in peer_infos]
+    wg_results = nodes.dispatch(
+        lambda node: {
+            "command": "wg_sync",
+            "peers": [
+                {"peer": jpeer, "node": allocs[asn][node.name]} for asn, jpeer in jpeers
+            ],
+        }
+    )
+    failed = NodeRegistry.failed(wg_results)
+    if len(failed) == len(wg_results):
+        revert(session, previous)
+        return wg_results
+    record(session, previous, wg_results)
+
+    return merge_results(wg_results, bgp_update(session, nodes, skip=failed))
+
+
+def merge_results(first: Dict[str, dict], second: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Combine the per node results of two consecutive steps, a node keeps the
+    error of the first step it failed.
+    """
+    return {
+        name: resp if not resp.get("success") else second[name]
+        for name, resp in first.items()
+    }
+
+
+def delete_peer(session: Session, nodes: NodeRegistry, asn: int) -> Dict[str, dict]:
+    """
+    Remove a peer from all nodes and from the database.
+    """
+    peer = session.get(models.PeerInfo, asn)
+    if peer is None:
+        return {}
+    allocs = allocations(session, nodes, asn, configured=False)
+    jpeer = peer_json(peer)
+    results = nodes.dispatch(
+        lambda node: (
+            {"command": "wg_delete", "peer": jpeer, "node": allocs[node.name]}
+            if node.name in allocs
+            else None
+        )
+    )
+    session.query(models.NodePeer).filter(models.NodePeer.ASN == asn).delete()
+    session.delete(peer)
+    session.commit()
+
+    return merge_results(results, bgp_update(session, nodes))
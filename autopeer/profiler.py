@@ -0,0 +1,129 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import FrameType
+from typing import Dict, Optional
+
+from .logger import logger
+
+# stage timings of the request being traced, in milliseconds
+current: ContextVar[Optional[Dict[str, float]]] = ContextVar("trace", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a stage of the request being traced, a no-op outside of one.
+    """
+    trace = current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        trace[name] = trace.get(name, 0) + elapsed
+
+
+class Tracer:
+    """
+    Keeps the stage breakdown of the requests slower than `threshold`
+    milliseconds, the last `keep` of them are kept for the admin API.
+    """
+
+    def __init__(self, threshold: float, keep: int = 100) -> None:
+        self.threshold = threshold
+        self.slow: deque = deque(maxlen=keep)
+
+    def finish(self, method: str, path: str, total: float, trace: Dict[str, float]):
+        if total < self.threshold:
+            return
+        stages = {name: round(ms, 1) for name, ms in trace.items()}
+        stages["other"] = round(max(0, total - sum(trace.values())), 1)
+        self.slow.append(
+            {
+                "time": round(time.time(), 3),
+                "method": method,
+                "path": path,
+                "total_ms": round(total, 1),
+                "stages": stages,
+            }
+        )
+        logger.warning(f"Slow request {method} {path} took {total:.0f}ms: {stages}")
+
+
+def collapse(thread: str, frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        names.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    names.append(thread)
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """
+    Statistical profiler of the threads of this process.
+    A background thread samples their stacks every `interval` seconds for
+    the duration of a profile and writes them as collapsed stacks, the
+    input format of flamegraph.pl and speedscope. Nothing runs in between
+    profiles, and only one profile is taken at a time.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def sample(self, duration: float) -> Counter:
+        stacks: Counter = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    stacks[collapse(names.get(ident, str(ident)), frame)] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    def profile(self, duration: float, path: str) -> dict:
+        """
+        Profile for `duration` seconds and write the stacks to `path`.
+        Raises RuntimeError if a profile is already being taken.
+        """
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            stacks = self.sample(duration)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        finally:
+            self.lock.release()
+        samples = sum(stacks.values())
+        logger.info(f"Wrote profile of {samples} samples to {path}")
+        return {"path": path, "samples": samples, "stacks": len(stacks)}
+
+    def start(self, duration: float, path: str):
+        """
+        Profile in the background, for processes which cannot wait for it.
+        """
+
+        def run():
+            try:
+                self.profile(duration, path)
+            except Exception as e:
+                logger.error(f"Failed to profile: {e}")
+
+        if self.lock.locked():
+            raise RuntimeError("A profile is already running")
+        threading.Thread(target=run, name="profiler", daemon=True).start()
@@ -0,0 +1,222 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Dict, Optional, Tuple
+
+from .logger import logger
+from .utils import DN42
+
+# magic, format version, reserved, registry signature, entry count
+header = struct.Struct(">4sHHQI")
+# ASN, offset of its record
+entry = struct.Struct(">II")
+magic = b"APRS"
+version = 1
+
+source_dirs = ["data/aut-num", "data/person", "data/mntner"]
+
+
+def signature(registry: str) -> int:
+    """
+    Hash of the name, size and modification time of every object the
+    snapshot is compiled from.
+    """
+    h = hashlib.sha256()
+    for d in source_dirs:
+        with os.scandir(os.path.join(registry, d)) as it:
+            for e in sorted(it, key=lambda e: e.name):
+                st = e.stat()
+                h.update(f"{d}/{e.name}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return int.from_bytes(h.digest()[:8])
+
+
+def attribute(path: str, key: str, index: int = 1) -> Optional[str]:
+    """
+    Value of the first `key` attribute of a registry object, the same one
+    the lookups of utils.DN42 use. Attributes without a value are skipped
+    and unreadable objects have none, so one malformed object does not stop
+    the snapshot from being compiled.
+    """
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(f"{key}:"):
+                    fields = line.split()
+                    if len(fields) < 2:
+                        continue
+                    if key == "auth" and fields[1] != "pgp-fingerprint":
+                        continue
+                    return fields[index] if len(fields) > index else None
+    except (OSError, UnicodeDecodeError):
+        pass
+    return None
+
+
+def compile_snapshot(registry: str, path: str) -> int:
+    """
+    Write the ASN to e-mail and PGP fingerprint mapping of the registry to
+    `path`, replacing it atomically. Returns the number of entries.
+    """
+    sig = signature(registry)
+    emails: Dict[str, Optional[str]] = {}
+    fingerprints: Dict[str, Optional[str]] = {}
+    records = []
+    aut_num = os.path.join(registry, "data/aut-num")
+    for name in os.listdir(aut_num):
+        if not name.startswith("AS"):
+            continue
+        try:
+            asn = int(name[2:])
+        except ValueError:
+            continue
+        if asn >= 1 << 32:
+            continue
+        asn_file = os.path.join(aut_num, name)
+        techc = attribute(asn_file, "tech-c")
+        if techc not in emails:
+            person = os.path.join(registry, "data/person", techc or "")
+            emails[techc] = attribute(person, "e-mail") if techc else None
+        mntner = attribute(asn_file, "mnt-by")
+        if mntner not in fingerprints:
+            mnt_file = os.path.join(registry, "data/mntner", mntner or "")
+            fingerprints[mntner] = attribute(mnt_file, "auth", 2) if mntner else None
+        records.append((asn, emails[techc] or "", fingerprints[mntner] or ""))
+    records.sort()
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".registry.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header.pack(magic, version, 0, sig, len(records)))
+            offset = header.size + entry.size * len(records)
+            blobs = []
+            for asn, email, fingerprint in records:
+                blob = b"".join(
+                    struct.pack(">H", len(s)) + s
+                    for s in (email.encode(), fingerprint.encode())
+                )
+                f.write(entry.pack(asn, offset))
+                offset += len(blob)
+                blobs.append(blob)
+            f.writelines(blobs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+    return len(records)
+
+
+class RegistrySnapshot:
+    """
+    Registry lookups served from a memory-mapped snapshot file.
+    The snapshot is a sorted table of ASNs searched in place, so opening it
+    is instant and all processes share its pages through the page cache.
+    Every `check_interval` seconds the file is checked for a replacement
+    and mapped again. ASNs missing from the snapshot, or any ASN while there
+    is no snapshot yet, are looked up in the registry directly.
+    """
+
+    def __init__(self, registry: str, path: str, check_interval: float = 1) -> None:
+        self.registry = registry
+        self.path = path
+        self.check_interval = check_interval
+        self.map: Optional[mmap.mmap] = None
+        self.inode: Optional[int] = None
+        self.count = 0
+        self.checked = 0.0
+
+    def refresh(self) -> bool:
+        """
+        Compile the snapshot again if the registry changed since it was
+        written. Returns whether it was compiled.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                head = f.read(header.size)
+            current = header.unpack(head)
+        except (OSError, struct.error):
+            current = None
+        sig = signature(self.registry)
+        if current and current[:2] == (magic, version) and current[3] == sig:
+            # the modification time tells when the snapshot was last checked
+            os.utime(self.path)
+            return False
+        start = time.perf_counter()
+        count = compile_snapshot(self.registry, self.path)
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(f"Compiled registry snapshot: {count} ASNs in {elapsed:.1f}ms")
+        return True
+
+    def age(self) -> Optional[float]:
+        """
+        Seconds since the snapshot was last checked against the registry,
+        None if there is no snapshot.
+        """
+        try:
+            return time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def open(self):
+        self.checked = time.monotonic()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_ino == self.inode:
+            return
+        with open(self.path, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            file_magic, file_version, _, _, count = header.unpack_from(m)
+        except struct.error:
+            m.close()
+            logger.error(f"Registry snapshot {self.path} is truncated")
+            return
+        if (file_magic, file_version) != (magic, version):
+            m.close()
+            logger.error(f"Registry snapshot {self.path} has an unknown format")
+            return
+        # the previous mapping is left to the garbage collector since a
+        # lookup may still be reading it
+        self.map, self.inode, self.count = m, st.st_ino, count
+
+    def lookup(self, asn: int) -> Optional[Tuple[str, str]]:
+        if time.monotonic() - self.checked >= self.check_interval:
+            self.open()
+        m = self.map
+        if m is None:
+            return None
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key, offset = entry.unpack_from(m, header.size + mid * entry.size)
+            if key < asn:
+                lo = mid + 1
+            elif key > asn:
+                hi = mid
+            else:
+                (n,) = struct.unpack_from(">H", m, offset)
+                email = m[offset + 2 : offset + 2 + n].decode()
+                offset += 2 + n
+                (n,) = struct.unpack_from(">H", m, offset)
+                fingerprint = m[offset + 2 : offset + 2 + n].decode()
+                return email, fingerprint
+        return None
+
+    def email(self, asn: int) -> str:
+        found = self.lookup(asn)
+        if found is None or not found[0]:
+            return DN42.email(self.registry, asn)
+        return found[0]
+
+    def pgp_fingerprint(self, asn: int) -> str:
+        found = self.lookup(asn)
+        if found is None or not found[1]:
+            return DN42.pgp_fingerprint(self.registry, asn)
+        return found[1]
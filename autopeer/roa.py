@@ -0,0 +1,144 @@
+import hashlib
+import ipaddress
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .logger import logger
+
+route_dirs = ["data/route", "data/route6"]
+
+
+class RoaGenerator:
+    """
+    Generates the OpenBGPD roa-set included by bgpd.conf from the route and
+    route6 objects of the registry.
+    Parsed objects are cached by file modification time and size so only
+    changed objects are read again, the output is streamed to a temporary
+    file and only replaces the current one if its hash differs.
+    """
+
+    def __init__(self, registry: str, output: str) -> None:
+        self.registry = registry
+        self.output = output
+        self.cache: Dict[str, Tuple[int, int, List[tuple]]] = {}
+        self.digest: Optional[str] = None
+        self.entries = 0
+        self.dirty = True
+
+    @staticmethod
+    def parse(path: str) -> List[tuple]:
+        prefix = None
+        maxlen = None
+        origins = []
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                value = value.strip()
+                if key in ("route", "route6"):
+                    prefix = ipaddress.ip_network(value)
+                elif key == "max-length":
+                    maxlen = int(value)
+                elif key == "origin":
+                    origins.append(int(value.removeprefix("AS")))
+        if prefix is None:
+            return []
+        maxlen = prefix.prefixlen if maxlen is None else maxlen
+        maxlen = min(max(maxlen, prefix.prefixlen), prefix.max_prefixlen)
+        return [(prefix, maxlen, origin) for origin in origins]
+
+    def scan(self) -> int:
+        """
+        Refresh the cache from the registry, returns the number of objects
+        that had to be parsed.
+        """
+        parsed = 0
+        seen = set()
+        for d in route_dirs:
+            path = os.path.join(self.registry, d)
+            if not os.path.isdir(path):
+                raise RuntimeError(f"Route directory {path} does not exist")
+            with os.scandir(path) as it:
+                for entry in it:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    seen.add(entry.path)
+                    cached = self.cache.get(entry.path)
+                    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                        continue
+                    try:
+                        roas = self.parse(entry.path)
+                    except (ValueError, OSError) as e:
+                        logger.warning(f"Skipping route object {entry.path}: {e}")
+                        roas = []
+                    self.cache[entry.path] = (st.st_mtime_ns, st.st_size, roas)
+                    parsed += 1
+        removed = set(self.cache) - seen
+        for path in removed:
+            del self.cache[path]
+        if parsed or removed:
+            self.dirty = True
+        return parsed
+
+    @staticmethod
+    def lines(roas: List[tuple]):
+        yield "roa-set {\n"
+        for prefix, maxlen, asn in roas:
+            yield f"\t{prefix} maxlen {maxlen} source-as {asn}\n"
+        yield "}\n"
+
+    def write(self) -> Tuple[bool, int]:
+        """
+        Stream the roa-set to the output file.
+        Returns whether the output changed and the number of entries.
+        """
+        roas = sorted(
+            {roa for _, _, entries in self.cache.values() for roa in entries},
+            key=lambda r: (r[0].version, r[0], r[1], r[2]),
+        )
+        if self.digest is None and os.path.isfile(self.output):
+            with open(self.output, "rb") as f:
+                self.digest = hashlib.file_digest(f, "sha256").hexdigest()
+
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(self.output), prefix=".roa-obgp."
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                for line in self.lines(roas):
+                    h.update(line.encode())
+                    f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            if h.hexdigest() == self.digest:
+                os.unlink(tmp)
+                return False, len(roas)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self.output)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self.digest = h.hexdigest()
+        return True, len(roas)
+
+    def update(self) -> dict:
+        start = time.perf_counter()
+        parsed = self.scan()
+        scanned = time.perf_counter()
+        changed = False
+        if self.dirty or self.digest is None:
+            changed, self.entries = self.write()
+            self.dirty = False
+        written = time.perf_counter()
+        return {
+            "objects": len(self.cache),
+            "parsed": parsed,
+            "entries": self.entries,
+            "changed": changed,
+            "scan_ms": round((scanned - start) * 1000, 1),
+            "write_ms": round((written - scanned) * 1000, 1),
+        }
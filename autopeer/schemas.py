@@ -2,8 +2,8 @@ import base64
 import ipaddress
 from typing import Optional
 
-from fastapi import HTTPException
 from pydantic import BaseModel
+from starlette.exceptions import HTTPException
 
 
 class PeerInfo(BaseModel):
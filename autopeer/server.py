@@ -2,17 +2,13 @@ import argparse
 import grp
 import os
 import pwd
+import signal
 import socket
 import sys
 import time
 import tomllib
 
-import uvicorn
-
-from . import settings, sp
-from .logger import logger
-from .peer_manager import PeerManager
-from .webapp import app
+from .logger import logger, setup_logging
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -23,6 +19,21 @@ parser.add_argument(
     default="/etc/autopeer.conf",
 )
 parser.add_argument("-n", action="store_true", help="configtest mode")
+parser.add_argument(
+    "-a", action="store_true", help="agent mode, serve a remote peer manager"
+)
+parser.add_argument(
+    "-i",
+    metavar="file",
+    type=str,
+    help="import peers from an NDJSON file (- for stdin) into a running instance",
+)
+parser.add_argument(
+    "-e",
+    metavar="file",
+    type=str,
+    help="export peers of a running instance to an NDJSON file (- for stdout)",
+)
 parser.add_argument(
     "-d",
     help="debug level",
@@ -33,24 +44,83 @@ parser.add_argument(
 
 def main():
     args = parser.parse_args()
-    logger.setLevel(args.d.upper())
+    setup_logging(args.d.upper())
 
     with open(args.f, "rb") as f:
         config = tomllib.load(f)
 
+    if args.n:
+        from .configtest import ConfigTest
+
+        sys.exit(0 if ConfigTest(config).run() else 1)
+
+    if args.i or args.e:
+        from . import bulk
+        from .nodes import read_secret
+
+        token = read_secret(config["autopeer"]["admin_token_file"])
+        if args.i:
+            ok = bulk.import_file(config, token, args.i)
+        else:
+            ok = bulk.export_file(config, token, args.e)
+        sys.exit(0 if ok else 1)
+
+    if args.a:
+        from .nodes import read_secret, serve
+
+        serve(
+            config["agent"]["listen"],
+            read_secret(config["agent"]["secret_file"]),
+            tls=config["agent"],
+            telemetry_interval=config["agent"].get("telemetry_interval", 60),
+            telemetry_samples=config["agent"].get("telemetry_samples", 60),
+            journal=config["agent"].get("journal"),
+            registry=config["agent"].get("registry"),
+            roa_file=config["agent"].get("roa_file", "/var/db/dn42/roa-obgp.conf"),
+            exec_workers=config["agent"].get("exec_workers", 4),
+            exec_timeout=config["agent"].get("exec_timeout", 120),
+            asn=config["agent"].get("asn"),
+            router_id=config["agent"].get("router_id"),
+            wgkey_file=config["agent"].get("wgkey_file", "/etc/wireguard/private.key"),
+            rdomain=config["agent"].get("rdomain", 0),
+            mtu=config["agent"].get("mtu", 1420),
+            profile_dir=config["agent"].get(
+                "profile_dir", "/var/db/dn42-autopeer/profiles"
+            ),
+        )
+        return
+
+    # with several workers the socketpair is the control channel of the
+    # supervisor, handing every worker its own channel to the peer manager
+    workers = config["uvicorn"].pop("workers", 1)
+    # requests get the same deadline as the drain of the lifespan
+    config["uvicorn"].setdefault(
+        "timeout_graceful_shutdown", config["autopeer"].get("drain_timeout", 30)
+    )
+
+    # the heavy imports are deferred to the branch that needs them, so the
+    # forked peer manager never loads the web stack and vice versa
+    sp = socket.socketpair()
     pid = os.fork()
     if pid < 0:
         logger.critical("Failed to fork")
         sys.exit(1)
     elif pid > 0:
         # parent process
+        import uvicorn
+
+        from .settings import Settings
+        from .webapp import create_app
+
         sp[0].close()
 
         if not "host" in config["uvicorn"]:
             config["uvicorn"]["host"] = "127.0.0.1"
         if not "port" in config["uvicorn"]:
             config["uvicorn"]["port"] = 8000
-        config["uvicorn"]["workers"] = 1
+        if workers > 1:
+            # bound before dropping privileges, shared by all workers
+            listen = uvicorn.Config(None, **config["uvicorn"]).bind_socket()
 
         gid = grp.getgrnam(config["autopeer"]["group"]).gr_gid
         uid = pwd.getpwnam(config["autopeer"]["user"]).pw_uid
@@ -58,16 +128,56 @@ def main():
         os.setgid(gid)
         os.setuid(uid)
 
+        settings = Settings()
         settings.initialize(config["autopeer"])
-        uvicorn.run(app, **config["uvicorn"])
+        if workers > 1:
+            from .supervisor import Supervisor
+
+            Supervisor(settings, config["uvicorn"], sp[1], listen, workers, pid).run()
+            return
+        uvicorn.run(create_app(settings, sp[1]), **config["uvicorn"])
+        os.waitpid(pid, 0)
     else:
         # child process
-        logger.debug("Parent process")
+        from .peer_manager import PeerManager
 
+        logger.debug("Peer manager process")
+
+        # the peer manager exits once the webapp closed its channel, after
+        # the webapp drained, rather than with the commands in flight
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
         sp[1].close()
-        pm = PeerManager(sp[0])
-        pm.run()
-    os.waitpid(pid, 0)
+        pm = PeerManager(
+            sp[0] if workers == 1 else None,
+            telemetry_interval=config["autopeer"].get("telemetry_interval", 60),
+            telemetry_samples=config["autopeer"].get("telemetry_samples", 60),
+            journal=config["autopeer"].get(
+                "journal",
+                os.path.join(config["autopeer"]["db_dir"], "peer_manager.journal"),
+            ),
+            registry=config["autopeer"].get("registry"),
+            roa_file=config["autopeer"].get("roa_file", "/var/db/dn42/roa-obgp.conf"),
+            exec_workers=config["autopeer"].get("exec_workers", 4),
+            exec_timeout=config["autopeer"].get("exec_timeout", 120),
+            asn=config["autopeer"].get("asn"),
+            router_id=config["autopeer"].get("router_id"),
+            wgkey_file=config["autopeer"].get(
+                "wgkey_file", "/etc/wireguard/private.key"
+            ),
+            rdomain=config["autopeer"].get("rdomain", 0),
+            mtu=config["autopeer"].get("mtu", 1420),
+            profile_dir=config["autopeer"].get(
+                "profile_dir", os.path.join(config["autopeer"]["db_dir"], "profiles")
+            ),
+        )
+        pm.recover()
+        if workers > 1:
+            from .supervisor import receive_channel
+
+            pm.run(sp[0], lambda: receive_channel(sp[0]))
+        else:
+            pm.run()
 
 
 if __name__ == "__main__":
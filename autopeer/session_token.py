@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenSigner:
+    """
+    Stateless session tokens, `ASN.expiry.nonce.tag` where the tag is an
+    HMAC-SHA256 of the rest, so verifying a token needs no shared storage.
+    With `single_use`, the nonces of accepted tokens are remembered until
+    they expire so every token is accepted only once by this process. The
+    set is bounded by `max_nonces`, tokens are refused while it is full of
+    unexpired nonces rather than forgetting one that could be replayed.
+    The nonces are not shared between the workers of a supervised
+    deployment, a token can be replayed once against every other worker
+    until it expires, which `ttl` keeps short.
+    """
+
+    def __init__(
+        self,
+        key: bytes,
+        ttl: float = 5,
+        single_use: bool = True,
+        max_nonces: int = 10000,
+    ) -> None:
+        self.key = key
+        self.ttl = ttl
+        self.single_use = single_use
+        self.max_nonces = max_nonces
+        self.nonces: OrderedDict[str, float] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def sign(self, payload: str) -> str:
+        tag = hmac.new(self.key, payload.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(tag).rstrip(b"=").decode()
+
+    def issue(self, asn: int) -> str:
+        expires = int(time.time() + self.ttl)
+        payload = f"{asn}.{expires}.{os.urandom(12).hex()}"
+        return f"{payload}.{self.sign(payload)}"
+
+    def verify(self, asn: int, token: str):
+        """
+        Check a token issued for `asn`, raises ValueError if it is not valid.
+        """
+        payload, _, tag = token.rpartition(".")
+        if not hmac.compare_digest(tag.encode(), self.sign(payload).encode()):
+            raise ValueError("Token is invalid")
+        token_asn, expires, nonce = payload.split(".")
+        if int(token_asn) != asn:
+            raise ValueError("Token is invalid")
+        now = time.time()
+        if int(expires) <= now:
+            raise ValueError("Token has expired")
+        if not self.single_use:
+            return
+
+        with self.lock:
+            # roughly ordered by expiry, an entry kept a little longer is
+            # harmless
+            while self.nonces and next(iter(self.nonces.values())) <= now:
+                self.nonces.popitem(last=False)
+            if nonce in self.nonces:
+                raise ValueError("Token was already used")
+            if len(self.nonces) >= self.max_nonces:
+                raise ValueError("Too many active sessions")
+            self.nonces[nonce] = int(expires)
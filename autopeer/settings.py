@@ -14,11 +14,69 @@ class Settings:
         self.initialized = False
         self.registry = "/var/db/dn42/registry"
         self.db_dir = "/var/db/dn42/db"
+        self.bgpctl = "/usr/sbin/bgpctl"
+        self.bgpd_socket = "/var/www/run/bgpd.rsock"
+        self.status_interval = 30
+        self.stale_threshold = 3 * 86400
+        self.stale_interval = 3600
+        self.stale_gc = False
+        self.local = {}
+        self.nodes = {}
+        self.admin_token_file = None
+        self.job_retention = 7 * 86400
+        self.roa_interval = 3600
+        self.peer_cache_ttl = 60
+        self.event_log = None
+        self.event_log_size = 16 << 20
+        self.session_tokens = "cache"
+        self.token_ttl = 5
+        self.token_single_use = True
+        self.token_key = None
+        self.registry_snapshot = None
+        self.snapshot_interval = 300
+        self.drain_timeout = 30
+        self.slow_request_ms = 1000
+        self.profile_dir = None
 
     def initialize(self, config: dict):
         self.initialized = True
 
         self.registry = config.get("registry", self.registry)
+        self.bgpctl = config.get("bgpctl", self.bgpctl)
+        self.bgpd_socket = config.get("bgpd_socket", self.bgpd_socket)
+        self.status_interval = config.get("status_interval", self.status_interval)
+        self.stale_threshold = config.get("stale_threshold", self.stale_threshold)
+        self.stale_interval = config.get("stale_interval", self.stale_interval)
+        self.stale_gc = config.get("stale_gc", self.stale_gc)
+        self.local = config.get("local", self.local)
+        self.nodes = config.get("nodes", self.nodes)
+        self.admin_token_file = config.get("admin_token_file", self.admin_token_file)
+        self.job_retention = config.get("job_retention", self.job_retention)
+        self.roa_interval = config.get("roa_interval", self.roa_interval)
+        self.peer_cache_ttl = config.get("peer_cache_ttl", self.peer_cache_ttl)
+        self.event_log = config.get(
+            "event_log",
+            os.path.join(config.get("db_dir", self.db_dir), "events.log"),
+        )
+        self.event_log_size = config.get("event_log_size", self.event_log_size)
+        self.session_tokens = config.get("session_tokens", self.session_tokens)
+        if self.session_tokens not in ("cache", "signed"):
+            raise ValueError(f"Invalid session_tokens mode: {self.session_tokens}")
+        self.token_ttl = config.get("token_ttl", self.token_ttl)
+        self.token_single_use = config.get("token_single_use", self.token_single_use)
+        self.registry_snapshot = config.get(
+            "registry_snapshot",
+            os.path.join(config.get("db_dir", self.db_dir), "registry.snapshot"),
+        )
+        self.snapshot_interval = config.get("snapshot_interval", self.snapshot_interval)
+        self.drain_timeout = config.get("drain_timeout", self.drain_timeout)
+        self.slow_request_ms = config.get("slow_request_ms", self.slow_request_ms)
+        self.profile_dir = config.get(
+            "profile_dir",
+            os.path.join(config.get("db_dir", self.db_dir), "profiles"),
+        )
+        # created before the webapp workers are forked so they all share it
+        self.token_key = os.urandom(32)
         self.database = os.path.join(config.get("db_dir", self.db_dir), "peers.db")
         self.db_engine = db.create_engine(f"sqlite:///{self.database}")
         self.session_local = sessionmaker(
@@ -0,0 +1,124 @@
+import os
+import signal
+import socket
+import time
+from typing import Dict, Optional
+
+from .logger import logger
+from .registry_snapshot import RegistrySnapshot
+from .settings import Settings
+
+
+def send_channel(control: socket.socket, channel: socket.socket):
+    socket.send_fds(control, [b"c"], [channel.fileno()])
+
+
+def receive_channel(control: socket.socket) -> Optional[socket.socket]:
+    """
+    Receive the peer manager channel of a new webapp worker, raises
+    ConnectionError once the supervisor is gone.
+    """
+    msg, fds, _, _ = socket.recv_fds(control, 1, 1)
+    if not msg:
+        raise ConnectionError("Supervisor closed the control channel")
+    if not fds:
+        return None
+    logger.debug("Peer manager channel added")
+    return socket.socket(fileno=fds[0])
+
+
+class Supervisor:
+    """
+    Pre-forks the webapp workers of a multi-worker deployment.
+    The workers share the listening socket and each one gets its own channel
+    to the peer manager, handed to it over the control socket, so requests
+    are spread over all cores while peer manager commands stay serialized.
+    Workers that exit are replaced, stopping the supervisor stops them all
+    and closes the control socket, which ends the peer manager.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        uvicorn_config: dict,
+        control: socket.socket,
+        listen: socket.socket,
+        workers: int,
+        pm_pid: Optional[int],
+    ) -> None:
+        self.settings = settings
+        self.uvicorn_config = uvicorn_config
+        self.control = control
+        self.listen = listen
+        self.workers = workers
+        self.pm_pid = pm_pid
+        self.pids: Dict[int, int] = {}
+        self.started: Dict[int, float] = {}
+        self.stopping = False
+
+    def spawn(self, index: int):
+        import uvicorn
+
+        from .webapp import create_app
+
+        ours, theirs = socket.socketpair()
+        send_channel(self.control, ours)
+        ours.close()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self.control.close()
+            app = create_app(self.settings, theirs, worker=index)
+            server = uvicorn.Server(uvicorn.Config(app, **self.uvicorn_config))
+            server.run(sockets=[self.listen])
+            os._exit(0)
+        theirs.close()
+        self.pids[pid] = index
+        self.started[index] = time.monotonic()
+        logger.info(f"Started webapp worker {index} (pid {pid})")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.pids:
+            os.kill(pid, signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # migrate once up front, and leave no database connection behind
+        # to be shared by the forked workers
+        self.settings.migrate()
+        self.settings.db_engine.dispose()
+        # compiled before forking so every worker starts with it mapped
+        if self.settings.registry_snapshot:
+            try:
+                RegistrySnapshot(
+                    self.settings.registry, self.settings.registry_snapshot
+                ).refresh()
+            except Exception as e:
+                logger.error(f"Failed to compile registry snapshot: {e}")
+
+        for index in range(self.workers):
+            self.spawn(index)
+        while self.pids:
+            pid, status = os.waitpid(-1, 0)
+            if pid == self.pm_pid:
+                logger.critical("Peer manager exited, stopping webapp workers")
+                self.pm_pid = None
+                self.stop(None, None)
+                continue
+            index = self.pids.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logger.error(
+                f"Webapp worker {index} exited with status {status}, restarting"
+            )
+            # avoid spinning on a worker failing at startup
+            if time.monotonic() - self.started[index] < 1:
+                time.sleep(1)
+            self.spawn(index)
+
+        self.control.close()
+        if self.pm_pid is not None:
+            os.waitpid(self.pm_pid, 0)
@@ -13,7 +13,7 @@ up
 wgkey {{ wgkey }}
 wgport {{ wgport }}
 
-wgpeer {{ peer_pubkey }} wgendpoint {{ peer_ip }} {{ peer_port }} wgaip {{ peer_aip }} wgaip 172.20.0.0/14 wgaip fd00::/8
+wgpeer {{ peer_pubkey }} wgpsk {{ peer_psk }} wgendpoint {{ peer_ip }} {{ peer_port }} wgaip {{ peer_ll4 }}/32 wgaip {{ peer_ll6 }}/128 wgaip 172.20.0.0/14 wgaip fd00::/8
 
 !route -n -T {{ rdomain }} add -inet -iface {{ peer_ll4 }} {{ inet }}
 !route -n -T {{ rdomain }} add -inet6 {{ peer_ll6 }} {{ inet6 }}%wg{{ wgid }}
@@ -28,10 +28,10 @@ bgpd_conf = Template(
 ASN="{{ ASN }}"
 
 {% for peer in peers %}
-P{{ loop.index }}_descr="{{ peer.asn }}.{{ peer.description }}"
+P{{ loop.index }}_descr="{{ peer.ASN }}.{{ peer.description }}"
 P{{ loop.index }}_remote4="{{ peer.dn42_ip4 }}"
 P{{ loop.index }}_remote6="{{ peer.dn42_ip6 }}"
-P{{ loop.index }}_asn="{{ peer.asn }}"
+P{{ loop.index }}_asn="{{ peer.ASN }}"
 
 {% endfor %}
 ###
@@ -0,0 +1,35 @@
+import time
+
+from . import models
+from .settings import Settings
+
+
+class TokenStore:
+    """
+    Login tokens stored in the database so every webapp worker of a
+    supervised deployment accepts the tokens issued by the others.
+    Indexed like the TTLCache used by a single worker, expired tokens are
+    treated as missing and removed on the next login.
+    """
+
+    def __init__(self, settings: Settings, ttl: float) -> None:
+        self.settings = settings
+        self.ttl = ttl
+
+    def __getitem__(self, asn: int) -> str:
+        with self.settings.session_local() as session:
+            row = session.get(models.LoginToken, asn)
+            if row is None or row.expires <= time.time():
+                raise KeyError(asn)
+            return row.token
+
+    def __setitem__(self, asn: int, token: str):
+        now = time.time()
+        with self.settings.session_local() as session:
+            session.query(models.LoginToken).filter(
+                models.LoginToken.expires <= now
+            ).delete()
+            session.merge(
+                models.LoginToken(ASN=asn, token=token, expires=now + self.ttl)
+            )
+            session.commit()
@@ -83,9 +83,9 @@ class DN42:
         with open(mnt_file) as f:
             for line in f:
                 if line.startswith("auth:"):
-                    auth_type = line.split()[1]
-                    if auth_type == "pgp-fingerprint":
-                        fingerprint = line.split()[2]
+                    fields = line.split()
+                    if len(fields) > 2 and fields[1] == "pgp-fingerprint":
+                        fingerprint = fields[2]
                         logger.debug("ASN %d fingerprint is %s", asn, fingerprint)
                         return fingerprint
         raise RuntimeError(f"PGP fingerprint not found in {mnt_file}")
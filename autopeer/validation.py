@@ -0,0 +1,194 @@
+import ipaddress
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.exceptions import HTTPException
+
+from .schemas import PeerInfo
+
+# columns with a UNIQUE constraint in the peerinfo table
+unique_fields = [
+    "peer_ip",
+    "peer_port",
+    "peer_pubkey",
+    "peer_psk",
+    "ll_ip4",
+    "ll_ip6",
+    "dn42_ip4",
+    "dn42_ip6",
+]
+address_fields = {"peer_ip", "ll_ip4", "ll_ip6", "dn42_ip4", "dn42_ip6"}
+
+
+class PrefixTable:
+    """
+    Set of prefixes stored as (network, netmask) integer pairs per address
+    family, membership is a mask and compare per prefix.
+    """
+
+    def __init__(self, prefixes: Iterable[str]) -> None:
+        self.prefixes = [ipaddress.ip_network(p) for p in prefixes]
+        self.table: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        for net in self.prefixes:
+            self.table[net.version].append((int(net.network_address), int(net.netmask)))
+
+    def __contains__(self, ip: str) -> bool:
+        addr = ipaddress.ip_address(ip)
+        value = int(addr)
+        return any(value & mask == net for net, mask in self.table[addr.version])
+
+    def __str__(self) -> str:
+        return ", ".join(str(net) for net in self.prefixes)
+
+
+prefix_tables = {
+    "dn42_ip4": PrefixTable(["172.20.0.0/14"]),
+    "dn42_ip6": PrefixTable(["fd00::/8"]),
+}
+
+
+def normalize(field: str, value):
+    if field in address_fields:
+        return str(ipaddress.ip_address(value))
+    return value
+
+
+class PeerIndex:
+    """
+    Indexes of the unique values in use, mapping each value to the ASN
+    using it.
+    """
+
+    def __init__(self) -> None:
+        self.owners: Dict[str, Dict[object, int]] = {f: {} for f in unique_fields}
+        self.values: Dict[int, Dict[str, object]] = {}
+
+    @classmethod
+    def load(cls, session) -> "PeerIndex":
+        from . import models
+
+        index = cls()
+        columns = [getattr(models.PeerInfo, f) for f in ["ASN", *unique_fields]]
+        for asn, *values in session.query(*columns):
+            index.add(asn, dict(zip(unique_fields, values)))
+        return index
+
+    @classmethod
+    def lookup(cls, session, peers: Iterable[PeerInfo]) -> "PeerIndex":
+        """
+        Index only the stored peers using one of the unique values of `peers`,
+        with one query on the indexed unique columns instead of loading the
+        whole table.
+        """
+        import sqlalchemy as db
+
+        from . import models
+
+        peers = list(peers)
+        conditions = []
+        for field in unique_fields:
+            candidates = set()
+            for peer in peers:
+                value = getattr(peer, field)
+                if value is None:
+                    continue
+                candidates.add(value)
+                try:
+                    candidates.add(normalize(field, value))
+                except ValueError:
+                    pass
+            if candidates:
+                conditions.append(getattr(models.PeerInfo, field).in_(candidates))
+
+        index = cls()
+        if not conditions:
+            return index
+        columns = [getattr(models.PeerInfo, f) for f in ["ASN", *unique_fields]]
+        for asn, *values in session.query(*columns).filter(db.or_(*conditions)):
+            index.add(asn, dict(zip(unique_fields, values)))
+        return index
+
+    def add(self, asn: int, values: Dict[str, object]):
+        # drop the values the ASN used before, they are being replaced
+        for field, value in self.values.pop(asn, {}).items():
+            if self.owners[field].get(value) == asn:
+                del self.owners[field][value]
+        normalized = {}
+        for field, value in values.items():
+            if value is None:
+                continue
+            try:
+                value = normalize(field, value)
+            except ValueError:
+                pass
+            self.owners[field][value] = asn
+            normalized[field] = value
+        self.values[asn] = normalized
+
+    def owner(self, field: str, value) -> Optional[int]:
+        return self.owners[field].get(value)
+
+
+class PeerValidator:
+    """
+    Validates peers against the DN42 address ranges and the unique values of
+    the stored peers and of the peers validated before them, so a batch is
+    checked in one pass and every conflict is reported.
+    """
+
+    def __init__(self, index: PeerIndex) -> None:
+        self.index = index
+        self.seen: Dict[int, str] = {}
+
+    def validate(self, label: str, peer: PeerInfo) -> List[str]:
+        try:
+            peer.dn42_validate()
+        except HTTPException as e:
+            return [f"{label}: {e.detail}"]
+
+        errors = []
+        if peer.ASN in self.seen:
+            errors.append(
+                f"{label}: AS{peer.ASN} is already listed in {self.seen[peer.ASN]}"
+            )
+
+        for field, table in prefix_tables.items():
+            value = getattr(peer, field)
+            if value not in table:
+                errors.append(f"{label}: {field} {value} is not within {table}")
+
+        values = {field: getattr(peer, field) for field in unique_fields}
+        for field, value in values.items():
+            # the columns are NOT NULL, dn42_validate does not check them all
+            if value is None:
+                errors.append(f"{label}: {field} is required")
+                continue
+            owner = self.index.owner(field, normalize(field, value))
+            if owner is not None and owner != peer.ASN:
+                who = self.seen.get(owner, f"AS{owner}")
+                errors.append(f"{label}: {field} {value} is already used by {who}")
+
+        if not errors:
+            self.seen[peer.ASN] = label
+            self.index.add(peer.ASN, values)
+        return errors
+
+    def validate_batch(
+        self, peers: Iterable[Tuple[str, PeerInfo]]
+    ) -> Tuple[List[PeerInfo], List[str]]:
+        valid = []
+        errors = []
+        for label, peer in peers:
+            peer_errors = self.validate(label, peer)
+            if peer_errors:
+                errors.extend(peer_errors)
+            else:
+                valid.append(peer)
+        return valid, errors
+
+    def check(self, peer: PeerInfo):
+        """
+        Validate a single peer, raising an HTTPException listing all errors.
+        """
+        errors = self.validate(f"AS{peer.ASN}", peer)
+        if errors:
+            raise HTTPException(status_code=400, detail=errors)
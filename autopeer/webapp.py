@@ -1,148 +1,649 @@
-import base64
-import ipaddress
+import asyncio
+import hmac
 import json
+import os
+import socket
+import time
 import uuid
 from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Optional
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from fastapi import Depends, FastAPI, HTTPException
-from pydantic import BaseModel
+from cachetools import TTLCache
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from . import cache, max_bytes, models, schemas, settings, sp
+from . import bulk, models, peers, schemas
+from .bgp_status import BGPStatus
+from .drain import Drain
+from .events import EventLog
+from .jobs import JobQueue
 from .logger import logger
-from .middleware import GPGMiddleware, TokenMiddleware
+from .middleware import (
+    DrainMiddleware,
+    GPGMiddleware,
+    TokenMiddleware,
+    TraceMiddleware,
+)
+from .nodes import NodeRegistry, read_secret
+from .peer_cache import PeerCache, etag_matches
+from .profiler import Sampler, Tracer
+from .registry_snapshot import RegistrySnapshot
+from .session_token import TokenSigner
+from .settings import Settings
+from .token_store import TokenStore
+from .validation import PeerIndex, PeerValidator
 
-app_login = FastAPI()
-app_login.add_middleware(GPGMiddleware, settings=settings)
 
-app_peer = FastAPI()
-app_peer.add_middleware(GPGMiddleware, settings=settings)
-app_peer.add_middleware(TokenMiddleware)
+def verify_admin(request: Request):
+    token = request.app.state.admin_token
+    if token is None:
+        raise HTTPException(status_code=403, detail="Admin access is disabled")
+    header = request.headers.get("X-DN42-Admin-Token", "")
+    if not hmac.compare_digest(header.encode(), token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
 
-scheduler = AsyncIOScheduler()
 
+health_router = APIRouter()
+login_router = APIRouter()
+peer_router = APIRouter()
+admin_router = APIRouter(dependencies=[Depends(verify_admin)])
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    settings.migrate()
-    scheduler.start()
-    yield
-    scheduler.shutdown()
 
+def create_app(
+    settings: Settings, pm_sock: socket.socket, worker: Optional[int] = None
+) -> FastAPI:
+    """
+    Build the autopeer ASGI application.
+    All shared state (settings, token cache, peer manager nodes) is created
+    here and attached to the state of the mounted applications.
+    `pm_sock` is the channel to the peer manager of the local node.
+    `worker` is the index of the webapp worker in a supervised deployment,
+    login tokens are then shared through the database and the background
+    tasks only run in the first worker.
+    """
+    primary = not worker
+    if worker is None:
+        cache = TTLCache(maxsize=1000, ttl=settings.token_ttl)
+    else:
+        cache = TokenStore(settings, ttl=settings.token_ttl)
+    token_signer = None
+    if settings.session_tokens == "signed":
+        token_signer = TokenSigner(
+            settings.token_key, settings.token_ttl, settings.token_single_use
+        )
+    drain = Drain(settings.drain_timeout)
+    sampler = Sampler()
+    nodes = NodeRegistry.from_config(settings.nodes, settings.local, pm_sock, drain)
+    admin_token = None
+    if settings.admin_token_file:
+        admin_token = read_secret(settings.admin_token_file)
+    scheduler = AsyncIOScheduler()
+    roa: dict = {}
+    if settings.roa_interval and primary:
+        scheduler.add_job(
+            update_roa,
+            "interval",
+            args=[nodes, roa],
+            seconds=settings.roa_interval,
+            next_run_time=datetime.now(),
+        )
+    peer_cache = PeerCache(ttl=settings.peer_cache_ttl)
+    events = EventLog(settings.event_log, settings.event_log_size)
+    jobs = JobQueue(
+        settings,
+        nodes,
+        poll=None if worker is None else 1,
+        invalidate=peer_cache.invalidate,
+        events=events,
+    )
+    if primary:
+        scheduler.add_job(jobs.prune, "interval", hours=1)
+        scheduler.add_job(
+            reap_stale_peers,
+            "interval",
+            args=[settings, nodes, jobs, events],
+            seconds=settings.stale_interval,
+        )
+    snapshot = None
+    if settings.registry_snapshot:
+        snapshot = RegistrySnapshot(settings.registry, settings.registry_snapshot)
+        if primary:
+            scheduler.add_job(
+                snapshot.refresh,
+                "interval",
+                seconds=settings.snapshot_interval,
+                next_run_time=datetime.now(),
+            )
+    bgp_status = BGPStatus(settings.bgpctl, settings.bgpd_socket)
+    scheduler.add_job(
+        bgp_status.poll,
+        "interval",
+        seconds=settings.status_interval,
+        next_run_time=datetime.now(),
+    )
 
-app = FastAPI(lifespan=lifespan)
-app.mount("/login", app_login)
-app.mount("/peer", app_peer)
+    app_login = FastAPI()
+    app_login.add_middleware(GPGMiddleware, settings=settings, snapshot=snapshot)
+    app_login.include_router(login_router)
 
+    app_peer = FastAPI()
+    app_peer.add_middleware(GPGMiddleware, settings=settings, snapshot=snapshot)
+    app_peer.add_middleware(TokenMiddleware, cache=cache, signer=token_signer)
+    app_peer.include_router(peer_router)
 
-pm_sock = sp[1]
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        settings.migrate()
+        scheduler.start()
+        events.start()
+        if worker is not None:
+            peer_cache.start(events)
+        if primary:
+            jobs.start()
+        drain.install()
+        yield
+        # uvicorn already waited for the requests, the jobs and peer manager
+        # commands in flight get the rest of the deadline
+        scheduler.shutdown(wait=False)
+        await jobs.stop(drain.remaining())
+        await asyncio.to_thread(drain.wait)
+        await peer_cache.stop()
+        await events.stop()
 
+    app_admin = FastAPI()
+    app_admin.include_router(admin_router)
 
-def pm_send(cmd: dict):
-    cmd_bytes = json.dumps(cmd).encode()
-    cmd_len = len(cmd_bytes).to_bytes(max_bytes)
-    pm_sock.send(cmd_len)
-    pm_sock.send(cmd_bytes)
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(DrainMiddleware, drain=drain)
+    tracer = Tracer(settings.slow_request_ms)
+    if settings.slow_request_ms:
+        app.add_middleware(TraceMiddleware, tracer=tracer)
+    app.include_router(health_router)
+    app.mount("/login", app_login)
+    app.mount("/peer", app_peer)
+    app.mount("/admin", app_admin)
 
+    for a in (app, app_login, app_peer, app_admin):
+        a.state.settings = settings
+        a.state.cache = cache
+        a.state.nodes = nodes
+        a.state.admin_token = admin_token
+        a.state.jobs = jobs
+        a.state.roa = roa
+        a.state.scheduler = scheduler
+        a.state.bgp_status = bgp_status
+        a.state.peer_cache = peer_cache
+        a.state.events = events
+        a.state.token_signer = token_signer
+        a.state.snapshot = snapshot
+        a.state.drain = drain
+        a.state.tracer = tracer
+        a.state.sampler = sampler
 
-def pm_recv() -> dict:
-    rsp_bytes = pm_sock.recv(max_bytes)
-    try:
-        rsp_len = int.from_bytes(rsp_bytes)
-    except ValueError:
-        logger.critical(f"Invalid command length: {rsp_bytes}")
-        raise ValueError
-    rsp_json = pm_sock.recv(rsp_len)
-    try:
-        rsp = json.loads(rsp_json)
-        if "success" not in rsp:
-            logger.critical(f"Invalid response: {rsp}")
-            return {"success": False, "error": "Invalid response from peer manager"}
-        return rsp
-    except json.JSONDecodeError:
-        logger.critical(f"Invalid response: {rsp_json}")
-        return {"success": False, "error": "Invalid response from peer manager"}
-    except Exception as e:
-        logger.error(f"Failed to decode response: {e}")
-        return {"success": False, "error": str(e)}
+    return app
 
 
-def get_db():
-    db = settings.session_local()
+def get_db(request: Request):
+    db = request.app.state.settings.session_local()
     try:
         yield db
     finally:
         db.close()
 
 
-@app_login.post("/")
+def get_settings(request: Request) -> Settings:
+    return request.app.state.settings
+
+
+def get_nodes(request: Request) -> NodeRegistry:
+    return request.app.state.nodes
+
+
+def get_jobs(request: Request) -> JobQueue:
+    return request.app.state.jobs
+
+
+def get_cache(request: Request) -> TTLCache:
+    return request.app.state.cache
+
+
+def get_bgp_status(request: Request) -> BGPStatus:
+    return request.app.state.bgp_status
+
+
+def get_peer_cache(request: Request) -> PeerCache:
+    return request.app.state.peer_cache
+
+
+def get_events(request: Request) -> EventLog:
+    return request.app.state.events
+
+
+def get_drain(request: Request) -> Drain:
+    return request.app.state.drain
+
+
+def signer(request: Request) -> Optional[str]:
+    return getattr(request.state, "signer", None)
+
+
+def conditional(request: Request, tag: str, body: dict) -> Response:
+    """
+    Answer with `body` and its ETag, or with 304 Not Modified if the client
+    already has it.
+    """
+    if etag_matches(request.headers.get("If-None-Match"), tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    return JSONResponse(body, headers={"ETag": tag})
+
+
+def readiness(
+    settings: Settings, nodes: NodeRegistry, snapshot: Optional[RegistrySnapshot]
+) -> dict:
+    """
+    Check the database, the freshness of the registry snapshot and the
+    liveness of the local peer manager.
+    """
+    checks = {}
+    try:
+        with settings.session_local() as session:
+            session.execute(text("SELECT 1"))
+        checks["database"] = True
+    except Exception as e:
+        logger.error(f"Database is not answering: {e}")
+        checks["database"] = False
+    if snapshot is not None:
+        # refreshed every snapshot_interval by the primary worker
+        age = snapshot.age()
+        checks["registry_snapshot"] = (
+            age is not None and age < 2 * settings.snapshot_interval + 60
+        )
+    checks["peer_manager"] = nodes["local"].ping()
+    return checks
+
+
+def reap_stale_peers(
+    settings: Settings, nodes: NodeRegistry, jobs: JobQueue, events: EventLog
+):
+    """
+    Report peers whose wireguard tunnels have been idle on every node for
+    longer than the stale threshold and, if enabled, queue their deletion.
+    Peers with a job pending are left alone, the job decides their fate.
+    """
+    results = nodes.dispatch(
+        {"command": "wg_stale", "threshold": settings.stale_threshold}
+    )
+    failed = NodeRegistry.failed(results)
+    if failed:
+        logger.error(f"Failed to get stale peers from nodes: {', '.join(failed)}")
+        return
+    stale = set.intersection(*(set(resp["stale"]) for resp in results.values()))
+    if not stale:
+        return
+
+    with settings.session_local() as session:
+        stale_peers = (
+            session.query(models.PeerInfo)
+            .filter(models.PeerInfo.peer_pubkey.in_(stale))
+            .all()
+        )
+        for peer in stale_peers:
+            logger.warning(f"Peer AS{peer.ASN} is stale")
+        if not settings.stale_gc:
+            return
+
+        pending = {
+            asn
+            for (asn,) in session.query(models.Job.ASN).filter(
+                models.Job.state.in_(["queued", "running"])
+            )
+        }
+        for peer in stale_peers:
+            if peer.ASN in pending:
+                logger.info(f"Not reaping AS{peer.ASN}, a job is pending")
+                continue
+            job = jobs.submit(session, "delete", peer.ASN)
+            events.record("reap", peer.ASN, job=job.id)
+            logger.info(f"Queued deletion of stale peer AS{peer.ASN}")
+
+
+def update_roa(nodes: NodeRegistry, roa: dict):
+    """
+    Regenerate the ROA set on every node and keep the latest results.
+    """
+    results = nodes.dispatch({"command": "roa_update"})
+    for name in NodeRegistry.failed(results):
+        logger.error(
+            f"Failed to update ROA set on {name}: {results[name].get('error')}"
+        )
+    roa.clear()
+    roa.update(results)
+
+
+@health_router.get("/healthz")
+async def autopeer_healthz():
+    """
+    Liveness probe, answered as long as the process serves requests.
+    """
+    return {"status": "ok"}
+
+
+@health_router.get("/readyz")
+async def autopeer_readyz(request: Request):
+    """
+    Readiness probe, fails while draining or if any check fails.
+    """
+    state = request.app.state
+    checks = await asyncio.to_thread(
+        readiness, state.settings, state.nodes, state.snapshot
+    )
+    ready = not state.drain.draining and all(checks.values())
+    return JSONResponse(
+        {"ready": ready, "draining": state.drain.draining, "checks": checks},
+        status_code=200 if ready else 503,
+    )
+
+
+@login_router.post("/")
 async def autopeer_login(
-    peer_info: schemas.PeerInfo, session: Session = Depends(get_db)
+    request: Request,
+    peer_info: schemas.PeerInfo,
+    session: Session = Depends(get_db),
+    cache: TTLCache = Depends(get_cache),
+    events: EventLog = Depends(get_events),
 ):
     """
     Login to the autopeering service.
-    Creates a new session token that is valid for one minute.
+    Creates a new session token that is valid for `token_ttl` seconds.
     """
+    events.record("login", peer_info.ASN, signer=signer(request))
+    token_signer = request.app.state.token_signer
+    if token_signer is not None:
+        return {"token": token_signer.issue(peer_info.ASN)}
     token = uuid.uuid4()
     cache[peer_info.ASN] = f"{token}"
     return {"token": f"{token}"}
 
 
-@app_peer.post("/info")
-async def autopeer_get(peer_info: schemas.PeerInfo, session: Session = Depends(get_db)):
+@peer_router.post("/info")
+async def autopeer_get(
+    request: Request,
+    peer_info: schemas.PeerInfo,
+    session: Session = Depends(get_db),
+    nodes: NodeRegistry = Depends(get_nodes),
+    peer_cache: PeerCache = Depends(get_peer_cache),
+):
     """
     Get peering information for given ASN.
+    Responses are cached until the peer changes and carry an ETag, a
+    matching If-None-Match is answered with 304 Not Modified.
     """
-    peer = (
-        session.query(models.PeerInfo)
-        .filter(models.PeerInfo.ASN == peer_info.ASN)
-        .first()
-    )
-    logger.debug(f"Peer info: {peer}")
-    return {"message": f"Autopeering with ASN {peer_info.ASN}"}
+    entry = peer_cache.get(peer_info.ASN)
+    if entry is None:
+        peer = session.get(models.PeerInfo, peer_info.ASN)
+        logger.debug(f"Peer info: {peer}")
+        body = {
+            "message": f"Autopeering with ASN {peer_info.ASN}",
+            "peer": None,
+            "nodes": peers.allocations(session, nodes, peer_info.ASN),
+        }
+        version = 0
+        if peer is not None:
+            body["peer"] = schemas.PeerInfo.model_validate(
+                peer, from_attributes=True
+            ).model_dump(mode="json")
+            version = peer.version
+        entry = (peer_cache.put(peer_info.ASN, version, body), body)
+    return conditional(request, *entry)
 
 
-@app_peer.post("/create")
-async def autopeer_create(
-    peer_info: schemas.PeerInfo, session: Session = Depends(get_db)
+@peer_router.post("/status")
+async def autopeer_status(
+    request: Request,
+    peer_info: schemas.PeerInfo,
+    bgp_status: BGPStatus = Depends(get_bgp_status),
+):
+    """
+    Get the BGP session state for given ASN.
+    The state is served from a cache refreshed in the background, its ETag
+    changes with every refresh.
+    """
+    return conditional(request, *bgp_status.tagged(peer_info.ASN))
+
+
+@peer_router.post("/telemetry")
+async def autopeer_telemetry(
+    peer_info: schemas.PeerInfo,
+    session: Session = Depends(get_db),
+    nodes: NodeRegistry = Depends(get_nodes),
+    settings: Settings = Depends(get_settings),
 ):
     """
-    Create or update a peering session with the given ASN.
+    Get the wireguard handshake and traffic history for given ASN on every node.
     """
-    # validate that peer information is valid
+    peer = session.get(models.PeerInfo, peer_info.ASN)
+    if peer is None:
+        raise HTTPException(status_code=404, detail="Peer not found")
 
-    peer_info.dn42_validate()
+    # the peer managers are waited for off the event loop
+    results = await asyncio.to_thread(
+        nodes.dispatch,
+        {
+            "command": "wg_stats",
+            "peer": peers.peer_json(peer),
+            "threshold": settings.stale_threshold,
+        },
+    )
+    return {"ASN": peer_info.ASN, "nodes": results}
 
-    jinfo = {"command": "create", "peer_info": peer_info.model_dump()}
-    pm_send(jinfo)
-    resp = pm_recv()
 
-    logger.debug(f"Received response: {resp}")
+@peer_router.post("/create", status_code=202)
+async def autopeer_create(
+    request: Request,
+    peer_info: schemas.PeerInfo,
+    session: Session = Depends(get_db),
+    jobs: JobQueue = Depends(get_jobs),
+    events: EventLog = Depends(get_events),
+):
+    """
+    Create or update a peering session with the given ASN on all nodes.
+    The request is validated and queued, its progress is reported by
+    /peer/job/{job_id}.
+    """
+    # validate that peer information is valid and does not conflict with
+    # the other peers, only the peers sharing one of its values are read
+    index = await asyncio.to_thread(PeerIndex.lookup, session, [peer_info])
+    PeerValidator(index).check(peer_info)
 
-    return {"message": f"Autopeering with ASN {peer_info.ASN}"}
+    job = jobs.submit(session, "create", peer_info.ASN, peer_info.model_dump_json())
+    events.record("create", peer_info.ASN, signer=signer(request), job=job.id)
+    return JobQueue.status(job)
 
 
-@app_peer.delete("/delete")
+@peer_router.delete("/delete", status_code=202)
 async def autopeer_delete(
-    peer_info: schemas.PeerInfo, session: Session = Depends(get_db)
+    request: Request,
+    peer_info: schemas.PeerInfo,
+    session: Session = Depends(get_db),
+    jobs: JobQueue = Depends(get_jobs),
+    events: EventLog = Depends(get_events),
 ):
     """
-    Delete peering session with the given ASN.
+    Delete peering session with the given ASN from all nodes.
+    The request is queued, its progress is reported by /peer/job/{job_id}.
     """
     logger.debug(f"Peer info: {peer_info}")
-    jinfo = {"command": "delete", "ASN": peer_info.ASN}
-    pm_send(jinfo)
-    try:
-        resp = pm_recv()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting peer: {e}")
+    if session.get(models.PeerInfo, peer_info.ASN) is None:
+        raise HTTPException(status_code=404, detail="Peer not found")
+
+    job = jobs.submit(session, "delete", peer_info.ASN)
+    events.record("delete", peer_info.ASN, signer=signer(request), job=job.id)
+    return JobQueue.status(job)
+
+
+@peer_router.post("/job/{job_id}")
+async def autopeer_job(
+    job_id: int, peer_info: schemas.PeerInfo, session: Session = Depends(get_db)
+):
+    """
+    Get the state of a queued peer operation of the given ASN.
+    """
+    job = session.get(models.Job, job_id)
+    if job is None or job.ASN != peer_info.ASN:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobQueue.status(job)
+
 
-    success = resp.get("success", False)
-    if not success:
+@admin_router.post("/import")
+async def autopeer_import(
+    request: Request,
+    session: Session = Depends(get_db),
+    nodes: NodeRegistry = Depends(get_nodes),
+    peer_cache: PeerCache = Depends(get_peer_cache),
+    events: EventLog = Depends(get_events),
+):
+    """
+    Import peers from a stream of NDJSON PeerInfo records.
+    All records are validated before anything is stored, valid imports are
+    stored in one transaction and applied with a single interface pass and
+    bgpd reload per node.
+    """
+    # the records are not known before they are streamed, every stored peer
+    # is indexed, off the event loop
+    validator = PeerValidator(await asyncio.to_thread(PeerIndex.load, session))
+    peer_infos, errors = await bulk.read_peers(request.stream(), validator)
+    if errors:
+        raise HTTPException(status_code=400, detail=errors)
+    if not peer_infos:
+        return {"success": True, "imported": 0, "nodes": {}}
+
+    results = await asyncio.to_thread(peers.import_peers, session, nodes, peer_infos)
+    peer_cache.invalidate(p.ASN for p in peer_infos)
+    failed = NodeRegistry.failed(results)
+    for p in peer_infos:
+        events.record("import", p.ASN, success=len(failed) < len(results))
+    if len(failed) == len(results):
         raise HTTPException(
             status_code=500,
-            detail=f'Error deleting peer: {resp.get("message", "unknown error")}',
+            detail=f"Error importing peers on nodes: {', '.join(failed)}",
         )
-    return {"success": True, "message": f"ASN {peer_info.ASN} deleted"}
+    return {"success": not failed, "imported": len(peer_infos), "nodes": results}
+
+
+@admin_router.get("/export")
+async def autopeer_export(settings: Settings = Depends(get_settings)):
+    """
+    Export all peers as a stream of NDJSON PeerInfo records.
+    """
+
+    def rows():
+        with settings.session_local() as session:
+            for peer in session.query(models.PeerInfo).yield_per(bulk.batch_size):
+                yield peers.peer_json(peer) + "\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+@admin_router.get("/roa")
+async def autopeer_roa(request: Request):
+    """
+    Get the result, object counts and timing of the last ROA set update on
+    every node.
+    """
+    return request.app.state.roa
+
+
+@admin_router.get("/exec")
+async def autopeer_exec(nodes: NodeRegistry = Depends(get_nodes)):
+    """
+    Get the count, timeouts and latency of the commands run by the peer
+    manager of every node.
+    """
+    return await asyncio.to_thread(nodes.dispatch, {"command": "exec_stats"})
+
+
+@admin_router.get("/events")
+async def autopeer_events(
+    request: Request,
+    cursor: Optional[str] = None,
+    timeout: float = 30,
+    events: EventLog = Depends(get_events),
+    drain: Drain = Depends(get_drain),
+):
+    """
+    Tail the event log.
+    Clients accepting text/event-stream get the events as server-sent
+    events, resuming after Last-Event-ID. Otherwise the request is held until
+    there are events after `cursor` or `timeout` seconds passed; without a
+    cursor only events logged from now on are returned.
+    """
+    if "text/event-stream" in request.headers.get("accept", ""):
+        position = request.headers.get("Last-Event-ID", cursor)
+
+        async def stream():
+            nonlocal position
+            if position is None:
+                position, _ = events.read(None)
+            while not drain.draining and not await request.is_disconnected():
+                position, batch = await asyncio.to_thread(events.read, position)
+                for event_id, event in batch:
+                    yield f"id: {event_id}\ndata: {json.dumps(event)}\n\n"
+                if not batch:
+                    yield ": keepalive\n\n"
+                    await asyncio.sleep(events.interval)
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    deadline = asyncio.get_running_loop().time() + min(max(timeout, 0), 60)
+    while True:
+        cursor, batch = await asyncio.to_thread(events.read, cursor)
+        if batch or drain.draining or asyncio.get_running_loop().time() >= deadline:
+            return {"cursor": cursor, "events": [event for _, event in batch]}
+        await asyncio.sleep(events.interval)
+
+
+@admin_router.post("/profile")
+async def autopeer_profile(
+    request: Request,
+    duration: float = 10,
+    target: str = "webapp",
+    settings: Settings = Depends(get_settings),
+    nodes: NodeRegistry = Depends(get_nodes),
+):
+    """
+    Take a sampling profile of this webapp worker, or of the peer manager
+    of the node named by `target`, and write it as collapsed stacks. The
+    webapp answers once the profile is written to the profile directory, a
+    peer manager profiles in the background to a file of its own profile
+    directory and answers with its path.
+    """
+    duration = min(max(duration, 0), 300)
+    if target == "webapp":
+        path = os.path.join(
+            settings.profile_dir, f"webapp-{os.getpid()}-{int(time.time())}.collapsed"
+        )
+        try:
+            return await asyncio.to_thread(
+                request.app.state.sampler.profile, duration, path
+            )
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    try:
+        node = nodes[target]
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Node not found")
+    cmd = {"command": "profile", "duration": duration}
+    return await asyncio.to_thread(node.request, cmd)
+
+
+@admin_router.get("/slow")
+async def autopeer_slow(request: Request):
+    """
+    Get the stage breakdown of the last requests slower than the
+    slow_request_ms threshold, oldest first.
+    """
+    return list(request.app.state.tracer.slow)
@@ -0,0 +1,94 @@
+import re
+import subprocess
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional
+
+from .executor import Executor
+from .logger import logger
+
+re_interface = re.compile(r"^(wg\d+): flags=")
+re_wgpeer = re.compile(r"^\s+wgpeer (\S+)")
+re_traffic = re.compile(r"^\s+tx: (\d+), rx: (\d+)")
+re_handshake = re.compile(r"^\s+last handshake: (\d+) seconds ago")
+
+
+class Sample(NamedTuple):
+    time: float
+    interface: str
+    handshake_age: Optional[int]
+    tx: int
+    rx: int
+
+
+class WGTelemetry:
+    """
+    Handshake and traffic counters of all wireguard peers.
+    A single `ifconfig wg` pass collects every interface, the samples are kept
+    in a fixed size ring buffer per peer public key.
+    """
+
+    def __init__(self, samples: int = 60, executor: Optional[Executor] = None) -> None:
+        self.samples = samples
+        self.executor = executor or Executor(workers=1)
+        self.series: Dict[str, Deque[Sample]] = {}
+        self.first_seen: Dict[str, float] = {}
+
+    def collect(self):
+        now = time.time()
+        try:
+            # parsed while ifconfig writes, the listing is never held whole
+            samples = self.parse(self.executor.lines(["/sbin/ifconfig", "wg"]), now)
+        except subprocess.CalledProcessError as e:
+            logger.debug(f"Failed to list wireguard interfaces: {e.stderr.decode()}")
+            return
+        seen = set()
+        for pubkey, sample in samples.items():
+            seen.add(pubkey)
+            self.first_seen.setdefault(pubkey, now)
+            series = self.series.setdefault(pubkey, deque(maxlen=self.samples))
+            series.append(sample)
+        # forget peers whose interface is gone
+        for pubkey in set(self.series) - seen:
+            del self.series[pubkey]
+            del self.first_seen[pubkey]
+
+    @staticmethod
+    def parse(lines: Iterable[str], now: float) -> Dict[str, Sample]:
+        peers: Dict[str, Sample] = {}
+        interface = pubkey = None
+        for line in lines:
+            if m := re_interface.match(line):
+                interface, pubkey = m.group(1), None
+            elif m := re_wgpeer.match(line):
+                pubkey = m.group(1)
+                peers[pubkey] = Sample(now, interface, None, 0, 0)
+            elif pubkey is None:
+                continue
+            elif m := re_traffic.match(line):
+                peers[pubkey] = peers[pubkey]._replace(
+                    tx=int(m.group(1)), rx=int(m.group(2))
+                )
+            elif m := re_handshake.match(line):
+                peers[pubkey] = peers[pubkey]._replace(handshake_age=int(m.group(1)))
+        return peers
+
+    def stats(self, pubkey: str) -> List[dict]:
+        return [s._asdict() for s in self.series.get(pubkey, [])]
+
+    def stale(self, threshold: int) -> List[str]:
+        """
+        Public keys of peers without a handshake in the last `threshold` seconds.
+        Peers that never completed a handshake are stale once their interface
+        has existed for longer than the threshold.
+        """
+        now = time.time()
+        stale = []
+        for pubkey, series in self.series.items():
+            last = series[-1]
+            if last.handshake_age is None:
+                if now - self.first_seen[pubkey] > threshold:
+                    stale.append(pubkey)
+            elif last.handshake_age + (now - last.time) > threshold:
+                stale.append(pubkey)
+        return stale
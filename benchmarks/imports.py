@@ -0,0 +1,88 @@
+"""
+Import time of the autopeer entry points, each measured in fresh
+interpreters, with the slowest top-level imports reported by -X importtime.
+
+    python benchmarks/imports.py [-n 5] [--top 5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+modules = [
+    "autopeer",
+    "autopeer.client",
+    "autopeer.configtest",
+    "autopeer.peer_manager",
+    "autopeer.server",
+    "autopeer.webapp",
+]
+
+
+def wall(code: str, n: int) -> float:
+    """
+    Median wall time of running `code` in a new interpreter, in ms.
+    """
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def importtime(code: str) -> dict:
+    """
+    Cumulative import time of the top-level packages imported by `code`,
+    in ms.
+    """
+    sp = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=root,
+    )
+    cumulative = {}
+    for line in sp.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        _, _, rest = line.partition("import time:")
+        fields = [f.strip() for f in rest.split("|")]
+        if len(fields) != 3 or not fields[1].isdigit():
+            continue
+        name = fields[2]
+        # only the packages imported directly at the top level
+        if name.startswith(" ") or "." in name.strip():
+            continue
+        cumulative[name.strip()] = int(fields[1]) / 1000
+    return cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", type=int, default=5, help="runs per module")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports shown")
+    args = parser.parse_args()
+
+    baseline = wall("pass", args.n)
+    # imported by the interpreter startup already, e.g. site
+    startup = importtime("pass")
+    print(f"{'interpreter':<24} {baseline:8.1f}ms")
+    for module in modules:
+        elapsed = wall(f"import {module}", args.n) - baseline
+        imported = importtime(f"import {module}")
+        slowest = sorted(
+            (item for item in imported.items() if item[0] not in startup),
+            key=lambda item: -item[1],
+        )
+        heavy = ", ".join(f"{name} {ms:.0f}ms" for name, ms in slowest[: args.top])
+        print(f"{module:<24} {elapsed:8.1f}ms  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Cost of a login and of the session check of the following request, for the
+stateless signed tokens and the tokens stored in the database that are
+shared by the workers of a supervised deployment.
+
+    python benchmarks/tokens.py [-n 2000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cachetools import TTLCache
+
+from autopeer.session_token import TokenSigner
+from autopeer.settings import Settings
+from autopeer.token_store import TokenStore
+
+
+def measure(name: str, n: int, login, check):
+    """
+    Log `n` peers in and check their tokens, printing the mean cost of each.
+    """
+    asns = range(4242420000, 4242420000 + n)
+    start = time.perf_counter()
+    tokens = [login(asn) for asn in asns]
+    issued = time.perf_counter()
+    for asn, token in zip(asns, tokens):
+        check(asn, token)
+    checked = time.perf_counter()
+    print(
+        f"{name:<8} login {(issued - start) / n * 1e6:8.1f}us"
+        f"  check {(checked - issued) / n * 1e6:8.1f}us"
+    )
+
+
+def cached(cache):
+    def login(asn: int) -> str:
+        token = f"{uuid.uuid4()}"
+        cache[asn] = token
+        return token
+
+    def check(asn: int, token: str):
+        if cache[asn] != token:
+            raise ValueError("Token is invalid")
+
+    return login, check
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", type=int, default=2000, help="logins to measure")
+    args = parser.parse_args()
+
+    # every token stays unexpired for the whole run
+    signer = TokenSigner(os.urandom(32), ttl=60, max_nonces=args.n)
+    measure("signed", args.n, signer.issue, signer.verify)
+    measure("cache", args.n, *cached(TTLCache(maxsize=args.n, ttl=60)))
+    with tempfile.TemporaryDirectory() as db_dir:
+        settings = Settings()
+        settings.initialize({"db_dir": db_dir})
+        settings.migrate()
+        measure("database", args.n, *cached(TokenStore(settings, ttl=60)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import pytest
+
+from autopeer.configtest import sample_peer
+from autopeer.nodes import Node, NodeRegistry
+from autopeer.settings import Settings
+
+
+class FakeNode(Node):
+    """
+    Node answering every command with `handler` instead of a peer manager.
+    """
+
+    def __init__(self, name: str, handler) -> None:
+        super().__init__(name, address="unix:/nonexistent", inet="172.22.109.97")
+        self.handler = handler
+
+    def request(self, cmd: dict) -> dict:
+        return self.handler(cmd)
+
+
+@pytest.fixture
+def settings(tmp_path):
+    settings = Settings()
+    settings.initialize({"db_dir": str(tmp_path)})
+    settings.migrate()
+    return settings
+
+
+@pytest.fixture
+def registry():
+    """
+    Build a registry of nodes "a" and "b" answering with `handler`, or with
+    the handler of each node name if it is a dict.
+    """
+
+    def build(handler) -> NodeRegistry:
+        handlers = (
+            handler if isinstance(handler, dict) else dict.fromkeys("ab", handler)
+        )
+        return NodeRegistry([FakeNode(name, h) for name, h in handlers.items()])
+
+    return build
+
+
+@pytest.fixture
+def make_peer():
+    """
+    Build the PeerInfo fields of the `n`th of a set of peers not conflicting
+    with each other, the first one is the configtest sample peer.
+    """
+
+    def make(n: int = 1, **fields) -> dict:
+        key = chr(ord("A") + n - 1) * 43 + "="
+        return {
+            **sample_peer,
+            "ASN": 4242420000 + n,
+            "peer_ip": f"192.0.2.{n}",
+            "peer_port": 20000 + n,
+            "peer_pubkey": key,
+            "peer_psk": key,
+            "ll_ip4": f"169.254.0.{n}",
+            "ll_ip6": f"fe80::{n}",
+            "dn42_ip4": f"172.20.0.{n}",
+            "dn42_ip6": f"fd00::{n}",
+            **fields,
+        }
+
+    return make
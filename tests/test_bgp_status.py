@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+from autopeer.bgp_status import BGPStatus
+
+neighbors = {
+    "neighbors": [
+        {
+            "remote_as": "4242420001",
+            "remote_addr": "fe80::1%wg0",
+            "description": "4242420001.alice",
+            "state": "Established",
+            "last_updown": "01:02:03",
+            "last_updown_sec": 3723,
+            "stats": {"prefixes": {"received": 812, "sent": 4}},
+        },
+        {
+            "remote_as": "4242420002",
+            "remote_addr": "fe80::2%wg1",
+            "description": "4242420002.bob",
+            "state": "Idle",
+            "last_updown": "Never",
+        },
+        {
+            "remote_as": "4242420001",
+            "remote_addr": "172.20.0.1",
+            "description": "4242420001.alice",
+            "state": "Active",
+        },
+        {"remote_as": "not an ASN", "state": "Established"},
+    ]
+}
+
+# stands in for bgpctl: relays its arguments to bgpd and prints the answer
+fake_bgpctl = """#!{python}
+import socket
+import sys
+
+args = sys.argv[1:]
+with socket.socket(socket.AF_UNIX) as s:
+    s.connect(args[args.index("-s") + 1])
+    s.sendall(" ".join(args).encode() + b"\\n")
+    sys.stdout.buffer.write(s.makefile("rb").read())
+"""
+
+
+@pytest.fixture
+def bgpd(tmp_path):
+    """
+    Fake bgpd control socket answering every connection with canned
+    `bgpctl -j show neighbor` output, the requests are recorded.
+    """
+    path = str(tmp_path / "bgpd.rsock")
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(path)
+    server.listen()
+    requests = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                requests.append(conn.makefile("rb").readline().decode().strip())
+                conn.sendall(json.dumps(neighbors).encode())
+
+    threading.Thread(target=serve, daemon=True).start()
+    bgpctl = tmp_path / "bgpctl"
+    bgpctl.write_text(fake_bgpctl.format(python=sys.executable))
+    os.chmod(bgpctl, 0o755)
+    yield str(bgpctl), path, requests
+    server.close()
+
+
+def test_poll_parses_sessions(bgpd):
+    bgpctl, path, requests = bgpd
+    status = BGPStatus(bgpctl, path)
+    asyncio.run(status.poll())
+
+    assert requests == [f"-j -s {path} show neighbor"]
+    assert status.updated > 0
+    assert sorted(status.peers) == [4242420001, 4242420002]
+    alice = status.peers[4242420001]
+    assert [s["state"] for s in alice] == ["Established", "Active"]
+    assert alice[0] == {
+        "remote_addr": "fe80::1%wg0",
+        "description": "4242420001.alice",
+        "state": "Established",
+        "last_updown": "01:02:03",
+        "last_updown_sec": 3723,
+        "prefixes_received": 812,
+        "prefixes_sent": 4,
+    }
+    bob = status.get(4242420002)
+    assert bob["sessions"][0]["state"] == "Idle"
+    assert bob["sessions"][0]["prefixes_received"] is None
+    assert status.get(4242420003)["sessions"] == []
+
+
+def test_failed_poll_keeps_cache(bgpd):
+    bgpctl, path, _ = bgpd
+    status = BGPStatus(bgpctl, path)
+    asyncio.run(status.poll())
+    peers, updated = status.peers, status.updated
+
+    status.bgpctl = "/bin/false"
+    asyncio.run(status.poll())
+    assert status.peers is peers
+    assert status.updated == updated
+
+
+def test_tagged_until_next_poll(bgpd):
+    bgpctl, path, _ = bgpd
+    status = BGPStatus(bgpctl, path)
+    asyncio.run(status.poll())
+
+    tag, body = status.tagged(4242420001)
+    assert status.tagged(4242420001) == (tag, body)
+    assert body == status.get(4242420001)
+    asyncio.run(status.poll())
+    assert status.responses == {}
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+from autopeer import bulk, models, peers
+from autopeer.nodes import NodeRegistry
+from autopeer.schemas import PeerInfo
+from autopeer.validation import PeerIndex, PeerValidator
+
+
+def read(chunks, validator=None):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    return asyncio.run(
+        bulk.read_peers(stream(), validator or PeerValidator(PeerIndex()))
+    )
+
+
+def ndjson(*records) -> bytes:
+    return b"".join(json.dumps(r).encode() + b"\n" for r in records)
+
+
+def test_lines_split_across_chunks(make_peer):
+    data = ndjson(make_peer(1)) + b"\n" + ndjson(make_peer(2))
+    valid, errors = read([data[:10], data[10:57], data[57:]])
+    assert errors == []
+    assert [p.ASN for p in valid] == [4242420001, 4242420002]
+
+
+def test_validation_errors(make_peer, monkeypatch):
+    monkeypatch.setattr(bulk, "batch_size", 2)
+    data = (
+        ndjson(make_peer(1))
+        + b"{not json\n"
+        + ndjson(make_peer(3, ASN="AS1"))
+        + ndjson(make_peer(4, peer_port=20001))
+        + ndjson(make_peer(5, dn42_ip4="10.0.0.1"))
+        + ndjson(make_peer(6))
+    )
+    valid, errors = read([data])
+    assert [p.ASN for p in valid] == [4242420001, 4242420006]
+    # every line is reported, with its line number
+    assert [e.split(":")[0] for e in errors] == [
+        "line 2",
+        "line 3",
+        "line 4",
+        "line 5",
+    ]
+    assert "line 4: peer_port 20001 is already used by line 1" in errors
+    assert "line 5: dn42_ip4 10.0.0.1 is not within 172.20.0.0/14" in errors
+
+
+def test_conflict_with_stored_peer(settings, make_peer):
+    with settings.session_local() as session:
+        session.add(models.PeerInfo(**make_peer(1)))
+        session.commit()
+        validator = PeerValidator(PeerIndex.load(session))
+    # updating a stored peer is not a conflict, reusing its values is
+    valid, errors = read([ndjson(make_peer(2, ll_ip6="fe80::1"))], validator)
+    assert valid == []
+    assert errors == ["line 1: ll_ip6 fe80::1 is already used by AS4242420001"]
+    valid, errors = read([ndjson(make_peer(1, description="new"))], validator)
+    assert errors == []
+    assert [p.ASN for p in valid] == [4242420001]
+
+
+def test_rejected_import_is_reverted(settings, registry, make_peer):
+    ok = registry(lambda cmd: {"success": True, "peers": []})
+    rejected = registry(lambda cmd: {"success": False, "error": "no"})
+    with settings.session_local() as session:
+        peers.import_peers(session, ok, [PeerInfo(**make_peer(1))])
+        batch = [
+            PeerInfo(**make_peer(1, description="updated")),
+            PeerInfo(**make_peer(2)),
+        ]
+        results = peers.import_peers(session, rejected, batch)
+        assert NodeRegistry.failed(results) == ["a", "b"]
+
+        session.expire_all()
+        assert session.get(models.PeerInfo, 4242420001).description == "configtest"
+        assert session.get(models.PeerInfo, 4242420002) is None
+        rows = session.query(models.NodePeer.node, models.NodePeer.ASN).all()
+        assert sorted(rows) == [("a", 4242420001), ("b", 4242420001)]
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from autopeer.drain import Drain
+from autopeer.middleware import DrainMiddleware
+from autopeer.webapp import health_router
+
+
+def test_wait_for_inflight_work():
+    drain = Drain(timeout=5)
+    started = threading.Event()
+
+    def command():
+        with drain.track("commands"):
+            started.set()
+            time.sleep(0.1)
+
+    thread = threading.Thread(target=command)
+    thread.start()
+    started.wait()
+    drain.start()
+    assert drain.draining
+    assert drain.wait()
+    assert drain.inflight == {"requests": 0, "commands": 0}
+    thread.join()
+
+
+def test_wait_gives_up_at_deadline():
+    drain = Drain(timeout=0.1)
+    release = threading.Event()
+
+    def request():
+        with drain.track("requests"):
+            release.wait()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    while not drain.inflight["requests"]:
+        time.sleep(0.01)
+    drain.start()
+    # a second signal does not push the deadline back
+    time.sleep(0.05)
+    drain.start()
+    start = time.monotonic()
+    assert not drain.wait()
+    assert time.monotonic() - start < 0.1
+    release.set()
+    thread.join()
+
+
+def test_probes_while_draining(settings, registry):
+    alive = {"success": True}
+    drain = Drain()
+    app = FastAPI()
+    app.add_middleware(DrainMiddleware, drain=drain)
+    app.include_router(health_router)
+    app.get("/work")(lambda: {"draining": drain.draining})
+    app.state.settings = settings
+    app.state.nodes = registry({"local": lambda cmd: alive})
+    app.state.snapshot = None
+    app.state.drain = drain
+    client = TestClient(app)
+
+    assert client.get("/work").json() == {"draining": False}
+    rsp = client.get("/readyz")
+    assert rsp.status_code == 200
+    assert rsp.json()["checks"] == {"database": True, "peer_manager": True}
+
+    alive = {"success": False}
+    rsp = client.get("/readyz")
+    assert rsp.status_code == 503
+    assert rsp.json()["checks"]["peer_manager"] is False
+
+    alive = {"success": True}
+    drain.start()
+    rsp = client.get("/work")
+    assert rsp.status_code == 503
+    assert rsp.headers["Retry-After"] == "1"
+    # the probes are still answered, readiness reports the drain
+    rsp = client.get("/readyz")
+    assert rsp.status_code == 503
+    assert rsp.json()["draining"] is True
+    assert client.get("/healthz").status_code == 200
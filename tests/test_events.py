@@ -0,0 +1,70 @@
+import pytest
+
+from autopeer.events import EventLog
+
+
+def log(events: EventLog, *asns: int):
+    for asn in asns:
+        events.record("create", asn)
+    events.flush()
+
+
+def asns(batch) -> list:
+    return [event["ASN"] for _, event in batch]
+
+
+def test_read_follows_cursor(tmp_path):
+    events = EventLog(str(tmp_path / "events.log"))
+    assert events.read(None) == ("0:0", [])
+    log(events, 1)
+    cursor, batch = events.read(None)
+    assert batch == []
+
+    log(events, 2, 3)
+    cursor, batch = events.read(cursor)
+    assert asns(batch) == [2, 3]
+    assert batch[-1][0] == cursor
+    # every event carries the cursor to resume after it
+    assert asns(events.read(batch[0][0])[1]) == [3]
+    assert events.read(cursor) == (cursor, [])
+
+
+def test_read_across_rotation(tmp_path):
+    events = EventLog(str(tmp_path / "events.log"), keep=2)
+    log(events, 1)
+    cursor, _ = events.read(None)
+    log(events, 2)
+    # rotated by every batch from now on
+    events.max_size = 1
+    log(events, 3)
+    # the cursor points into events.log.1 now
+    cursor, batch = events.read(cursor)
+    assert asns(batch) == [2, 3]
+
+    # older than the last rotation, reading starts over with the current log
+    log(events, 4)
+    log(events, 5)
+    cursor, batch = events.read(cursor)
+    assert asns(batch) == [5]
+    assert events.read(cursor) == (cursor, [])
+
+
+def test_partial_batch_is_not_read(tmp_path):
+    events = EventLog(str(tmp_path / "events.log"))
+    log(events, 1)
+    cursor, _ = events.read(None)
+    with open(events.path, "ab") as f:
+        f.write(b'{"time":1,"event":"create","ASN":2')
+    assert events.read(cursor) == (cursor, [])
+
+
+@pytest.mark.parametrize(
+    "cursor", ["", "garbage", "{ino}:x", "{ino}:-5", "{ino}:", ":", "1:2:3"]
+)
+def test_malformed_cursor_reads_from_start(tmp_path, cursor):
+    events = EventLog(str(tmp_path / "events.log"))
+    log(events, 1, 2)
+    ino = events.read(None)[0].partition(":")[0]
+    cursor, batch = events.read(cursor.format(ino=ino))
+    assert asns(batch) == [1, 2]
+    assert cursor == batch[-1][0]
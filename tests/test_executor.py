@@ -0,0 +1,41 @@
+import os
+import time
+
+from autopeer.executor import Executor
+
+
+def alive(pid: int) -> bool:
+    # zombies are not running, they only wait for init to reap them
+    if os.path.isdir("/proc/self"):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                return f.read().split(") ")[1][0] != "Z"
+        except FileNotFoundError:
+            return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_background_child_does_not_delay_exit():
+    executor = Executor()
+    start = time.monotonic()
+    sp = executor.run(["sh", "-c", "sleep 5 & echo started"], timeout=2)
+    assert time.monotonic() - start < 1
+    assert sp.returncode == 0
+    assert sp.stdout == b"started\n"
+
+
+def test_timeout_kills_process_group():
+    executor = Executor()
+    sp = executor.run(["sh", "-c", "sleep 30 & echo $!; wait"], timeout=0.5)
+    assert sp.returncode == -9
+    assert b"killed after 0.5s" in sp.stderr
+    assert executor.summary()["sh"]["timeouts"] == 1
+    pid = int(sp.stdout)
+    deadline = time.monotonic() + 2
+    while alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not alive(pid)
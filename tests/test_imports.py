@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# packages outside the standard library each entry point may pull in, the
+# web stack, database and gnupg must stay out of the forked peer manager and
+# the command line modes
+allowed = {
+    "autopeer": set(),
+    "autopeer.client": set(),
+    "autopeer.configtest": set(),
+    "autopeer.peer_manager": {
+        "annotated_types",
+        "jinja2",
+        "markupsafe",
+        "pydantic",
+        "pydantic_core",
+        "starlette",
+        "typing_extensions",
+        "typing_inspection",
+    },
+}
+
+script = """
+import sys
+before = set(sys.modules)
+import {module}
+for name in sorted({{m.split(".")[0] for m in set(sys.modules) - before}}):
+    if name not in sys.stdlib_module_names and not name.startswith("_"):
+        print(name)
+"""
+
+
+@pytest.mark.parametrize("module", sorted(allowed))
+def test_lazy_imports(module):
+    sp = subprocess.run(
+        [sys.executable, "-c", script.format(module=module)],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    imported = set(sp.stdout.split()) - {"autopeer"}
+    assert imported <= allowed[module], imported - allowed[module]
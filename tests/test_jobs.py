@@ -0,0 +1,124 @@
+import asyncio
+import json
+import time
+
+from autopeer import models
+from autopeer.jobs import JobQueue
+from autopeer.schemas import PeerInfo
+
+
+def ok(cmd):
+    return {"success": True}
+
+
+def drain(jobs: JobQueue, settings, job_ids):
+    """
+    Run the worker of `jobs` until none of `job_ids` is queued or running.
+    """
+
+    async def run():
+        jobs.start()
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            with settings.session_local() as session:
+                states = [session.get(models.Job, i).state for i in job_ids]
+            if all(state in ("done", "failed") for state in states):
+                break
+        await jobs.stop(5)
+
+    asyncio.run(run())
+
+
+def test_jobs_run_in_submission_order(settings, registry, make_peer):
+    sent = []
+
+    def handler(cmd):
+        if cmd["command"] in ("wg_create", "wg_delete"):
+            sent.append((cmd["command"], PeerInfo.model_validate_json(cmd["peer"]).ASN))
+        return {"success": True}
+
+    alice, bob = PeerInfo(**make_peer(1)), PeerInfo(**make_peer(2))
+    jobs = JobQueue(settings, registry({"a": handler}))
+    with settings.session_local() as session:
+        ids = [
+            jobs.submit(session, "create", bob.ASN, bob.model_dump_json()).id,
+            jobs.submit(session, "create", alice.ASN, alice.model_dump_json()).id,
+            jobs.submit(session, "delete", bob.ASN).id,
+            jobs.submit(session, "delete", bob.ASN).id,
+        ]
+    drain(jobs, settings, ids)
+
+    assert sent == [
+        ("wg_create", bob.ASN),
+        ("wg_create", alice.ASN),
+        ("wg_delete", bob.ASN),
+    ]
+    with settings.session_local() as session:
+        states = [session.get(models.Job, i).state for i in ids]
+        assert states == ["done", "done", "done", "failed"]
+        result = json.loads(session.get(models.Job, ids[3]).result)
+        assert result == {"success": False, "error": "Peer not found"}
+
+
+def test_prune_keeps_recent_and_pending_jobs(settings, registry):
+    settings.job_retention = 60
+    jobs = JobQueue(settings, registry(ok))
+    old = time.time() - 120
+    with settings.session_local() as session:
+        for asn, state, updated in [
+            (1, "done", old),
+            (2, "failed", old),
+            (3, "done", time.time()),
+            (4, "queued", old),
+            (5, "running", old),
+        ]:
+            session.add(
+                models.Job(
+                    ASN=asn, command="delete", state=state, created=old, updated=updated
+                )
+            )
+        session.commit()
+    jobs.prune()
+    with settings.session_local() as session:
+        assert sorted(j.ASN for j in session.query(models.Job)) == [3, 4, 5]
+
+
+def test_interrupted_job_is_run_again(settings, registry, make_peer):
+    peer = PeerInfo(**make_peer(1))
+    jobs = JobQueue(settings, registry(ok))
+    with settings.session_local() as session:
+        job = jobs.submit(session, "create", peer.ASN, peer.model_dump_json())
+        job_id = job.id
+    assert jobs.claim() == job_id
+
+    # restarted while the job was running
+    jobs = JobQueue(settings, registry(ok))
+    drain(jobs, settings, [job_id])
+    with settings.session_local() as session:
+        job = session.get(models.Job, job_id)
+        assert job.state == "done"
+        assert json.loads(job.result)["success"]
+        assert session.get(models.PeerInfo, peer.ASN) is not None
+
+
+def test_conflicting_queued_creates(settings, registry, make_peer):
+    # both requests were validated before either job ran
+    first = PeerInfo(**make_peer(1))
+    second = PeerInfo(**make_peer(2, peer_port=first.peer_port))
+    jobs = JobQueue(settings, registry(ok))
+    with settings.session_local() as session:
+        ids = [
+            jobs.submit(session, "create", p.ASN, p.model_dump_json()).id
+            for p in (first, second)
+        ]
+    for job_id in ids:
+        jobs.run(jobs.claim())
+
+    with settings.session_local() as session:
+        assert session.get(models.Job, ids[0]).state == "done"
+        job = session.get(models.Job, ids[1])
+        assert job.state == "failed"
+        assert json.loads(job.result)["error"] == (
+            f"AS{second.ASN}: peer_port 20001 is already used by AS{first.ASN}"
+        )
+        assert session.get(models.PeerInfo, second.ASN) is None
@@ -0,0 +1,103 @@
+import subprocess
+
+from autopeer import peer_manager
+from autopeer.configtest import sample_peer
+from autopeer.executor import FakeExecutor
+from autopeer.journal import Journal
+from autopeer.peer_manager import PeerManager
+from autopeer.schemas import PeerInfo
+
+node = {"wgid": 3, "wgport": 20003, "inet": "172.22.109.97", "inet6": "fe80::4242"}
+wg_create = {
+    "command": "wg_create",
+    "peer": PeerInfo(**sample_peer).model_dump_json(),
+    "node": node,
+}
+
+
+def test_pending_after_reload(tmp_path):
+    path = str(tmp_path / "journal")
+    journal = Journal(path)
+    first = journal.begin({"command": "wg_delete"})
+    journal.step(first, "removed")
+    journal.done(first)
+    second = journal.begin({"command": "bgp_update"})
+    journal.step(second, "installed")
+    journal.close()
+
+    journal = Journal(path)
+    assert journal.pending() == [(second, {"command": "bgp_update"}, ["installed"])]
+    assert journal.begin({"command": "wg_sync"}) == second + 1
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    path = tmp_path / "journal"
+    journal = Journal(str(path))
+    jid = journal.begin({"command": "wg_create"})
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"id":1,"op":"st')
+
+    # the completion is not glued to the torn entry and lost
+    journal = Journal(str(path))
+    journal.done(jid)
+    journal.close()
+    assert path.read_text().splitlines()[-1] == '{"id":1,"op":"done"}'
+    assert Journal(str(path)).pending() == []
+
+
+def test_sync_after_done(tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path / "journal"))
+    synced = []
+    monkeypatch.setattr("os.fsync", synced.append)
+    for _ in range(3):
+        journal.done(journal.begin({"command": "wg_sync"}))
+    # one fsync per begin, the completions share one
+    assert len(synced) == 3
+    journal.sync()
+    journal.sync()
+    assert len(synced) == 4
+
+
+def test_compact(tmp_path):
+    path = tmp_path / "journal"
+    journal = Journal(str(path), max_size=64)
+    first = journal.begin({"command": "wg_sync", "peers": ["x" * 64]})
+    journal.done(first)
+    assert path.stat().st_size == 0
+    journal.done(journal.begin({"command": "wg_sync"}))
+    journal.close()
+    assert Journal(str(path)).pending() == []
+
+
+def test_recover(tmp_path, monkeypatch):
+    path = str(tmp_path / "journal")
+    journal = Journal(path)
+    journal.begin(wg_create)
+    journal.begin({"command": "bgp_update", "peers": []})
+    last = journal.begin({"command": "bgp_update", "peers": []})
+    journal.step(last, "installed")
+    journal.close()
+
+    def handler(args):
+        # the interface does not exist yet
+        failed = args[0] == "/sbin/ifconfig"
+        return subprocess.CompletedProcess(args, int(failed), b"", b"")
+
+    key = tmp_path / "private.key"
+    key.write_text("PRIVATEKEY=\n")
+    monkeypatch.setattr(peer_manager, "wg_dir", str(tmp_path))
+    executor = FakeExecutor(handler)
+    pm = PeerManager(None, journal=path, executor=executor, wgkey_file=str(key))
+    pm.recover()
+
+    # the interface is created again, the installed bgpd config only reloaded
+    # and the superseded update dropped
+    assert executor.commands == [
+        ["/sbin/ifconfig", "wg3"],
+        ["/bin/sh", "/etc/netstart", "wg3"],
+        ["/usr/sbin/rcctl", "reload", "bgpd"],
+    ]
+    assert (tmp_path / "wg3.conf").exists()
+    pm.journal.close()
+    assert Journal(path).pending() == []
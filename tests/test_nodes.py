@@ -0,0 +1,264 @@
+import json
+import multiprocessing
+import os
+import select
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+import pytest
+
+from autopeer.client import recv_exact
+from autopeer.configtest import sample_peer
+from autopeer.nodes import (
+    Acceptor,
+    Node,
+    NodeRegistry,
+    authenticate,
+    challenge,
+    listen,
+    tls_context,
+)
+from autopeer.schemas import PeerInfo
+
+secret = b"s" * 32
+
+
+def handshake(controller_secret: bytes, agent_secret: bytes):
+    controller, agent = socket.socketpair()
+    result = {}
+
+    def run():
+        result["agent"] = challenge(agent, agent_secret)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        authenticate(controller, controller_secret)
+    finally:
+        thread.join()
+        controller.close()
+        agent.close()
+    return result["agent"]
+
+
+def test_handshake():
+    assert handshake(secret, secret)
+
+
+def test_handshake_wrong_secret():
+    with pytest.raises(PermissionError):
+        handshake(b"x" * 32, secret)
+
+
+def openssl(*args):
+    subprocess.run(["openssl", *args], check=True, capture_output=True)
+
+
+@pytest.fixture(scope="module")
+def certs(tmp_path_factory):
+    """
+    CA with an agent certificate for localhost, a controller certificate and
+    a controller certificate signed by another CA.
+    """
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is not available")
+    d = tmp_path_factory.mktemp("certs")
+    for ca in ("ca", "rogue"):
+        openssl(
+            "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", f"/CN={ca}", "-keyout", d / f"{ca}.key", "-out", d / f"{ca}.crt",
+        )  # fmt: skip
+    for name, ca in (("agent", "ca"), ("controller", "ca"), ("intruder", "rogue")):
+        openssl(
+            "req", "-newkey", "rsa:2048", "-nodes", "-subj", f"/CN={name}",
+            "-keyout", d / f"{name}.key", "-out", d / f"{name}.csr",
+        )  # fmt: skip
+        ext = d / f"{name}.ext"
+        ext.write_text("subjectAltName=DNS:localhost\n")
+        openssl(
+            "x509", "-req", "-in", d / f"{name}.csr", "-days", "1",
+            "-CA", d / f"{ca}.crt", "-CAkey", d / f"{ca}.key", "-CAcreateserial",
+            "-extfile", ext, "-out", d / f"{name}.crt",
+        )  # fmt: skip
+
+    def config(name: str) -> dict:
+        return {
+            "tls_cert": str(d / f"{name}.crt"),
+            "tls_key": str(d / f"{name}.key"),
+            "tls_ca": str(d / "ca.crt"),
+        }
+
+    return config
+
+
+def agent(config: dict):
+    """
+    One shot agent answering a single command with its name.
+    """
+    context = tls_context(ssl.Purpose.CLIENT_AUTH, config)
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    errors = []
+
+    def run():
+        conn, _ = server.accept()
+        try:
+            with context.wrap_socket(conn, server_side=True) as tls:
+                assert challenge(tls, secret)
+                cmd = json.loads(recv_exact(tls, int.from_bytes(recv_exact(tls, 8))))
+                rsp = json.dumps({"success": True, "data": cmd["command"]}).encode()
+                tls.sendall(len(rsp).to_bytes(8) + rsp)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            server.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return server.getsockname()[1], thread, errors
+
+
+def node(port: int, config: dict, secret_file) -> Node:
+    secret_file.write_bytes(secret)
+    return Node.from_config(
+        "remote",
+        {
+            "address": f"tcp:127.0.0.1:{port}",
+            "secret_file": str(secret_file),
+            "tls_server_name": "localhost",
+            "timeout": 5,
+            **config,
+        },
+    )
+
+
+def test_tls_round_trip(certs, tmp_path):
+    port, thread, errors = agent(certs("agent"))
+    client = node(port, certs("controller"), tmp_path / "secret").connect()
+    assert isinstance(client.sock, ssl.SSLSocket)
+    client.send({"command": "wg_stats"})
+    assert client.recv() == {"success": True, "data": "wg_stats"}
+    client.sock.close()
+    thread.join(5)
+    assert errors == []
+
+
+def test_tls_rejects_unknown_controller(certs, tmp_path):
+    port, thread, errors = agent(certs("agent"))
+    intruder = {**certs("intruder"), "tls_ca": certs("agent")["tls_ca"]}
+    with pytest.raises((ssl.SSLError, ConnectionError)):
+        node(port, intruder, tmp_path / "secret").connect()
+    thread.join(5)
+    assert isinstance(errors[0], ssl.SSLError)
+
+
+def test_tcp_requires_tls(tmp_path):
+    with pytest.raises(ValueError, match="tls_cert"):
+        node(4242, {}, tmp_path / "secret")
+
+
+def test_stalled_handshake_does_not_block(tmp_path):
+    address = f"unix:{tmp_path / 'agent.sock'}"
+    acceptor = Acceptor(listen(address), secret, timeout=5)
+    acceptor.start()
+    stalled = socket.socket(socket.AF_UNIX)
+    stalled.connect(str(tmp_path / "agent.sock"))
+
+    client = socket.socket(socket.AF_UNIX)
+    client.connect(str(tmp_path / "agent.sock"))
+    authenticate(client, secret)
+    readable, _, _ = select.select([acceptor.ready], [], [], 2)
+    assert readable
+    conn = acceptor.accept()
+    assert conn is not None
+    client.sendall(b"ping")
+    assert recv_exact(conn, 4) == b"ping"
+    for sock in (stalled, client, conn):
+        sock.close()
+
+
+def run_agent(address: str, wg_dir: str, fail: bool):
+    """
+    Agent process whose commands run nothing, netstart fails with `fail`.
+    """
+    from autopeer import peer_manager
+    from autopeer.executor import FakeExecutor
+    from autopeer.nodes import serve
+
+    def handler(args):
+        failed = args[0] == "/sbin/ifconfig" or (fail and args[0] == "/bin/sh")
+        return subprocess.CompletedProcess(args, int(failed), b"", b"netstart failed")
+
+    key = os.path.join(wg_dir, "private.key")
+    with open(key, "w") as f:
+        f.write("PRIVATEKEY=\n")
+    peer_manager.wg_dir = wg_dir
+    serve(address, secret, executor=FakeExecutor(handler), wgkey_file=key)
+
+
+@pytest.fixture
+def agents(tmp_path):
+    """
+    Agent processes "a" and "b", the latter failing to create interfaces,
+    and the address of "c" where no agent listens.
+    """
+    context = multiprocessing.get_context("fork")
+    procs, addresses = [], {}
+    for name in ("a", "b", "c"):
+        addresses[name] = f"unix:{tmp_path / name}.sock"
+        if name == "c":
+            continue
+        wg_dir = tmp_path / name
+        wg_dir.mkdir()
+        proc = context.Process(
+            target=run_agent, args=(addresses[name], str(wg_dir), name == "b")
+        )
+        proc.start()
+        procs.append(proc)
+    deadline = time.monotonic() + 10
+    while not all(os.path.exists(tmp_path / f"{n}.sock") for n in "ab"):
+        assert time.monotonic() < deadline, "agents did not start"
+        time.sleep(0.05)
+    yield addresses
+    for proc in procs:
+        proc.kill()
+        proc.join()
+
+
+def test_dispatch_to_agents(agents, tmp_path):
+    secret_file = tmp_path / "secret"
+    secret_file.write_bytes(secret)
+    nodes = NodeRegistry(
+        [
+            Node.from_config(
+                name,
+                {
+                    "address": address,
+                    "secret_file": str(secret_file),
+                    "inet": "172.22.109.97",
+                    "inet6": "fe80::4242",
+                    "timeout": 5,
+                },
+            )
+            for name, address in agents.items()
+        ]
+    )
+    peer = PeerInfo(**sample_peer).model_dump_json()
+    results = nodes.dispatch(
+        lambda node: {"command": "wg_create", "peer": peer, "node": node.allocation(3)}
+    )
+    assert results["a"] == {"success": True}
+    assert results["b"]["success"] is False
+    assert results["c"]["success"] is False
+    assert NodeRegistry.failed(results) == ["b", "c"]
+    assert (tmp_path / "a" / "wg3.conf").exists()
+
+    # every node answers on its own channel, concurrently
+    results = nodes.dispatch({"command": "exec_stats"})
+    assert NodeRegistry.failed(results) == ["c"]
+    assert results["a"]["stats"]["/bin/sh"]["count"] == 1
@@ -0,0 +1,24 @@
+import asyncio
+
+from autopeer.events import EventLog
+from autopeer.peer_cache import PeerCache
+
+
+def test_follow_invalidates_other_workers_changes(tmp_path):
+    path = str(tmp_path / "events.log")
+    other = EventLog(path)
+    cache = PeerCache()
+
+    async def run():
+        cache.put(4242420001, 1, {"peer": "old"})
+        cache.put(4242420002, 1, {"peer": "unchanged"})
+        cache.start(EventLog(path, interval=0.01))
+        await asyncio.sleep(0.05)
+        other.record("job", 4242420001, job=1, command="create", state="done")
+        other.flush()
+        await asyncio.sleep(0.05)
+        await cache.stop()
+
+    asyncio.run(run())
+    assert cache.get(4242420001) is None
+    assert cache.get(4242420002) is not None
@@ -0,0 +1,75 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from autopeer import peer_manager
+from autopeer.configtest import sample_peer
+from autopeer.executor import FakeExecutor
+from autopeer.peer_manager import PeerManager
+from autopeer.schemas import PeerInfo
+
+node = {"wgid": 3, "wgport": 20003, "inet": "172.22.109.97", "inet6": "fe80::4242"}
+
+
+@pytest.fixture
+def pm(tmp_path, monkeypatch):
+    """
+    Peer manager running no commands, `ifconfig wgN` succeeds for the
+    interfaces in `pm.interfaces`.
+    """
+    interfaces = set()
+
+    def handler(args):
+        missing = args[0] == "/sbin/ifconfig" and args[1] not in interfaces
+        return subprocess.CompletedProcess(args, int(missing), b"", b"")
+
+    key = tmp_path / "private.key"
+    key.write_text("PRIVATEKEY=\n")
+    monkeypatch.setattr(peer_manager, "wg_dir", str(tmp_path))
+    pm = PeerManager(None, executor=FakeExecutor(handler), wgkey_file=str(key))
+    pm.interfaces = interfaces
+    return pm
+
+
+def wg_create(pm, **fields):
+    peer = PeerInfo(**{**sample_peer, **fields}).model_dump_json()
+    return pm.handle({"command": "wg_create", "peer": peer, "node": node})
+
+
+def test_wg_create_new_interface(pm, tmp_path):
+    assert wg_create(pm) == {"success": True}
+    assert pm.executor.commands == [
+        ["/sbin/ifconfig", "wg3"],
+        ["/bin/sh", "/etc/netstart", "wg3"],
+    ]
+    assert "wgkey PRIVATEKEY=" in (tmp_path / "wg3.conf").read_text()
+
+
+def test_wg_create_updates_existing_interface(pm, tmp_path):
+    pm.interfaces.add("wg3")
+    pubkey = "B" * 43 + "="
+    assert wg_create(pm, peer_pubkey=pubkey) == {"success": True}
+    assert pm.executor.commands == [
+        ["/sbin/ifconfig", "wg3"],
+        ["/sbin/ifconfig", "wg3", "-wgpeerall"],
+        ["/bin/sh", "/etc/netstart", "wg3"],
+    ]
+    assert f"wgpeer {pubkey}" in (tmp_path / "wg3.conf").read_text()
+    # repeating it changes nothing
+    assert wg_create(pm, peer_pubkey=pubkey) == {"success": True}
+
+
+def test_profile_ignores_requested_path(pm, tmp_path):
+    pm.profile_dir = str(tmp_path / "profiles")
+    cmd = {"command": "profile", "duration": 0, "path": "/etc/rc.collapsed"}
+    resp = pm.handle(cmd)
+    assert resp["success"]
+    assert os.path.dirname(resp["path"]) == pm.profile_dir
+    assert resp["path"].endswith(".collapsed")
+    deadline = time.monotonic() + 5
+    while not os.path.exists(resp["path"]) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert os.path.exists(resp["path"])
+    assert not os.path.exists("/etc/rc.collapsed")
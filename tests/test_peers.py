@@ -0,0 +1,77 @@
+import sqlalchemy as db
+
+from autopeer import models, peers
+from autopeer.configtest import sample_peer
+from autopeer.nodes import NodeRegistry
+from autopeer.schemas import PeerInfo
+
+
+def test_no_write_transaction_during_dispatch(settings, registry):
+    # a second writer only waits briefly for the lock, as a concurrent
+    # request would
+    engine = db.create_engine(
+        f"sqlite:///{settings.database}", connect_args={"timeout": 0.1}
+    )
+
+    def handler(cmd):
+        with engine.begin() as conn:
+            conn.execute(db.text("DELETE FROM job"))
+        return {"success": True}
+
+    with settings.session_local() as session:
+        results = peers.create_peer(session, registry(handler), PeerInfo(**sample_peer))
+        assert not NodeRegistry.failed(results)
+        assert session.get(models.PeerInfo, sample_peer["ASN"]) is not None
+
+
+def test_rejected_peer_is_reverted(settings, registry):
+    ok = registry(lambda cmd: {"success": True})
+    rejected = registry(
+        lambda cmd: {"success": cmd["command"] != "wg_create", "error": "no"}
+    )
+    with settings.session_local() as session:
+        results = peers.create_peer(session, rejected, PeerInfo(**sample_peer))
+        assert NodeRegistry.failed(results) == ["a", "b"]
+        assert session.get(models.PeerInfo, sample_peer["ASN"]) is None
+        assert session.query(models.NodePeer).count() == 0
+
+        peers.create_peer(session, ok, PeerInfo(**sample_peer))
+        new = PeerInfo(**{**sample_peer, "description": "updated"})
+        peers.create_peer(session, rejected, new)
+        session.expire_all()
+        peer = session.get(models.PeerInfo, sample_peer["ASN"])
+        assert peer.description == "configtest"
+        assert session.query(models.NodePeer).count() == 2
+
+
+def test_partial_failure(settings, registry, make_peer):
+    sent = {"a": [], "b": []}
+
+    def node(name, accept=True):
+        def handler(cmd):
+            sent[name].append(cmd)
+            if cmd["command"] == "bgp_update":
+                asns = [PeerInfo.model_validate_json(p).ASN for p in cmd["peers"]]
+                return {"success": True, "peers": asns}
+            return {"success": accept, "error": "rejected"}
+
+        return handler
+
+    alice, bob = PeerInfo(**make_peer(1)), PeerInfo(**make_peer(2))
+    with settings.session_local() as session:
+        nodes = registry({"a": node("a"), "b": node("b", accept=False)})
+        results = peers.create_peer(session, nodes, alice)
+        assert NodeRegistry.failed(results) == ["b"]
+        assert results["a"]["peers"] == [alice.ASN]
+        # the rejecting node does not get the BGP session
+        assert [cmd["command"] for cmd in sent["b"]] == ["wg_create"]
+        assert list(peers.allocations(session, nodes, alice.ASN)) == ["a"]
+
+        # nor with the next peer, until it accepts the interface
+        nodes = registry({"a": node("a"), "b": node("b")})
+        results = peers.create_peer(session, nodes, bob)
+        assert results["a"]["peers"] == [alice.ASN, bob.ASN]
+        assert results["b"]["peers"] == [bob.ASN]
+        results = peers.create_peer(session, nodes, alice)
+        assert results["b"]["peers"] == [alice.ASN, bob.ASN]
+        assert list(peers.allocations(session, nodes, alice.ASN)) == ["a", "b"]
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from autopeer.profiler import Sampler, Tracer, current, stage
+
+
+def test_stages_of_traced_request():
+    with stage("outside"):
+        pass
+    trace = {}
+    token = current.set(trace)
+    try:
+        for _ in range(2):
+            with stage("db"):
+                time.sleep(0.01)
+    finally:
+        current.reset(token)
+    assert list(trace) == ["db"]
+    assert trace["db"] >= 20
+
+
+def test_tracer_keeps_slow_requests():
+    tracer = Tracer(threshold=100, keep=2)
+    tracer.finish("GET", "/fast", 99.9, {"db": 50})
+    assert not tracer.slow
+
+    tracer.finish("POST", "/peer/create", 250.04, {"db": 100.04, "token": 50})
+    (slow,) = tracer.slow
+    assert slow["method"] == "POST"
+    assert slow["path"] == "/peer/create"
+    assert slow["total_ms"] == 250.0
+    # the time outside of the timed stages is reported as well
+    assert slow["stages"] == {"db": 100.0, "token": 50.0, "other": 100.0}
+
+    # stages overlapping each other never make it negative
+    tracer.finish("GET", "/a", 100, {"a": 80, "b": 80})
+    assert tracer.slow[-1]["stages"]["other"] == 0
+    tracer.finish("GET", "/b", 100, {})
+    assert [s["path"] for s in tracer.slow] == ["/a", "/b"]
+
+
+def spin(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy():
+    stop = threading.Event()
+    thread = threading.Thread(target=spin, args=(stop,), name="busy")
+    thread.start()
+    yield
+    stop.set()
+    thread.join()
+
+
+def test_profile_writes_collapsed_stacks(busy, tmp_path):
+    path = tmp_path / "profiles" / "webapp.folded"
+    result = Sampler(interval=0.001).profile(0.1, str(path))
+    assert result["path"] == str(path)
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == result["stacks"]
+    counts = [int(line.rpartition(" ")[2]) for line in lines]
+    assert sum(counts) == result["samples"]
+    assert counts == sorted(counts, reverse=True)
+    # root first, each frame with its location
+    frames = [line.rpartition(" ")[0].split(";") for line in lines]
+    busy = [f for f in frames if f[0] == "busy"]
+    assert busy
+    assert all(
+        any(name.startswith("spin (test_profiler.py:") for name in f) for f in busy
+    )
+
+
+def test_one_profile_at_a_time(tmp_path):
+    sampler = Sampler()
+    sampler.start(0.2, str(tmp_path / "first.folded"))
+    while not sampler.lock.locked():
+        time.sleep(0.001)
+    with pytest.raises(RuntimeError, match="already running"):
+        sampler.profile(0.1, str(tmp_path / "second.folded"))
+    with pytest.raises(RuntimeError, match="already running"):
+        sampler.start(0.1, str(tmp_path / "second.folded"))
+    deadline = time.monotonic() + 5
+    while sampler.lock.locked():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert (tmp_path / "first.folded").exists()
+    assert not (tmp_path / "second.folded").exists()
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from autopeer.registry_snapshot import RegistrySnapshot, compile_snapshot
+
+fingerprint = "0123456789ABCDEF0123456789ABCDEF01234567"
+
+
+def write(registry, path: str, *lines: str):
+    (registry / path).write_text("".join(f"{line}\n" for line in lines))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    """
+    Registry with AS4242420001 and AS4242420002 sharing a person and a
+    maintainer whose first auth attribute has no value.
+    """
+    registry = tmp_path / "registry"
+    for d in ("aut-num", "person", "mntner"):
+        (registry / "data" / d).mkdir(parents=True)
+    for asn in (4242420001, 4242420002):
+        write(
+            registry,
+            f"data/aut-num/AS{asn}",
+            f"aut-num:            AS{asn}",
+            "tech-c:             EXAMPLE-DN42",
+            "mnt-by:             EXAMPLE-MNT",
+        )
+    write(registry, "data/person/EXAMPLE-DN42", "e-mail:             peer@example.com")
+    write(
+        registry,
+        "data/mntner/EXAMPLE-MNT",
+        "auth:",
+        "auth:               ssh-ed25519 AAAA",
+        f"auth:               pgp-fingerprint {fingerprint}",
+    )
+    return registry
+
+
+def test_compile_and_lookup(registry, tmp_path):
+    path = str(tmp_path / "registry.snapshot")
+    assert compile_snapshot(str(registry), path) == 2
+    snapshot = RegistrySnapshot(str(registry), path)
+    assert snapshot.lookup(4242420001) == ("peer@example.com", fingerprint)
+    assert snapshot.lookup(4242420002) == ("peer@example.com", fingerprint)
+    assert snapshot.lookup(4242420003) is None
+
+
+def test_malformed_objects_do_not_stop_compiling(registry, tmp_path):
+    write(registry, "data/aut-num/AS4242420003", "tech-c:", "mnt-by:   BINARY-MNT")
+    (registry / "data/mntner/BINARY-MNT").write_bytes(b"auth: \xff\xfe\n")
+    path = str(tmp_path / "registry.snapshot")
+    assert compile_snapshot(str(registry), path) == 3
+    snapshot = RegistrySnapshot(str(registry), path)
+    assert snapshot.lookup(4242420003) == ("", "")
+    assert snapshot.lookup(4242420001) == ("peer@example.com", fingerprint)
+
+
+def test_refresh_only_when_registry_changed(registry, tmp_path):
+    path = str(tmp_path / "registry.snapshot")
+    snapshot = RegistrySnapshot(str(registry), path, check_interval=0)
+    assert snapshot.refresh()
+    assert not snapshot.refresh()
+    assert snapshot.email(4242420001) == "peer@example.com"
+
+    write(registry, "data/person/EXAMPLE-DN42", "e-mail:   new@example.com")
+    os.utime(registry / "data/person/EXAMPLE-DN42", ns=(0, 0))
+    assert snapshot.refresh()
+    # the replaced snapshot is mapped on the next lookup
+    assert snapshot.email(4242420001) == "new@example.com"
+
+
+def test_fallback_to_registry(registry, tmp_path):
+    path = str(tmp_path / "registry.snapshot")
+    snapshot = RegistrySnapshot(str(registry), path)
+    # no snapshot yet
+    assert snapshot.email(4242420001) == "peer@example.com"
+    assert snapshot.pgp_fingerprint(4242420001) == fingerprint
+
+    compile_snapshot(str(registry), path)
+    write(
+        registry,
+        "data/aut-num/AS4242420003",
+        "tech-c:             EXAMPLE-DN42",
+        "mnt-by:             EXAMPLE-MNT",
+    )
+    # added after the snapshot was compiled
+    snapshot = RegistrySnapshot(str(registry), path)
+    assert snapshot.lookup(4242420003) is None
+    assert snapshot.email(4242420003) == "peer@example.com"
@@ -0,0 +1,86 @@
+import os
+from typing import Optional
+
+import pytest
+
+from autopeer.roa import RoaGenerator
+
+
+def route(
+    registry, name: str, prefix: str, *origins: str, maxlen: Optional[int] = None
+):
+    d = registry / ("data/route6" if ":" in prefix else "data/route")
+    key = "route6" if ":" in prefix else "route"
+    lines = [f"{key}:              {prefix}"]
+    lines += [f"origin:             {origin}" for origin in origins]
+    if maxlen is not None:
+        lines.append(f"max-length:         {maxlen}")
+    path = d / name
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.fixture
+def registry(tmp_path):
+    for d in ("data/route", "data/route6"):
+        (tmp_path / d).mkdir(parents=True)
+    return tmp_path
+
+
+def test_incremental_refresh(registry, tmp_path):
+    route(registry, "172.20.0.0_24", "172.20.0.0/24", "AS4242420001", maxlen=28)
+    route(registry, "fd00::_48", "fd00::/48", "AS4242420001", "AS4242420002")
+    output = tmp_path / "roa-obgp.conf"
+    roa = RoaGenerator(str(registry), str(output))
+
+    stats = roa.update()
+    assert (stats["objects"], stats["parsed"], stats["entries"]) == (2, 2, 3)
+    assert stats["changed"]
+    assert output.read_text() == (
+        "roa-set {\n"
+        "\t172.20.0.0/24 maxlen 28 source-as 4242420001\n"
+        "\tfd00::/48 maxlen 48 source-as 4242420001\n"
+        "\tfd00::/48 maxlen 48 source-as 4242420002\n"
+        "}\n"
+    )
+
+    # nothing changed, nothing is parsed or written
+    mtime = output.stat().st_mtime_ns
+    stats = roa.update()
+    assert (stats["parsed"], stats["changed"]) == (0, False)
+    assert output.stat().st_mtime_ns == mtime
+
+    # only the new and the modified objects are parsed
+    route(registry, "172.20.1.0_24", "172.20.1.0/24", "AS4242420003")
+    path = route(registry, "fd00::_48", "fd00::/48", "AS4242420001")
+    os.utime(path, ns=(0, 0))
+    stats = roa.update()
+    assert (stats["objects"], stats["parsed"], stats["entries"]) == (3, 2, 3)
+    assert stats["changed"]
+    assert "source-as 4242420002" not in output.read_text()
+
+    # removed objects are dropped without parsing anything
+    os.unlink(registry / "data/route/172.20.1.0_24")
+    stats = roa.update()
+    assert (stats["objects"], stats["parsed"], stats["entries"]) == (2, 0, 2)
+    assert "172.20.1.0/24" not in output.read_text()
+
+
+def test_existing_output_is_kept(registry, tmp_path):
+    route(registry, "172.20.0.0_24", "172.20.0.0/24", "AS4242420001")
+    output = tmp_path / "roa-obgp.conf"
+    RoaGenerator(str(registry), str(output)).update()
+    mtime = output.stat().st_mtime_ns
+
+    # a restarted generator compares with the file it wrote before
+    stats = RoaGenerator(str(registry), str(output)).update()
+    assert (stats["parsed"], stats["changed"]) == (1, False)
+    assert output.stat().st_mtime_ns == mtime
+    assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".roa")] == []
+
+
+def test_invalid_object_is_skipped(registry, tmp_path):
+    route(registry, "172.20.0.0_24", "172.20.0.0/24", "AS4242420001")
+    route(registry, "bad", "172.20.0.0/33", "AS4242420002")
+    stats = RoaGenerator(str(registry), str(tmp_path / "roa-obgp.conf")).update()
+    assert (stats["objects"], stats["entries"]) == (2, 1)
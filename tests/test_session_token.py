@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from autopeer.session_token import TokenSigner
+
+asn = 4242420001
+
+
+def test_token_round_trip():
+    signer = TokenSigner(b"k" * 32)
+    signer.verify(asn, signer.issue(asn))
+
+
+def test_expired_token(monkeypatch):
+    signer = TokenSigner(b"k" * 32, ttl=5)
+    token = signer.issue(asn)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 6)
+    with pytest.raises(ValueError, match="expired"):
+        signer.verify(asn, token)
+
+
+def test_replayed_token():
+    signer = TokenSigner(b"k" * 32)
+    token = signer.issue(asn)
+    signer.verify(asn, token)
+    with pytest.raises(ValueError, match="already used"):
+        signer.verify(asn, token)
+
+    reusable = TokenSigner(b"k" * 32, single_use=False)
+    token = reusable.issue(asn)
+    reusable.verify(asn, token)
+    reusable.verify(asn, token)
+
+
+@pytest.mark.parametrize(
+    "tamper",
+    [
+        lambda t: t.replace(str(asn), str(asn + 1), 1),
+        lambda t: t.rpartition(".")[0] + ".AAAA",
+        lambda t: t.rpartition(".")[0],
+        lambda t: "not a token",
+    ],
+)
+def test_tampered_token(tamper):
+    signer = TokenSigner(b"k" * 32)
+    with pytest.raises(ValueError, match="invalid"):
+        signer.verify(asn, tamper(signer.issue(asn)))
+
+
+def test_token_of_other_asn_or_key():
+    signer = TokenSigner(b"k" * 32)
+    with pytest.raises(ValueError, match="invalid"):
+        signer.verify(asn + 1, signer.issue(asn))
+    with pytest.raises(ValueError, match="invalid"):
+        signer.verify(asn, TokenSigner(b"x" * 32).issue(asn))
+
+
+def test_nonces_are_bounded(monkeypatch):
+    signer = TokenSigner(b"k" * 32, ttl=5, max_nonces=2)
+    for _ in range(2):
+        signer.verify(asn, signer.issue(asn))
+    with pytest.raises(ValueError, match="Too many"):
+        signer.verify(asn, signer.issue(asn))
+
+    # expired nonces make room again
+    token = signer.issue(asn)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 6)
+    signer.verify(asn, signer.issue(asn))
+    assert len(signer.nonces) == 1
+    with pytest.raises(ValueError, match="expired"):
+        signer.verify(asn, token)
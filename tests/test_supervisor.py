@@ -0,0 +1,66 @@
+import socket
+import subprocess
+import threading
+
+import pytest
+
+from autopeer.client import PeerManagerClient
+from autopeer.executor import FakeExecutor
+from autopeer.peer_manager import PeerManager
+from autopeer.supervisor import receive_channel, send_channel
+
+
+def test_channel_passing():
+    control, theirs = socket.socketpair()
+    ours, channel = socket.socketpair()
+    send_channel(control, channel)
+    channel.close()
+
+    received = receive_channel(theirs)
+    ours.sendall(b"ping")
+    assert received.recv(4) == b"ping"
+
+    # a message without a descriptor adds no channel
+    control.sendall(b"c")
+    assert receive_channel(theirs) is None
+
+    control.close()
+    with pytest.raises(ConnectionError):
+        receive_channel(theirs)
+    for sock in (ours, received, theirs):
+        sock.close()
+
+
+def test_peer_manager_serves_passed_channels(tmp_path):
+    def handler(args):
+        return subprocess.CompletedProcess(args, 0, b"", b"")
+
+    key = tmp_path / "private.key"
+    key.write_text("PRIVATEKEY=\n")
+    pm = PeerManager(None, executor=FakeExecutor(handler), wgkey_file=str(key))
+    control, listener = socket.socketpair()
+    thread = threading.Thread(
+        target=pm.run, args=(listener, lambda: receive_channel(listener))
+    )
+    thread.start()
+
+    # one channel per worker, as handed out by Supervisor.spawn
+    clients = []
+    for _ in range(2):
+        ours, theirs = socket.socketpair()
+        send_channel(control, ours)
+        ours.close()
+        clients.append(PeerManagerClient(theirs))
+    for client in clients:
+        assert client.request({"command": "exec_stats"})["success"]
+
+    # a worker exiting does not stop the peer manager
+    clients[0].sock.close()
+    assert clients[1].request({"command": "exec_stats"})["success"]
+
+    # the supervisor closing the control socket does
+    control.close()
+    thread.join(5)
+    assert not thread.is_alive()
+    clients[1].sock.close()
+    listener.close()
@@ -0,0 +1,38 @@
+import re
+
+import pytest
+
+from autopeer.configtest import sample_peer
+from autopeer.peer_manager import bgpd_config, wg_config
+from autopeer.schemas import PeerInfo
+
+node = {"wgid": 3, "wgport": 20003, "inet": "172.22.109.97", "inet6": "fe80::4242"}
+
+
+def test_wg_config_sets_every_field():
+    peer = PeerInfo(**sample_peer)
+    data = wg_config(peer, node, "PRIVATEKEY=", rdomain=2, mtu=1400)
+
+    assert "None" not in data
+    assert not re.search(r"  |\s$", data.replace("\n", "")), data
+    assert "wgkey PRIVATEKEY=" in data
+    assert f"wgpeer {peer.peer_pubkey} wgpsk {peer.peer_psk}" in data
+    assert f"wgendpoint {peer.peer_ip} {peer.peer_port}" in data
+    assert "rdomain 2" in data and "mtu 1400" in data
+    assert f"{peer.ll_ip6} fe80::4242%wg3" in data
+
+
+def test_wg_config_requires_allocation():
+    peer = PeerInfo(**sample_peer)
+    with pytest.raises(ValueError, match="inet"):
+        wg_config(peer, {**node, "inet": None}, "PRIVATEKEY=")
+
+
+def test_bgpd_config_sets_asn_and_router_id():
+    peer = PeerInfo(**sample_peer)
+    data = bgpd_config([peer], 4242420000, "172.22.109.97")
+
+    assert 'ASN="4242420000"' in data
+    assert "router-id 172.22.109.97" in data
+    assert "listen on 172.22.109.97 port 179" in data
+    assert f'P1_asn="{peer.ASN}"' in data
@@ -0,0 +1,36 @@
+from autopeer import models
+from autopeer.configtest import sample_peer
+from autopeer.schemas import PeerInfo
+from autopeer.validation import PeerIndex, PeerValidator
+
+
+def test_missing_psk():
+    peer = PeerInfo(**{**sample_peer, "peer_psk": None})
+    errors = PeerValidator(PeerIndex()).validate("line 1", peer)
+    assert errors == ["line 1: peer_psk is required"]
+
+
+def test_conflicts_within_batch():
+    validator = PeerValidator(PeerIndex())
+    other = {**sample_peer, "ASN": 4242420002, "peer_port": 20002}
+    valid, errors = validator.validate_batch(
+        [("line 1", PeerInfo(**sample_peer)), ("line 2", PeerInfo(**other))]
+    )
+    assert [p.ASN for p in valid] == [4242420001]
+    assert "line 2: peer_ip 192.0.2.1 is already used by line 1" in errors
+
+
+def test_lookup_reads_only_conflicting_peers(settings, make_peer):
+    with settings.session_local() as session:
+        for n in (1, 2, 3):
+            session.add(models.PeerInfo(**make_peer(n)))
+        session.commit()
+        peer = PeerInfo(**make_peer(4, peer_port=20002, ll_ip6="fe80:0::3"))
+        index = PeerIndex.lookup(session, [peer])
+        assert sorted(index.values) == [4242420002, 4242420003]
+        errors = PeerValidator(index).validate("line 1", peer)
+        assert errors == PeerValidator(PeerIndex.load(session)).validate("line 1", peer)
+        assert errors == [
+            "line 1: peer_port 20002 is already used by AS4242420002",
+            "line 1: ll_ip6 fe80:0::3 is already used by AS4242420003",
+        ]
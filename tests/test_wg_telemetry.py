@@ -0,0 +1,117 @@
+import subprocess
+import time
+
+from autopeer import models
+from autopeer.executor import FakeExecutor
+from autopeer.jobs import JobQueue
+from autopeer.webapp import reap_stale_peers
+from autopeer.wg_telemetry import WGTelemetry
+
+listing = """\
+wg0: flags=80c3<UP,BROADCAST,RUNNING,NOARP,MULTICAST> mtu 1420
+\tindex 5 priority 0 llprio 3
+\twgport 20000
+\twgpubkey LOCALKEY=
+\twgpeer ALICE=
+\t\twgpsk (present)
+\t\twgendpoint 192.0.2.1 20001
+\t\ttx: 1200, rx: 3400
+\t\tlast handshake: 30 seconds ago
+\t\twgaip 172.20.0.0/14
+\tgroups: wg
+\tinet 172.22.109.97 --> 169.254.0.1 netmask 0xffffffff
+wg1: flags=80c3<UP,BROADCAST,RUNNING,NOARP,MULTICAST> mtu 1420
+\twgport 20001
+\twgpeer BOB=
+\t\twgendpoint 192.0.2.2 20002
+\t\ttx: 0, rx: 0
+\t\twgaip fd00::/8
+"""
+
+
+def test_parse():
+    samples = WGTelemetry.parse(listing.splitlines(), 100.0)
+    assert set(samples) == {"ALICE=", "BOB="}
+    alice = samples["ALICE="]
+    assert (alice.interface, alice.tx, alice.rx) == ("wg0", 1200, 3400)
+    assert alice.handshake_age == 30
+    bob = samples["BOB="]
+    assert (bob.interface, bob.handshake_age) == ("wg1", None)
+
+
+def collected(output: str) -> WGTelemetry:
+    def handler(args):
+        return subprocess.CompletedProcess(args, 0, output.encode(), b"")
+
+    telemetry = WGTelemetry(executor=FakeExecutor(handler))
+    telemetry.collect()
+    return telemetry
+
+
+def test_stale():
+    telemetry = collected(listing)
+    assert telemetry.stale(60) == []
+    # the handshake ages, without one the interface age counts
+    assert telemetry.stale(20) == ["ALICE="]
+    telemetry.first_seen["BOB="] -= 100
+    assert sorted(telemetry.stale(60)) == ["BOB="]
+    assert len(telemetry.stats("ALICE=")) == 1
+
+
+def test_removed_interface_is_forgotten():
+    telemetry = collected(listing)
+    telemetry.executor.handler = lambda args: subprocess.CompletedProcess(
+        args, 0, listing.split("wg1:")[0].encode(), b""
+    )
+    telemetry.collect()
+    assert set(telemetry.series) == {"ALICE="}
+    assert telemetry.stats("BOB=") == []
+
+
+class Events:
+    def __init__(self) -> None:
+        self.recorded = []
+
+    def record(self, event, asn, **fields):
+        self.recorded.append((event, asn))
+
+
+def test_reap_queues_deletes(settings, registry, make_peer):
+    settings.stale_gc = True
+    alice, bob = make_peer(1), make_peer(2)
+    with settings.session_local() as session:
+        session.add(models.PeerInfo(**alice))
+        session.add(models.PeerInfo(**bob))
+        session.commit()
+
+    # with a job pending a peer is kept
+    stale = [alice["peer_pubkey"], bob["peer_pubkey"]]
+    nodes = registry(lambda cmd: {"success": True, "stale": stale})
+    jobs = JobQueue(settings, nodes)
+    events = Events()
+    with settings.session_local() as session:
+        jobs.submit(session, "create", bob["ASN"])
+    reap_stale_peers(settings, nodes, jobs, events)
+
+    with settings.session_local() as session:
+        queued = session.query(models.Job).order_by(models.Job.id).all()
+        assert [(j.command, j.ASN) for j in queued] == [
+            ("create", bob["ASN"]),
+            ("delete", alice["ASN"]),
+        ]
+        # nothing is deleted before the job runs
+        assert session.query(models.PeerInfo).count() == 2
+    assert events.recorded == [("reap", alice["ASN"])]
+
+    # only stale on some of the nodes
+    with settings.session_local() as session:
+        session.query(models.Job).update({"state": "done"})
+        session.commit()
+    nodes = registry(
+        {
+            "a": lambda cmd: {"success": True, "stale": stale},
+            "b": lambda cmd: {"success": True, "stale": []},
+        }
+    )
+    reap_stale_peers(settings, nodes, jobs, events)
+    assert len(events.recorded) == 1